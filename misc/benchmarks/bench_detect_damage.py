@@ -0,0 +1,50 @@
+'''Benchmark for signal_processor.detect_damage_analytically.
+
+Times the detector on synthetic mono float32 audio from 10 seconds up to
+60 minutes and prints the cost per minute of audio, which should stay flat
+if the run time grows linearly with recording length.
+
+Run from the repository root:
+    python misc/benchmarks/bench_detect_damage.py [sample_rate]
+'''
+
+import sys
+import time
+import numpy as np
+
+sys.path.append('src')
+import signal_processor as processor
+
+
+DURATIONS_SECONDS = [10, 60, 5 * 60, 20 * 60, 60 * 60]
+
+
+def make_audio(num_samples: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    audio = rng.standard_normal(num_samples, dtype=np.float32)
+    audio *= 0.05
+    return audio
+
+
+def main():
+
+    sample_rate = int(sys.argv[1]) if len(sys.argv) > 1 else 48000
+
+    print('sample rate: {} Hz'.format(sample_rate))
+    print('{:>10}   {:>12}   {:>10}   {:>14}'.format('duration', 'samples', 'time (s)', 'ms / audio min'))
+
+    for duration in DURATIONS_SECONDS:
+        audio = make_audio(duration * sample_rate)
+
+        begin = time.perf_counter()
+        processor.detect_damage_analytically(audio, sample_rate)
+        elapsed = time.perf_counter() - begin
+
+        print('{:>9}s   {:>12}   {:>10.3f}   {:>14.2f}'.format(
+            duration, len(audio), elapsed, 1000 * elapsed / (duration / 60)))
+
+        del audio
+
+
+if __name__ == '__main__':
+    main()
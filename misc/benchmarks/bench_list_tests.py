@@ -0,0 +1,106 @@
+'''Benchmark for listing test metadata from the database.
+
+Fills a temporary database with 10,000 tests and 50 tags (5 tags per test)
+and times listing every test and filtering by tags with
+DatabaseManager.list_tests, against the previous per-test loading loop
+(one query per test and per tag, with a linear duplicate check).
+
+Run from the repository root:
+    python misc/benchmarks/bench_list_tests.py [num_tests] [num_tags]
+'''
+
+import os
+import sys
+import time
+import random
+import datetime
+import tempfile
+
+sys.path.append('src')
+import settings
+import storage
+
+
+TAGS_PER_TEST = 5
+
+
+def populate(manager: storage.DatabaseManager, num_tests: int, num_tags: int):
+
+    rng = random.Random(0)
+    tag_values = ['tag_{}'.format(i) for i in range(num_tags)]
+
+    with manager.transaction() as con:
+        tag_ids = [storage._create_tag(con, value) for value in tag_values]
+        for i in range(num_tests):
+            test_id, _ = storage._create_test(con, 'test_{}'.format(i), datetime.datetime.now(), 'notes')
+            for tag_id in rng.sample(tag_ids, TAGS_PER_TEST):
+                storage._create_tag_link(con, test_id, tag_id)
+
+    return tag_values
+
+
+def previous_list_all(manager: storage.DatabaseManager):
+    '''Listing as the GUI did before: one metadata load per test id.'''
+
+    with manager.transaction() as con:
+        tests = []
+        for test_id in storage._read_all_test_ids(con):
+            test_row = storage._read_test_by_id(con, test_id)
+            test = storage.TestEntry(id=test_row[0], name=test_row[1], creation_date=test_row[2],
+                                     notes=test_row[3], data_file_path=test_row[4])
+            test.tags = [storage._read_tag_value_by_tag_id(con, tag_id)
+                         for tag_id in storage._read_linked_tag_ids_by_test_id(con, test_id) or []]
+            tests.append(test)
+    return tests
+
+
+def previous_list_by_tags(manager: storage.DatabaseManager, tags: list[str]):
+    '''list_tests_by_tags as it was: per tag, per linked test, with a linear
+    duplicate check.'''
+
+    tests = []
+    with manager.transaction() as con:
+        all_tests = {test.id: test for test in previous_list_all(manager)}
+        for tag in tags:
+            for test_id in storage._read_test_ids_linked_to_tag(con, tag) or []:
+                test = all_tests[test_id]
+                if test not in tests: tests.append(test)
+    return tests
+
+
+def timed(function, *args) -> float:
+    begin = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - begin
+
+
+def main():
+
+    num_tests = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_tags = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    original_location = settings.get_setting('save_location')
+    original_name = settings.get_setting('database_file_name')
+
+    with tempfile.TemporaryDirectory() as location:
+        storage.configure(save_location=location, database_file_name='bench.db')
+        manager = storage.DatabaseManager()
+
+        tag_values = populate(manager, num_tests, num_tags)
+        filter_tags = tag_values[:3]
+
+        print('{} tests, {} tags, {} tags per test'.format(num_tests, num_tags, TAGS_PER_TEST))
+        print('{:>22}   {:>12}   {:>12}'.format('', 'before (s)', 'joined (s)'))
+        print('{:>22}   {:>12.3f}   {:>12.3f}'.format('list all tests',
+                                                      timed(previous_list_all, manager),
+                                                      timed(manager.list_tests)))
+        print('{:>22}   {:>12.3f}   {:>12.3f}'.format('filter by 3 tags',
+                                                      timed(previous_list_by_tags, manager, filter_tags),
+                                                      timed(manager.list_tests_by_tags, filter_tags)))
+        manager.close()
+
+    storage.configure(save_location=original_location, database_file_name=original_name)
+
+
+if __name__ == '__main__':
+    main()
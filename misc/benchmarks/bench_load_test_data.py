@@ -0,0 +1,78 @@
+'''Benchmark for reading stored recordings.
+
+Saves a synthetic stereo float32 recording (20 minutes at 44.1 kHz by
+default) to a temporary storage location, then times loading it and
+reading 5 seconds from its middle, once read into memory and once
+memory-mapped, and reports how much the resident set grew each time.
+
+Run from the repository root:
+    python misc/benchmarks/bench_load_test_data.py [minutes] [sample_rate]
+'''
+
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.append('src')
+import settings
+import storage
+
+
+def resident_bytes() -> int:
+    '''Current resident set size (Linux only, 0 elsewhere).'''
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def load_and_play(path: str, sample_rate: int, mmap: bool):
+    '''Load the recording and touch the 5 seconds a short playback would.'''
+
+    before = resident_bytes()
+    begin = time.perf_counter()
+
+    data = storage._read_test_data_from_file(path, mmap=mmap)
+    middle = len(data.audio_data) // 2
+    excerpt = np.array(data.audio_channel(0)[middle:middle + 5 * sample_rate])
+
+    elapsed = time.perf_counter() - begin
+    grown = resident_bytes() - before
+    del data, excerpt
+    return elapsed, grown
+
+
+def main():
+
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 20
+    sample_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 44100
+
+    original_location = settings.get_setting('save_location')
+    original_name = settings.get_setting('database_file_name')
+
+    with tempfile.TemporaryDirectory() as location:
+        storage.configure(save_location=location, database_file_name='bench.db')
+
+        data = storage.DmgData()
+        data.audio_data = np.random.default_rng(0).standard_normal((int(minutes * 60 * sample_rate), 2),
+                                                                    dtype=np.float32)
+        data.trigger_data = np.zeros(len(data.audio_data))
+        data.sample_rate = sample_rate
+        storage._save_test_data_to_file('bench.dmg', data)
+        size = data.audio_data.nbytes
+        del data
+
+        print('{:.0f} min stereo float32 at {} Hz, {:.0f} MB of audio'.format(minutes, sample_rate, size / 1e6))
+        print('{:>10}   {:>10}   {:>16}'.format('', 'time (s)', 'resident (MB)'))
+        for label, mmap in [('mapped', True), ('read', False)]:
+            elapsed, grown = load_and_play('bench.dmg', sample_rate, mmap)
+            print('{:>10}   {:>10.3f}   {:>16.1f}'.format(label, elapsed, grown / 1e6))
+
+    storage.configure(save_location=original_location, database_file_name=original_name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+'''Benchmark for the resampling module against scipy.signal.resample.
+
+Compares, for recordings of increasing length:
+ - bringing a 1 kHz trigger to the 48 kHz audio length, as the old
+   sensors.match_signals did with an FFT resample, against zero-order-hold
+   interpolation
+ - converting stereo 44.1 kHz audio to 48 kHz, as the old
+   data_generation._match_signals did with an FFT resample, against the
+   polyphase resampler
+
+Run from the repository root:
+    python misc/benchmarks/bench_resampling.py
+'''
+
+import sys
+import time
+import numpy as np
+from scipy.signal import resample
+
+sys.path.append('src')
+import resampling
+
+
+DURATIONS_SECONDS = [10, 60, 5 * 60]
+
+
+def timed(function, *args, **kwargs) -> float:
+    begin = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - begin
+
+
+def main():
+
+    rng = np.random.default_rng(0)
+
+    print('trigger 1 kHz -> 48 kHz')
+    print('{:>10}   {:>12}   {:>12}'.format('duration', 'fft (s)', 'hold (s)'))
+    for duration in DURATIONS_SECONDS:
+        trigger = (rng.random(duration * 1000) > 0.5).astype(float)
+        num_frames = duration * 48000
+
+        fft_time = timed(resample, trigger, num_frames)
+        hold_time = timed(resampling.interpolate, trigger, 1000, 48000, num_frames, method='hold')
+
+        print('{:>9}s   {:>12.3f}   {:>12.3f}'.format(duration, fft_time, hold_time))
+
+    print('\nstereo audio 44.1 kHz -> 48 kHz')
+    print('{:>10}   {:>12}   {:>12}'.format('duration', 'fft (s)', 'poly (s)'))
+    for duration in DURATIONS_SECONDS:
+        audio = rng.standard_normal((duration * 44100, 2)).astype(np.float32)
+
+        fft_time = timed(resample, audio, duration * 48000)
+        poly_time = timed(resampling.resample, audio, 44100, 48000)
+
+        print('{:>9}s   {:>12.3f}   {:>12.3f}'.format(duration, fft_time, poly_time))
+
+        del audio
+
+
+if __name__ == '__main__':
+    main()
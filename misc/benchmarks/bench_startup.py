@@ -0,0 +1,84 @@
+'''Benchmark for application start up.
+
+Imports each module in a fresh interpreter under 'python -X importtime' and
+reports its cumulative import time and the slowest modules it pulled in.
+Then starts the application (Controller) and reports the time until the
+first frame of the main window has been drawn, which needs a display.
+
+The import budget itself is checked by tests/unit/test_startup.py.
+
+Run from the repository root:
+    python misc/benchmarks/bench_startup.py [module ...]
+'''
+
+import sys
+import time
+import subprocess
+
+
+MODULES = ('settings', 'storage', 'signal_processor', 'sensors', 'gui', 'controller')
+
+# prints the seconds from interpreter start until the window has been drawn
+FIRST_FRAME_SCRIPT = '''
+import sys, time
+sys.path.append('src')
+from controller import Controller
+controller = Controller()
+controller.root.update()
+print(time.perf_counter() - float(sys.argv[1]))
+controller.root.destroy()
+'''
+
+
+def import_times(module: str) -> dict:
+    '''Cumulative import time in seconds of every module loaded by
+    importing 'module' in a new interpreter.'''
+
+    code = "import sys; sys.path.append('src'); import " + module
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def first_frame_time() -> float:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', FIRST_FRAME_SCRIPT, str(start)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+
+    modules = sys.argv[1:] or MODULES
+
+    print('{:>18}   {:>10}   {}'.format('module', 'import (s)', 'slowest dependencies'))
+    for module in modules:
+        try:
+            times = import_times(module)
+        except RuntimeError as e:
+            print('{:>18}   {:>10}   {}'.format(module, '-', e))
+            continue
+
+        slowest = sorted(((t, name) for name, t in times.items() if name != module), reverse=True)[:3]
+        print('{:>18}   {:>10.3f}   {}'.format(module, times[module],
+                                              ', '.join('{} {:.3f}'.format(name, t) for t, name in slowest)))
+
+    try:
+        print('\ntime to first frame: {:.3f} s'.format(first_frame_time()))
+    except RuntimeError as e:
+        print('\ntime to first frame: not measured ({})'.format(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,38 @@
-
 import gui
 import storage
 import sensors
 import settings
+import threading
 
 class Controller:
     def __init__(self):
         self.root = gui.MainWindow()
         self.db_manager = storage.DatabaseManager()
-        self.recorder = sensors.Recorder()
         self.context_pane = self.root.context_pane
         self.subviews = {}
 
+        # storage is set up off the GUI thread so the window shows right away
+        self._recovered_names = []
+        self._failed_journals = []
+        self._storage_thread = threading.Thread(target=self._prepare_storage, daemon=True)
+        self._storage_thread.start()
+        self.root.after(100, self._check_storage_prepared)
+
     def _add_subview(self, Subview):
         subview = Subview(self.context_pane)
 
+    def _prepare_storage(self):
+        # recordings that were interrupted, or never saved, become tests
+        recovered = self.db_manager.recover_interrupted_recordings(
+            on_error=lambda journal_path, error: self._failed_journals.append(journal_path))
+        self._recovered_names = [test.name for test in recovered]
+
+    def _check_storage_prepared(self):
+        # the prompt is opened on the GUI thread once recovery has finished
+        if self._storage_thread.is_alive():
+            self.root.after(100, self._check_storage_prepared)
+        elif self._recovered_names or self._failed_journals:
+            self.root.show_recovered_recordings(self._recovered_names, self._failed_journals)
+
     def start(self):
         self.root.mainloop()
-
-    
\ No newline at end of file
@@ -3,7 +3,7 @@ import librosa
 import time
 import numpy as np
 import sounddevice as sd
-from scipy.signal import resample
+import resampling
 from numpy import ndarray
 from dataclasses import dataclass, replace
 
@@ -141,8 +141,8 @@ class SampleBuilder:
 def _match_signals(sig_1, sr_1, sig_2, sr_2):
     '''Resample signals to use a common samplerate.
 
-    Will resample the arrays provided by reference into this function. Pass
-    a copy into this function to avoid the original array being manipulated.
+    Uses polyphase resampling (see resampling.match_signals). The signal
+    already at the common rate is returned as is.
     
     Parameters
     ----------
@@ -165,12 +165,7 @@ def _match_signals(sig_1, sr_1, sig_2, sr_2):
         The common samplerate
     '''
 
-    common_sr = max(sr_1, sr_2)
-
-    sig_1 = resample(sig_1, int(len(sig_1) * common_sr / sr_1))
-    sig_2 = resample(sig_2, int(len(sig_2) * common_sr / sr_2))
-
-    return sig_1, sig_2, common_sr
+    return resampling.match_signals(sig_1, sr_1, sig_2, sr_2)
 
 
 def main():
@@ -1,5 +1,4 @@
 
-import sounddevice
 import storage as db
 import customtkinter
 import threading
@@ -8,6 +7,7 @@ import settings
 import sensors
 import signal_processor as processor
 from storage import DatabaseManager, TestEntry
+from processing import ProcessingExecutor, ProcessingJob, detector_params
 from typing import Callable
 from tkinter import filedialog
 from customtkinter import (
@@ -34,6 +34,10 @@ from userprompts import (
 MAIN_WINDOW_HEIGHT = 580
 MAIN_WINDOW_WIDTH = 1100
 
+# Search as you type
+SEARCH_TYPING_DELAY_MS = 200
+SEARCH_RESULT_LIMIT = 200
+
 # App coloring
 WARNING_COLOR = 'red3'
 WARNING_COLOR_HIGHLIGHTED = 'red4'
@@ -48,9 +52,6 @@ ITEM_COLOR_HIGHLIGHTED = 'gray27'
 ITEM_BORDER_COLOR = 'gray20'
 ITEM_BORDER_COLOR_SELECTED = 'grey40'
 
-customtkinter.set_appearance_mode("Dark")
-customtkinter.set_default_color_theme("blue")
-
 db_manager = DatabaseManager()
 
 _exit_processes = list()
@@ -59,6 +60,8 @@ class MainWindow(CTk):
     """The primary window object for the application GUI."""
 
     def __init__(self):
+        customtkinter.set_appearance_mode("Dark")
+        customtkinter.set_default_color_theme("blue")
         super().__init__()
 
         self.title("UAS Damage Assessment")
@@ -155,6 +158,24 @@ class MainWindow(CTk):
     def settings_button_handler(self):
         self.show_frame(SettingsContextFrame)
         return 
+
+    def show_recovered_recordings(self, names: list, failed: list):
+        '''Tell the user which interrupted recordings were saved as tests at
+        start up, and how many could not be recovered.'''
+
+        lines = []
+        if names:
+            shown = ', '.join(names[:3]) + (' and {} more'.format(len(names) - 3) if len(names) > 3 else '')
+            lines.append('Recovered interrupted recordings:\n' + shown)
+        if failed:
+            lines.append('{} recording(s) could not be recovered.'.format(len(failed)))
+
+        try:
+            ConfirmationPrompt(self,
+                               prompt_text='\n'.join(lines) + ('\nShow saved tests?' if names else ''),
+                               confirm_command=self.open_test_button_handler if names else (lambda: None))
+        except SpawnPromptError:
+            pass # prevents multiple prompts from spawning
     
     def on_close(self):
         self.exit_processes()
@@ -230,7 +251,7 @@ class EditTestContextFrame(CTkFrame):
                                         hover_color=CONFIRM_COLOR_HIGHLIGHTED)
         self.process_button.grid(row=0, column=0)
         self.progress_bar = CTkProgressBar(process_panel, width=250,
-                                           determinate_speed=2)
+                                           mode='determinate')
         self.progress_bar.grid(row=1, column=0, pady=10)
         self.progress_bar.set(0)
 
@@ -273,6 +294,11 @@ class EditTestContextFrame(CTkFrame):
         self.output_summary = OutputSummaryFrame(self)
         self.output_summary.grid(row=1, column=2, rowspan=7, padx=20, sticky='nsew')
 
+        # processing runs in the background, results come back on the main loop
+        self.executor = ProcessingExecutor()
+        self.executor.attach(self)
+        _exit_processes.append(self.executor.shutdown)
+
     def load_test_entry(self, test_data: TestEntry):
         '''Load the data of a preexisting test entry.
         '''
@@ -289,6 +315,8 @@ class EditTestContextFrame(CTkFrame):
 
         # update summary
         self.output_summary.summarize(test_data.data)
+        self.progress_bar.set(0)
+        self.update_processing_state()
 
         # indicate linked tags via checkboxes
         self.tag_select_frame.sync_tags(test_data.tags)
@@ -365,35 +393,69 @@ class EditTestContextFrame(CTkFrame):
             pass # prevents multiple prompts from spawning
 
     def process_button_handler(self):
-        data = db_manager._active_test.data
-        self.progress_bar.set(0)
-        if data:
-            self.progress_bar.start()
-            try:
-                process_mode = settings.get_setting('process_mode')
-                dmg_detections = None
-                
-                if process_mode == 'MACHINE_LEARNING':
-                    print('Machine Learning')
-                    dmg_detections = processor.detect_damage_with_AI(data.audio_data, data.sample_rate)
-                elif process_mode == 'ANALYTICAL':
-                    print('Analytical')
-                    dmg_detections = processor.detect_damage_analytically(data.audio_data, data.sample_rate)
-                    time_elapsed = float(len(data.audio_data)/data.sample_rate)
-                    #processor.plot_dmg_data(data.audio_data, dmg_detections, time_elapsed)
-                else:
-                    raise Exception('Process mode is invalid.')
-               
-                data.output_data = dmg_detections
-                self.output_summary.summarize(data)
+        test_entry = db_manager._active_test
 
-            except Exception as e:
-                print(e)
-            self.progress_bar.set(1)
-            self.progress_bar.stop()
+        # pressed again while the test is being processed, cancel instead
+        job = self.processing_job(test_entry)
+        if job is not None:
+            job.cancel()
+            return
+
+        if test_entry and test_entry.data:
+            self.submit_processing(test_entry)
         else:
             print('<process_button_handler()> no data')
 
+    def submit_processing(self, test_entry: TestEntry):
+        '''Queue the data of 'test_entry' on the processing executor.'''
+        self.progress_bar.set(0)
+        self.executor.submit(test_entry.data, settings.get_setting('process_mode'),
+                             context=test_entry,
+                             on_progress=self.processing_progress_handler,
+                             on_finished=self.processing_finished_handler)
+        self.update_processing_state()
+
+    def processing_job(self, test_entry: TestEntry):
+        '''The queued or running processing job of 'test_entry', if any.'''
+        for job in self.executor.pending:
+            if job.context is test_entry: return job
+        return None
+
+    def update_processing_state(self):
+        '''Show the processing state of the active test on the button and progress bar.'''
+        job = self.processing_job(db_manager._active_test)
+        if job is None:
+            self.process_button.configure(text='Process Sample')
+        else:
+            self.process_button.configure(text='Cancel Processing')
+            self.progress_bar.set(job.progress)
+
+    def processing_progress_handler(self, job):
+        if job.context is db_manager._active_test:
+            self.progress_bar.set(job.progress)
+
+    def processing_finished_handler(self, job):
+        # runs on the Tk main loop, see ProcessingExecutor.attach
+        test_entry = job.context
+
+        # results of a recording that has since been replaced are dropped
+        if job.state == ProcessingJob.DONE and test_entry.data is job.data:
+            job.data.output_data = job.result.dmg_detections
+            db_manager.record_damage_events(job.result.consecutive_scores,
+                                            detector=job.process_mode,
+                                            params=detector_params(job.process_mode),
+                                            test_entry=test_entry)
+        elif job.state == ProcessingJob.FAILED:
+            print(job.error)
+
+        if test_entry is db_manager._active_test:
+            self.update_processing_state()
+            if job.state == ProcessingJob.DONE:
+                self.progress_bar.set(1)
+                self.output_summary.display(job.result.consecutive_scores)
+            else:
+                self.progress_bar.set(0)
+
 
 class SampleRecordingFrame(CTkFrame):
 
@@ -403,8 +465,11 @@ class SampleRecordingFrame(CTkFrame):
         super().__init__(parent, width=250,
                          fg_color=CONTAINER_COLOR)
         
+        self.parent = parent
         self.timer_thread = None
-        self.rec_hardware = sensors.Recorder()
+        self.device_session = None
+        self.live_detector = None
+        self.live_ranges = []
         self.is_recording = False
         self.is_playing = False
         self.time_started_recording = None
@@ -413,8 +478,12 @@ class SampleRecordingFrame(CTkFrame):
         self.recording_length_string = '00:00:00'
         self.recording_cursor_position_string = '00:00:00'
 
-        _exit_processes.append(self.rec_hardware.stop_recording)
         _exit_processes.append(self.stop_button_handler)
+        _exit_processes.append(self.release_hardware)
+
+        # opening the devices takes seconds, so the window is shown first
+        self.hardware_thread = threading.Thread(target=self._connect_hardware, daemon=True)
+        self.hardware_thread.start()
         
         self.grid_columnconfigure((0,1,2), weight=1)
         self.grid_rowconfigure((0,1,2), weight=0)
@@ -440,6 +509,24 @@ class SampleRecordingFrame(CTkFrame):
                                      hover_color=WARNING_COLOR_HIGHLIGHTED)
         self.stop_button.grid(row=2, column=2, padx=2, pady=3, sticky='nsew')
 
+    def _connect_hardware(self):
+        # runs on hardware_thread; no widgets may be touched from here
+        self.device_session = sensors.device_manager.acquire()
+
+    @property
+    def rec_hardware(self):
+        # looked up on every use, the devices may have been reconnected
+        if self.device_session is None: return None
+        return self.device_session.recorder
+
+    def hardware_ready(self) -> bool:
+        return (self.device_session is not None) and self.device_session.ready
+
+    def release_hardware(self):
+        if self.device_session is not None:
+            self.device_session.release()
+            self.device_session = None
+
     def update_recording_timer(self):
 
         elapsed_time = time.time() - self.time_started_recording
@@ -475,25 +562,45 @@ class SampleRecordingFrame(CTkFrame):
 
     def record_button_handler(self):
 
+        if not self.hardware_ready():
+            print('Recording hardware is not ready.')
+            return
+
         # toggle recording flag and disable play button
         self.is_recording = True
         self.play_button.configure(state='disabled')
 
         # stop audio playback if in progress
-        sounddevice.stop()
+        sensors.stop_playback()
 
-        # begin recording
-        self.rec_hardware.start_recording()
+        # begin recording, detecting damage as the audio comes in
+        self.live_detector = processor.StreamingDamageDetector(self.rec_hardware.audio_recorder.sample_rate,
+                                                               **detector_params('ANALYTICAL'))
+        self.live_ranges = []
+        self.rec_hardware.start_recording(detector=self.live_detector)
 
         # start timer
         self.time_started_recording = time.time()
         self.update_recording_timer()
+        self.after(250, self.update_live_detections)
+
+    def update_live_detections(self):
+        '''Show damage ranges scored so far while a recording is in progress.'''
+
+        # the final summary is shown by stop_button_handler
+        if not self.is_recording: return
+
+        while not self.rec_hardware.detected_ranges.empty():
+            self.live_ranges.append(self.rec_hardware.detected_ranges.get())
+        self.parent.output_summary.display(self.live_ranges)
+
+        self.after(250, self.update_live_detections)
 
     def play_button_handler(self):
 
         if not db_manager._active_test.data: return
         data = db_manager._active_test.data
-        sounddevice.play(data.audio_data, data.sample_rate)
+        sensors.play_audio(data.audio_data, data.sample_rate)
 
         # start timer
         self.is_playing = True
@@ -503,24 +610,48 @@ class SampleRecordingFrame(CTkFrame):
     def stop_button_handler(self):
 
         # toggle recording flag and re-enable play button
+        was_recording = self.is_recording
         self.is_recording = False
         self.is_playing = False
         self.play_button.configure(state='normal')
 
         # stop audio playback if in progress
-        sounddevice.stop()
+        sensors.stop_playback()
 
-        # stop recording
+        # stop recording, the last recording is only taken over once
+        if not was_recording or not self.hardware_ready(): return
         self.rec_hardware.stop_recording()
 
         # capture data
+        live_detector, self.live_detector = self.live_detector, None
         try:
-            db_manager._active_test.data = self.rec_hardware.get_data()
-        except Exception as e:
-            print(e)
+            data = self.rec_hardware.get_data()
+        except Exception:
             # exception due to no data existing.
             # nothing need be done here besides catching the exception.
-            pass 
+            return
+
+        # detection already ran during the recording, its ranges are final once flushed
+        consecutive_scores = None
+        if live_detector:
+            consecutive_scores = live_detector.flush()
+            dmg_detections = live_detector.get_detections()
+            if len(dmg_detections) == len(data.audio_data):
+                data.output_data = dmg_detections
+            else:
+                consecutive_scores = None
+
+        test_entry = db_manager._active_test
+        test_entry.data = data
+        if consecutive_scores is not None:
+            self.parent.output_summary.display(consecutive_scores)
+            db_manager.record_damage_events(consecutive_scores, detector='ANALYTICAL',
+                                            params=detector_params('ANALYTICAL'),
+                                            test_entry=test_entry)
+        else:
+            # the live detections do not cover the recording, process it in the background
+            self.parent.output_summary.display([])
+            self.parent.submit_processing(test_entry)
 
     def update(self, data):
 
@@ -560,6 +691,8 @@ class OutputSummaryFrame(CTkFrame):
         self.output_text_box.grid(row=1, column=0, sticky='nsew', padx=5, pady=0)
 
     def summarize(self, data: db.DmgData):
+        '''Score and display the detections in 'data'. Return the scored
+        (start_time, end_time, score) ranges, empty if there are none.'''
         if data:
             try:
 
@@ -570,12 +703,14 @@ class OutputSummaryFrame(CTkFrame):
                 )
 
                 self.display(timestamps)
+                return timestamps
 
             except Exception as e:
                 print(e)
                 self.output_text_box.delete("1.0", 'end')
         else:
             self.output_text_box.delete("1.0", 'end')
+        return []
 
     def display(self, timestamps):
         formatted_output = ''
@@ -850,20 +985,15 @@ class OpenTestContextFrame(CTkFrame):
 
         # otherwise load all tests 
         else:
-            test_ids = db_manager.list_test_ids()
-            if test_ids: 
-                test_entries = []
-                for id in test_ids:
-                    test_entries.append(db_manager._load_test_by_id(id))
-
+            test_entries = db_manager.list_tests()
+            if test_entries:
                 self.search_table.populate(test_entries)
 
-    def search(self, test_name):
+    def search(self, search_text):
 
-        # populate with searched test or nothing if none found
-        if test_name != '':
-            searched_entry = [db_manager._load_test_by_name(test_name)]
-            self.search_table.populate(searched_entry)
+        # populate with the best matching tests
+        if search_text != '':
+            self.search_table.populate(db_manager.search(search_text, limit=SEARCH_RESULT_LIMIT))
 
         # if search invoked with no search string, behave like refresh
         else:
@@ -874,19 +1004,24 @@ class SearchField(CTkFrame):
     def __init__(self,
                  parent = None,
                  command: Callable[[str], None] = None):
+        """Search box which runs 'command' with the search text when the
+        search button or Return is pressed, and shortly after typing stops.
+        """
         super().__init__(parent,
                          fg_color=BACKGROUND_COLOR)
         
         self.command = command
+        self._pending_search = None
 
         self.grid_columnconfigure((0,1), weight=1)
         self.search_entry = CTkEntry(self, width=250,
-                                placeholder_text='search by name',
+                                placeholder_text='search names, notes and tags',
                                 fg_color=CONTAINER_COLOR,
                                 border_color=CONTAINER_BORDER_COLOR)
         self.search_entry.grid(row=0, column=0, sticky='w')
         self.search_entry.bind("<Return>", self.search_button_handler)
         self.search_entry.bind("<Button-1>", self.search_entry_click)
+        self.search_entry.bind("<KeyRelease>", self.search_entry_typed)
 
         self.search_button = CTkButton(self, width=75,
                                   text='Search',
@@ -894,9 +1029,20 @@ class SearchField(CTkFrame):
         self.search_button.grid(row=0, column=1, padx=10)
 
     def search_button_handler(self, event=None):
+        if self._pending_search:
+            self.after_cancel(self._pending_search)
+            self._pending_search = None
+
         search_text = self.search_entry.get().strip()
         if self.command: self.command(search_text)
 
+    def search_entry_typed(self, event):
+        # search once typing pauses rather than on every key
+        if event.keysym == 'Return': return
+        if self._pending_search:
+            self.after_cancel(self._pending_search)
+        self._pending_search = self.after(SEARCH_TYPING_DELAY_MS, self.search_button_handler)
+
     def search_entry_click(self, event):
         self.search_entry.icursor(0)
         self.search_entry.select_range(0, 'end')
@@ -1028,13 +1174,7 @@ class SearchTable(CTkFrame):
         self.scroll_container.grid(row=1, column=0, padx=3, pady=3, sticky='nsew')
         self.scroll_container.grid_columnconfigure(0, weight=1)
 
-        existing_test_ids = db_manager.list_test_ids()
-        existing_test_entries = []
-
-        if existing_test_ids:
-            for id in existing_test_ids:
-                test_entry = db_manager._quick_load_test_by_id(id)
-                existing_test_entries.append(test_entry)
+        existing_test_entries = db_manager.list_tests()
 
         self.populate(existing_test_entries)
 
@@ -1169,7 +1309,8 @@ class SettingsContextFrame(CTkFrame):
         self.trigger_port_entry.insert(0, settings.get_setting('trigger_port'))
         self.save_path_entry.delete(0, 'end')
         self.save_path_entry.insert(0, settings.get_setting('save_location'))
-        self.refresh_devices_button_handler()
+        # listing devices loads PortAudio; let the window appear first
+        self.after_idle(self.refresh_devices_button_handler)
 
     def process_mode_selector_handler(self, value):
         
@@ -1185,6 +1326,7 @@ class SettingsContextFrame(CTkFrame):
     def audio_device_selector_handler(self, value):
         device_id = sensors.get_audio_device_id(value)
         settings.configure_setting('audio_device_id', device_id)
+        self.reconnect_devices()
 
     def refresh_devices_button_handler(self):
         devices = sensors.get_audio_device_names()
@@ -1195,6 +1337,18 @@ class SettingsContextFrame(CTkFrame):
     def update_trigger_port_button_handler(self):
         trigger_port = self.trigger_port_entry.get()
         settings.configure_setting('trigger_port', trigger_port)
+        self.reconnect_devices()
+
+    def reconnect_devices(self):
+        # reopening the devices takes seconds, keep the window responsive
+
+        def reconnect():
+            try:
+                sensors.device_manager.reconnect()
+            except sensors.DeviceError as e:
+                print(e)
+
+        threading.Thread(target=reconnect, daemon=True).start()
 
     def browse_path_button_handler(self):
         save_path = filedialog.askdirectory(initialdir=settings.get_setting('save_location'))
@@ -1203,8 +1357,8 @@ class SettingsContextFrame(CTkFrame):
 
     def update_path_button_handler(self):
         save_path = self.save_path_entry.get()
-        settings.configure_setting('save_location', save_path)
-        db.configure(save_location=settings.get_setting('save_location'))
+        # configure() stores the new location in the settings
+        db.configure(save_location=save_path)
 
 class SingleSettingContainer(CTkFrame):
     def __init__(self, parent, controller=None, setting_name=None):
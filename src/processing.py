@@ -0,0 +1,326 @@
+'''Damage detection and scoring of recordings off the GUI thread.
+
+A ProcessingExecutor runs processing jobs on worker threads, in the order
+they were submitted. The analytical detector works through a recording in
+blocks (see signal_processor.StreamingDamageDetector), so every job reports
+the fraction of its recording processed so far and can be cancelled
+between two blocks, or before it starts.
+
+Callbacks are not run on the worker threads. They are queued and run by
+dispatch_callbacks, which attach() calls from a Tk after() loop, so they
+may update widgets.
+
+Threads are used rather than processes: recordings may be memory-mapped,
+and the numpy work releases the GIL, so no recording has to be copied into
+another process.
+'''
+
+import threading
+import numpy as np
+import signal_processor as processor
+from storage import DmgData
+from dataclasses import dataclass
+from typing import Callable
+from queue import Queue, Empty
+from threading import Thread, Event
+
+
+# length of the blocks a recording is processed in, progress is reported after each
+PROCESS_BLOCK_SECONDS = 10.0
+
+PROCESS_MODES = ('ANALYTICAL', 'MACHINE_LEARNING')
+
+
+class ProcessingError(Exception):
+    '''Exception thrown when a recording cannot be processed.'''
+
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class ProcessingCancelled(ProcessingError):
+    '''Raised inside a job that was cancelled while it was running.'''
+
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+def detector_params(process_mode: str) -> dict:
+    '''Parameters the detector of 'process_mode' runs with, as stored with
+    its damage events (see storage.damage_params_hash).'''
+
+    if process_mode == 'ANALYTICAL':
+        return {'threshold': processor.DAMAGE_THRESHOLD}
+    return {}
+
+
+@dataclass
+class ProcessingResult:
+    dmg_detections: np.ndarray  # per-frame 0/1 detections, as detect_damage_analytically
+    consecutive_scores: list    # (start_time, end_time, score) ranges, as score_damage
+
+
+def process_recording(data: DmgData,
+                      process_mode: str,
+                      progress: Callable = None,
+                      cancelled: Callable = None,
+                      block_seconds: float = PROCESS_BLOCK_SECONDS) -> ProcessingResult:
+    '''Detect and score damage in a recording.
+
+    Parameters
+    ----------
+    data: DmgData
+        Recording to process, its trigger_data is treated as off if missing
+    process_mode: str
+        'ANALYTICAL' or 'MACHINE_LEARNING'
+    progress: Callable, optional
+        Called with the fraction (0-1) of the recording processed so far
+    cancelled: Callable, optional
+        Polled between blocks, processing stops with ProcessingCancelled
+        once it returns True
+    block_seconds: float, optional
+        Length of the blocks the recording is processed in
+
+    Return
+    ------
+    result: ProcessingResult
+        The same detections and ranges as detect_damage_analytically and
+        score_damage give for the whole recording
+    '''
+
+    if process_mode not in PROCESS_MODES:
+        raise ValueError('Process mode is invalid: ' + str(process_mode))
+
+    if process_mode == 'MACHINE_LEARNING':
+        return _process_with_AI(data, progress)
+
+    audio = data.audio_data
+    trigger = data.trigger_data
+    num_frames = len(audio)
+    block_frames = max(1, int(block_seconds * data.sample_rate))
+
+    detector = processor.StreamingDamageDetector(data.sample_rate, **detector_params(process_mode))
+    for start in range(0, num_frames, block_frames):
+        if cancelled and cancelled(): raise ProcessingCancelled('Processing was cancelled.')
+
+        stop = min(start + block_frames, num_frames)
+        detector.push(audio[start:stop], None if trigger is None else trigger[start:stop])
+        if progress: progress(stop / num_frames)
+
+    consecutive_scores = detector.flush()
+    if progress: progress(1.0)
+
+    return ProcessingResult(dmg_detections=detector.get_detections(),
+                            consecutive_scores=consecutive_scores)
+
+
+def _process_with_AI(data: DmgData, progress: Callable = None) -> ProcessingResult:
+
+    dmg_detections = processor.detect_damage_with_AI(data.audio_data, data.sample_rate)
+    if dmg_detections is None:
+        raise ProcessingError('Machine learning detection is not available.')
+
+    _, consecutive_scores = processor.score_damage(dmg_detections=dmg_detections,
+                                                   trigger_detections=data.trigger_data,
+                                                   sampleRate=data.sample_rate)
+    if progress: progress(1.0)
+
+    return ProcessingResult(dmg_detections=dmg_detections, consecutive_scores=consecutive_scores)
+
+
+class ProcessingJob:
+    '''A recording submitted to a ProcessingExecutor.
+
+    'state' moves from QUEUED to RUNNING to DONE, CANCELLED or FAILED.
+    Once finished, 'result' holds the ProcessingResult of a DONE job and
+    'error' the exception of a FAILED one.
+    '''
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    FAILED = 'failed'
+
+    def __init__(self,
+                 data: DmgData,
+                 process_mode: str,
+                 context=None,
+                 on_progress: Callable = None,
+                 on_finished: Callable = None):
+
+        self.data = data
+        self.process_mode = process_mode
+        self.context = context
+        self.state = ProcessingJob.QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+
+        self._on_progress = on_progress
+        self._on_finished = on_finished
+        self._cancel_event = Event()
+        self._finished_event = Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return self._finished_event.is_set()
+
+    def cancel(self):
+        '''Stop the job before it starts, or after the block in progress.'''
+        self._cancel_event.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        '''Block until the job has finished. Return False on timeout.'''
+        return self._finished_event.wait(timeout)
+
+
+class ProcessingExecutor:
+    '''Runs ProcessingJobs on a pool of worker threads.
+
+    Jobs queue up behind each other, so several recordings can be
+    submitted at once. Their callbacks are delivered by dispatch_callbacks
+    (see attach) on the thread that calls it.
+    '''
+
+    def __init__(self, workers: int = 1, block_seconds: float = PROCESS_BLOCK_SECONDS):
+        '''
+        Parameters
+        ----------
+        workers: int, optional
+            Number of recordings processed at the same time
+        block_seconds: float, optional
+            Length of the blocks recordings are processed in
+        '''
+
+        self.block_seconds = block_seconds
+
+        self._job_queue = Queue()
+        self._callback_queue = Queue()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._is_shut_down = False
+
+        self._workers = [_ProcessingWorker(self) for _ in range(workers)]
+        for worker in self._workers: worker.start()
+
+    @property
+    def pending(self) -> list:
+        '''Jobs queued or running, in the order they were submitted.'''
+        with self._lock:
+            return list(self._pending)
+
+    def submit(self,
+               data: DmgData,
+               process_mode: str,
+               context=None,
+               on_progress: Callable = None,
+               on_finished: Callable = None) -> ProcessingJob:
+        '''Queue a recording for processing.
+
+        Parameters
+        ----------
+        data: DmgData
+            Recording to process
+        process_mode: str
+            'ANALYTICAL' or 'MACHINE_LEARNING'
+        context: optional
+            Anything the caller wants to find the job by, e.g. its TestEntry
+        on_progress: Callable, optional
+            Called with the job whenever its 'progress' has advanced
+        on_finished: Callable, optional
+            Called with the job once it is done, cancelled or failed
+        '''
+
+        if self._is_shut_down: raise ProcessingError('Executor has been shut down.')
+
+        job = ProcessingJob(data, process_mode, context, on_progress, on_finished)
+        with self._lock:
+            self._pending.append(job)
+        self._job_queue.put(job)
+        return job
+
+    def cancel_all(self):
+        for job in self.pending: job.cancel()
+
+    def dispatch_callbacks(self) -> int:
+        '''Run the callbacks queued by the workers on the calling thread.
+        Return the number run.'''
+
+        count = 0
+        while True:
+            try:
+                callback, job = self._callback_queue.get_nowait()
+            except Empty:
+                return count
+            callback(job)
+            count += 1
+
+    def attach(self, widget, interval_ms: int = 50):
+        '''Dispatch callbacks every 'interval_ms' from widget.after(), on the
+        Tk main loop, until the executor is shut down.'''
+
+        def poll():
+            self.dispatch_callbacks()
+            if not self._is_shut_down: widget.after(interval_ms, poll)
+
+        widget.after(interval_ms, poll)
+
+    def shutdown(self, wait: bool = False):
+        '''Cancel every pending job and stop the workers.'''
+
+        self._is_shut_down = True
+        self.cancel_all()
+        for _ in self._workers: self._job_queue.put(None)
+        if wait:
+            for worker in self._workers: worker.join()
+
+    def _run(self, job: ProcessingJob):
+
+        if job._cancel_event.is_set():
+            job.state = ProcessingJob.CANCELLED
+            self._finish(job)
+            return
+
+        job.state = ProcessingJob.RUNNING
+
+        def report(fraction):
+            job.progress = fraction
+            if job._on_progress: self._callback_queue.put((job._on_progress, job))
+
+        try:
+            job.result = process_recording(job.data, job.process_mode,
+                                           progress=report,
+                                           cancelled=job._cancel_event.is_set,
+                                           block_seconds=self.block_seconds)
+            job.state = ProcessingJob.DONE
+        except ProcessingCancelled:
+            job.state = ProcessingJob.CANCELLED
+        except Exception as e:
+            job.error = e
+            job.state = ProcessingJob.FAILED
+
+        self._finish(job)
+
+    def _finish(self, job: ProcessingJob):
+
+        with self._lock:
+            self._pending.remove(job)
+        job._finished_event.set()
+        if job._on_finished: self._callback_queue.put((job._on_finished, job))
+
+
+class _ProcessingWorker(Thread):
+
+    def __init__(self, executor: ProcessingExecutor):
+        '''Thread taking jobs off the queue of 'executor' until it is shut down.'''
+
+        Thread.__init__(self, daemon=True)
+        self._executor = executor
+
+    def run(self):
+
+        while True:
+            job = self._executor._job_queue.get()
+            if job is None: break
+            self._executor._run(job)
@@ -0,0 +1,170 @@
+'''Resampling shared by the recorder, storage and the data generator.
+
+Audio is converted between sample rates with a polyphase filter
+(scipy.signal.resample_poly) whose FIR filter is designed once per rate
+ratio and cached. Control signals such as the ~1 kHz trigger are brought to
+the audio rate by linear or zero-order-hold interpolation, which is far
+cheaper and does not ring around the trigger's edges. A signal that is
+already at the target rate is always handed back untouched.
+
+scipy.signal is only imported once audio is actually resampled, as loading
+it takes about a second.
+'''
+
+import numpy as np
+from numpy import ndarray
+from fractions import Fraction
+from functools import lru_cache
+
+
+# largest up/down factor considered when approximating a rate ratio
+_MAX_RATIO_TERM = 1000
+
+INTERPOLATION_METHODS = ('linear', 'hold')
+
+
+def rate_ratio(source_rate: float, target_rate: float) -> tuple[int, int]:
+    '''Smallest (up, down) factors such that source_rate * up / down is
+    target_rate, or close to it for rates that are not whole numbers.'''
+
+    if source_rate <= 0 or target_rate <= 0:
+        raise ValueError('Sample rates must be positive.')
+
+    if float(source_rate).is_integer() and float(target_rate).is_integer():
+        ratio = Fraction(int(target_rate), int(source_rate))
+    else:
+        ratio = Fraction(target_rate / source_rate)
+    ratio = ratio.limit_denominator(_MAX_RATIO_TERM)
+    return ratio.numerator, ratio.denominator
+
+
+def resample(signal: ndarray, source_rate: float, target_rate: float, axis: int = 0) -> ndarray:
+    '''Polyphase resampling of 'signal' from 'source_rate' to 'target_rate'.
+
+    Meant for audio. The anti-aliasing filter for each rate ratio is only
+    designed once. The output has ceil(len * up / down) samples along
+    'axis'.
+
+    Return
+    ------
+    resampled: ndarray
+        The resampled signal, or 'signal' itself if the rates already match
+    '''
+
+    up, down = rate_ratio(source_rate, target_rate)
+    if up == down:
+        return signal
+
+    from scipy.signal import resample_poly
+    return resample_poly(signal, up, down, axis=axis, window=_polyphase_filter(up, down))
+
+
+@lru_cache(maxsize=32)
+def _polyphase_filter(up: int, down: int) -> ndarray:
+    '''Low-pass FIR filter for a resampling ratio, designed the same way
+    resample_poly designs its default filter.'''
+
+    from scipy.signal import firwin
+
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    taps = firwin(2 * half_len + 1, 1. / max_rate, window=('kaiser', 5.0))
+    taps.flags.writeable = False
+    return taps
+
+
+def interpolate(signal: ndarray,
+                source_rate: float,
+                target_rate: float,
+                num_samples: int = None,
+                method: str = 'linear') -> ndarray:
+    '''Bring a control signal (e.g. the trigger) to another sample rate by
+    interpolation along the first axis.
+
+    Parameters
+    ----------
+    signal: ndarray
+        'samples' or 'samples x channels' values taken at 'source_rate'
+    source_rate: float
+        Rate 'signal' was sampled at
+    target_rate: float
+        Rate to produce samples at
+    num_samples: int, optional
+        Number of output samples, covering the length of 'signal' by default
+    method: str, optional
+        'linear', or 'hold' to keep each value until the next one (zero-order hold)
+    '''
+
+    if num_samples is None:
+        num_samples = int(np.ceil(len(signal) * target_rate / source_rate))
+    if source_rate == target_rate and num_samples == len(signal):
+        return signal
+
+    if method not in INTERPOLATION_METHODS:
+        raise ValueError('Unknown interpolation method: ' + str(method))
+
+    signal = np.asarray(signal)
+    if len(signal) == 0:
+        return np.zeros((num_samples,) + signal.shape[1:])
+
+    # both grids are uniform, so source positions are computed directly
+    # rather than searched for
+    positions = np.arange(num_samples) * source_rate / target_rate
+    lower = np.minimum(positions.astype(np.int64), len(signal) - 1)
+    if method == 'hold':
+        return signal[lower]
+
+    upper = np.minimum(lower + 1, len(signal) - 1)
+    fraction = np.minimum(positions - lower, 1.0)
+    if signal.ndim > 1:
+        fraction = fraction.reshape((-1,) + (1,) * (signal.ndim - 1))
+    return signal[lower] + (signal[upper] - signal[lower]) * fraction
+
+
+def sample_at(times: ndarray, values: ndarray, sample_times: ndarray, method: str = 'linear') -> ndarray:
+    '''Values of a signal known at increasing 'times', interpolated at
+    'sample_times'. Times outside the known range take the first or last
+    value.
+
+    'values' may be 'samples' or 'samples x channels'. 'method' is 'linear'
+    or 'hold' (zero-order hold).
+    '''
+
+    if method not in INTERPOLATION_METHODS:
+        raise ValueError('Unknown interpolation method: ' + str(method))
+
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.zeros((len(sample_times),) + values.shape[1:])
+
+    if method == 'hold':
+        indices = np.searchsorted(times, sample_times, side='right') - 1
+        return values[np.clip(indices, 0, len(values) - 1)]
+
+    if values.ndim == 1:
+        return np.interp(sample_times, times, values)
+
+    columns = values.reshape(len(values), -1)
+    result = np.empty((len(sample_times), columns.shape[1]))
+    for i in range(columns.shape[1]):
+        result[:, i] = np.interp(sample_times, times, columns[:, i])
+    return result.reshape((len(sample_times),) + values.shape[1:])
+
+
+def match_signals(sig_1: ndarray, sr_1: float, sig_2: ndarray, sr_2: float):
+    '''Polyphase resample two signals to a common (the higher) sample rate.
+
+    The signal already at the common rate is returned as is.
+
+    Returns
+    -------
+    sig_1: ndarray
+        First signal at the common sample rate
+    sig_2: ndarray
+        Second signal at the common sample rate
+    common_sr: float
+        The common samplerate
+    '''
+
+    common_sr = max(sr_1, sr_2)
+    return resample(sig_1, sr_1, common_sr), resample(sig_2, sr_2, common_sr), common_sr
@@ -1,25 +1,45 @@
 
-import pyfirmata
 import settings
+import storage
+import signal_processor as processor
+import resampling
 import time
 import sys
+import math
+import bisect
 import numpy as np
 import threading
-import sounddevice
 import traceback
 from storage import DmgData
-from pyfirmata import util
+from array import array
+from dataclasses import dataclass
+from typing import Callable
 from queue import Queue
 from threading import Thread, Event
-from scipy.signal import resample
+
+# sounddevice and pyfirmata are imported where the devices are opened, so
+# importing this module neither loads PortAudio nor the serial libraries
+
+
+# number of trigger samples collected before they are written to a journal
+_JOURNAL_TRIGGER_BATCH = 1000
+
+# seconds of trigger samples kept in memory once they are in a journal
+_TRIGGER_TAIL_SECONDS = 10.0
 
 class Recorder:
 
     def __init__(self):
+        self.detected_ranges = Queue()
+        self.trigger_jitter = None
+        self._detection_thread = None
+
+        config = settings.get_settings()
+
         try:
             self.trigger_recorder = TriggerRecorder(
-                port=settings.get_setting('trigger_port'),
-                pin=settings.get_setting('trigger_pin')
+                port=config.trigger_port,
+                pin=config.trigger_pin
             )
         except Exception as e:
             print('Error setting up trigger recorder. Ensure device is attached correctly.')
@@ -28,87 +48,371 @@ class Recorder:
 
         try:
             self.audio_recorder = AudioRecorder(
-                device_id=int(settings.get_setting('audio_device_id'))
+                device_id=config.audio_device_id
             )
         except Exception as e:
             print('Error setting up audio recorder.')
             print(e)
             return None
 
-    def start_recording(self):
-        self.trigger_recorder.start_recording()
-        self.audio_recorder.start_recording()
+    @property
+    def ready(self) -> bool:
+        '''Whether both the trigger board and the audio device were opened.'''
+        return hasattr(self, 'trigger_recorder') and hasattr(self, 'audio_recorder')
+
+    @property
+    def is_recording(self) -> bool:
+        return self.ready and self.audio_recorder.is_recording
+
+    def close(self):
+        '''Stop any recording in progress and release the devices.'''
+        if self.is_recording: self.stop_recording()
+        if hasattr(self, 'trigger_recorder'): self.trigger_recorder.close()
+        if hasattr(self, 'audio_recorder'): self.audio_recorder.close()
+
+    def start_recording(self, detector=None):
+        '''Begin recording.
+
+        If a signal_processor.StreamingDamageDetector is given, every audio
+        block is pushed to it as it is captured, together with the trigger
+        state at the time each of its frames was captured. Scored ranges it reports are put on
+        'detected_ranges' for the GUI to pick up.
+        '''
+        # stream to a journal on disk instead of holding the recording in memory
+        config = settings.get_settings()
+        self.journal = None
+        if config.record_to_disk:
+            self.journal = storage.RecordingJournal(self.audio_recorder.sample_rate,
+                                                    self.audio_recorder.channels)
+
+        if detector:
+            self.detected_ranges = Queue()
+            block_queue = Queue()
+            self.audio_recorder.set_block_queue(block_queue)
+            conditioner = processor.TriggerConditioner(
+                **config.trigger_conditioning(self.audio_recorder.sample_rate))
+            self._detection_thread = _DetectionThread(detector,
+                                                      block_queue,
+                                                      self.trigger_recorder.readings_at,
+                                                      conditioner,
+                                                      self.detected_ranges)
+            self._detection_thread.start()
+
+        self.trigger_recorder.start_recording(journal=self.journal)
+        self.audio_recorder.start_recording(journal=self.journal)
 
     def stop_recording(self):
         self.trigger_recorder.stop_recording()
         self.audio_recorder.stop_recording()
 
+        if self.journal:
+            self.journal.set_audio_start_time(self.audio_recorder.start_time)
+            self.journal.close()
+
+        # let the detector catch up with the last captured blocks
+        if self._detection_thread:
+            self.audio_recorder.set_block_queue(None)
+            self._detection_thread.stop()
+            self._detection_thread.join()
+            self._detection_thread = None
+
     def get_data(self):
 
+        if self.journal:
+            return self._get_journal_data()
+
         # get data
-        tsr, tdata = self.trigger_recorder.get_data()
+        capture = self.trigger_recorder.get_capture()
         asr, adata = self.audio_recorder.get_data()
 
-        # resample to match sample length
-        tdata, adata, csr = match_signals(tdata, tsr, adata, asr)
-
-        # verify nothing crazy happened
-        assert csr == max(tsr, asr)
-        assert len(tdata) == len(adata)
+        # sample the trigger at the time of every audio frame
+        tdata = capture.align(self.audio_recorder.start_time or 0.0, asr, len(adata))
+        csr = asr
+        self.trigger_jitter = capture.jitter()
 
         # convert trigger signal to binary
-        b_tdata = []
-        for value in tdata:
-            if value:
-                value = value * 1023
-                if value < 300:
-                    value = 0
-                else:
-                    value = 1
-            else:
-                value = 0
-            b_tdata.append(value)
-
+        trigger = processor.condition_trigger(tdata, **settings.get_settings().trigger_conditioning(csr))
 
-        # pack data and return
+        # pack data and return, the capture buffer is not reused so its
+        # view is handed over as is
         out_data = DmgData()
-        out_data.audio_data = np.array(adata)
-        b_tdata = np.array(b_tdata)
-        b_tdata = b_tdata.reshape(-1, 1)
-        out_data.trigger_data = b_tdata
+        out_data.audio_data = adata
+        out_data.trigger_data = trigger.states.reshape(-1, 1)
         out_data.sample_rate = csr
 
         return out_data
 
+    def _get_journal_data(self):
+        '''Finalize the journal of the last recording and map it.'''
+
+        if self.journal.dropped_blocks:
+            print('Warning: {} blocks could not be written to disk in time.'.format(self.journal.dropped_blocks))
+
+        # the recording stays on disk and is mapped rather than read into memory
+        out_data = storage.finalize_recording(self.journal.path)
+        self.journal = None
+
+        return out_data
+
+
+class DeviceError(Exception):
+    '''Exception thrown when the recording devices cannot be used as asked.'''
+
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+class DeviceManager:
+    '''Owns the recording devices of the process: one audio input stream and
+    one trigger board, wrapped in a single Recorder.
+
+    Everything that records acquires a CaptureSession. The devices are
+    opened with the first session and closed when the last session is
+    released. reconnect() reopens them after their settings changed,
+    without the sessions having to be acquired again.
+    '''
+
+    def __init__(self, open_recorder: Callable = None):
+        '''
+        Parameters
+        ----------
+        open_recorder: Callable, optional
+            Creates the Recorder from the current settings, Recorder by default
+        '''
+
+        self._open_recorder = open_recorder or Recorder
+        self._lock = threading.RLock()
+        self._recorder = None
+        self._device_settings = None
+        self._session_count = 0
+
+    @property
+    def recorder(self):
+        '''The open Recorder, None while no session is held.'''
+        return self._recorder
+
+    @property
+    def session_count(self) -> int:
+        return self._session_count
+
+    def acquire(self) -> 'CaptureSession':
+        '''Start a session, opening the devices if this is the first one.
+
+        Opening the devices can take seconds, so call this off the GUI thread.
+        '''
+
+        with self._lock:
+            if self._recorder is None: self._open()
+            self._session_count += 1
+            return CaptureSession(self)
+
+    def reconnect(self, force: bool = False) -> bool:
+        '''Reopen the devices if 'trigger_port', 'trigger_pin' or
+        'audio_device_id' changed since they were opened, or if they failed
+        to open. With 'force' they are always reopened.
+
+        Nothing is opened while no session is held; the next session opens
+        the devices with the settings at that time.
+
+        Return
+        ------
+        reopened: bool
+            Whether the devices were reopened
+        '''
+
+        with self._lock:
+            if self._session_count == 0: return False
+
+            if (not force) and self._recorder.ready and (self._device_settings == _device_settings()):
+                return False
+
+            if self._recorder.is_recording:
+                raise DeviceError('Cannot reconnect the recording devices while recording.')
+
+            self._close()
+            self._open()
+            return True
+
+    def _release(self):
+
+        with self._lock:
+            self._session_count -= 1
+            if self._session_count == 0: self._close()
+
+    def _open(self):
+        self._device_settings = _device_settings()
+        self._recorder = self._open_recorder()
+
+    def _close(self):
+        recorder, self._recorder = self._recorder, None
+        if recorder is not None: recorder.close()
+
+
+class CaptureSession:
+    '''A hold on the shared recording devices, from DeviceManager.acquire.
+
+    Release it, or use it as a context manager, once the devices are no
+    longer needed.
+    '''
+
+    def __init__(self, manager: DeviceManager):
+        self._manager = manager
+        self._released = False
+
+    @property
+    def recorder(self) -> Recorder:
+        '''The shared Recorder. It is replaced when the devices are reconnected,
+        so look it up again rather than keeping it.'''
+        if self._released: raise DeviceError('Capture session has been released.')
+        return self._manager.recorder
+
+    @property
+    def ready(self) -> bool:
+        '''Whether the devices are open and can record.'''
+        if self._released: return False
+        recorder = self._manager.recorder
+        return (recorder is not None) and recorder.ready
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._manager._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+def _device_settings() -> tuple:
+    '''The settings the recording devices are opened with.'''
+    config = settings.get_settings()
+    return (config.trigger_port, config.trigger_pin, config.audio_device_id)
+
+
+# shared by the whole application; opens nothing until a session is acquired
+device_manager = DeviceManager()
+
+
 class AudioRecorder():
-    def __init__(self, device_id: int):
+    def __init__(self, device_id: int, expected_duration: float = 120):
+        '''Records audio from the specified input device.
+
+        Parameters
+        ----------
+        device_id: int
+            sounddevice index of the input device
+        expected_duration: float, optional
+            Typical recording length in seconds. Capture memory is reserved
+            in segments of this length before each recording starts, so the
+            audio callback only allocates when a recording outgrows one.
+        '''
+
+        import sounddevice
 
         self._device_id = device_id
         device_info = sounddevice.query_devices(self._device_id)
         self._sample_rate = int(device_info['default_samplerate'])
         self._channels = 2
+        self._dtype = np.float32
+        self._segment_frames = max(1, int(expected_duration * self._sample_rate))
 
-        self._audio_blocks = []
+        self._buffer = _CaptureBuffer(self._channels, self._dtype, self._segment_frames)
+        self._block_queue = None
+        self._journal = None
+        self._journal_frames = 0
+        self._start_time = None
 
-        def audio_callback(indata, frames, time, status):
+        def audio_callback(indata, frames, time_info, status):
             """callback for consumption of audio data from stream"""
 
+            # monotonic time of the first frame of the recording
+            if self._start_time is None:
+                self._start_time = time.monotonic() - frames / self._sample_rate
+
             if status:
                 print(status, file=sys.stderr)
+                if status.input_overflow: self._buffer.overflow_count += 1
+
+            journal = self._journal
+            if journal is not None:
+                first_frame = self._journal_frames
+                journal.write_audio(indata)
+                self._buffer.block_count += 1
+                self._journal_frames += len(indata)
+                stored_blocks = [indata.copy()] if self._block_queue is not None else []
+            else:
+                first_frame = self._buffer.frames
+                stored_blocks = self._buffer.write(indata)
 
-            self._audio_blocks.append(indata.copy())
+            # each block goes with the monotonic time its first frame was captured at
+            block_queue = self._block_queue
+            if block_queue is not None:
+                for block in stored_blocks:
+                    block_queue.put_nowait((block, self._start_time + first_frame / self._sample_rate))
+                    first_frame += len(block)
 
         self._audio_stream = sounddevice.InputStream(
             samplerate=self._sample_rate, 
             device=self._device_id,
             channels=self._channels,
+            dtype='float32',
             callback=audio_callback)
         
         self._is_recording = False
+
+    @property
+    def sample_rate(self):
+        return self._sample_rate
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @property
+    def is_recording(self) -> bool:
+        return self._is_recording
+
+    @property
+    def start_time(self) -> float:
+        '''time.monotonic() at which the first frame of the last recording was
+        captured, estimated from the arrival of the first block.'''
+        return self._start_time
+
+    @property
+    def block_count(self) -> int:
+        '''Number of blocks delivered by the stream during the last recording.'''
+        return self._buffer.block_count
+
+    @property
+    def overflow_count(self) -> int:
+        '''Number of blocks the stream flagged as overflowed (audio was lost).'''
+        return self._buffer.overflow_count
+
+    @property
+    def bytes_captured(self) -> int:
+        if self._journal is not None:
+            return self._journal_frames * self._channels * np.dtype(self._dtype).itemsize
+        return self._buffer.bytes_captured
+
+    def set_block_queue(self, block_queue: Queue):
+        '''Have every captured block put on 'block_queue' (or stop doing so by
+        passing None). Blocks are queued as (block, capture_time) where the
+        block is a read-only view of the capture buffer and capture_time the
+        time.monotonic() its first frame was captured at.'''
+        self._block_queue = block_queue
         
-    def start_recording(self):
+    def start_recording(self, journal=None):
+        '''Begin capturing audio, into memory or, if a storage.RecordingJournal
+        is given, to disk. Blocks are not kept in memory in the latter case.'''
         if not self._is_recording:
-            self._audio_blocks = []
+            # fresh memory so data handed out earlier is never overwritten
+            self._buffer = _CaptureBuffer(self._channels, self._dtype,
+                                          self._segment_frames if journal is None else 1)
+            self._journal = journal
+            self._journal_frames = 0
+            self._start_time = None
             self._is_recording = True
             self._audio_stream.start()
 
@@ -117,15 +421,94 @@ class AudioRecorder():
             self._is_recording = False
             self._audio_stream.stop()
 
+    def close(self):
+        '''Stop recording and close the input stream.'''
+        self.stop_recording()
+        self._audio_stream.close()
+
     def get_data(self):
         if self._is_recording:
             raise Exception('Cannot acquire data, recording in progress.')
+        elif self._journal is not None:
+            raise Exception('Recording was written to a journal, finalize it instead.')
         else:
-            outdata = np.concatenate(self._audio_blocks)
+            outdata = self._buffer.get_data()
             return self._sample_rate, outdata
-        
+
+
+class _CaptureBuffer():
+    '''Growable store for captured audio made of preallocated segments.
+
+    Writing a block copies it into the current segment. A new segment is only
+    allocated once the current one is full, and get_data hands back a view
+    of the stored frames rather than a copy whenever they fit in a single
+    segment.
+    '''
+
+    def __init__(self, channels: int, dtype, segment_frames: int):
+        self._channels = channels
+        self._dtype = dtype
+        self._segment_frames = segment_frames
+        self._segments = [np.empty((segment_frames, channels), dtype=dtype)]
+        self._segment_position = 0
+
+        self.frames = 0
+        self.block_count = 0
+        self.overflow_count = 0
+
+    @property
+    def bytes_captured(self) -> int:
+        return self.frames * self._channels * np.dtype(self._dtype).itemsize
+
+    def write(self, block: np.ndarray) -> list:
+        '''Copy a block into the buffer.
+
+        Return
+        ------
+        stored: list[ndarray]
+            Read-only views of where the block was stored, two if it was split
+            across segments.
+        '''
+
+        self.block_count += 1
+        stored = []
+        position = 0
+
+        while position < len(block):
+            segment = self._segments[-1]
+            if self._segment_position == len(segment):
+                segment = np.empty((self._segment_frames, self._channels), dtype=self._dtype)
+                self._segments.append(segment)
+                self._segment_position = 0
+
+            count = min(len(block) - position, len(segment) - self._segment_position)
+            destination = segment[self._segment_position:self._segment_position + count]
+            destination[:] = block[position:position + count]
+
+            view = destination.view()
+            view.flags.writeable = False
+            stored.append(view)
+
+            self._segment_position += count
+            position += count
+
+        self.frames += len(block)
+        return stored
+
+    def get_data(self) -> np.ndarray:
+        '''All frames captured so far as one 'frames x channels' array.'''
+
+        # a recording longer than one segment is joined once and kept joined
+        if len(self._segments) > 1:
+            joined = np.concatenate(self._segments[:-1] + [self._segments[-1][:self._segment_position]])
+            self._segments = [joined]
+            self._segment_position = len(joined)
+
+        return self._segments[0][:self.frames]
+
 
 def get_audio_device_names():
+    import sounddevice
     devices_data = sounddevice.query_devices()
     device_names = []
     for device in devices_data:
@@ -133,9 +516,21 @@ def get_audio_device_names():
     return device_names
 
 def get_audio_device_id(name: str):
+    import sounddevice
     device_data = sounddevice.query_devices(name)
     device_id = device_data['index']
     return device_id
+
+def play_audio(audio_data, sample_rate):
+    '''Start playing audio on the default output device.'''
+    import sounddevice
+    sounddevice.play(audio_data, sample_rate)
+
+def stop_playback():
+    '''Stop audio started with play_audio, if any.'''
+    # nothing can be playing if sounddevice was never loaded
+    sounddevice = sys.modules.get('sounddevice')
+    if sounddevice is not None: sounddevice.stop()
     
 
 
@@ -145,44 +540,112 @@ class TriggerRecorder():
         self.thread_output_queue = Queue()
         self.recorder_thread = _TriggerRecorder(port, pin, self.thread_output_queue)
         self.recorder_thread.start()
-        self.raw_data = None
+        self.capture = None
 
-    def start_recording(self):
-        self.raw_data = None
-        self.recorder_thread.start_recording()
+    def start_recording(self, journal=None):
+        self.capture = None
+        self.recorder_thread.start_recording(journal)
 
     def stop_recording(self):
         self.recorder_thread.stop_recording()
         self.recorder_thread.wait()
         if not self.thread_output_queue.empty():
-            self.raw_data = self.thread_output_queue.get()
+            self.capture = self.thread_output_queue.get()
+
+    def readings_at(self, times: np.ndarray) -> np.ndarray:
+        '''Readings of the recording in progress, or of the last one,
+        interpolated at the time.monotonic() 'times'.'''
+        return self.recorder_thread.readings_at(times)
 
     def get_data(self):
-        if self.raw_data:
-            sr = self.raw_data[0]
-            values = self.raw_data[1]
-            return sr, values
-        else:
+        '''Measured sample rate and the raw readings of the last recording.'''
+        capture = self.get_capture()
+        return capture.sample_rate, capture.values
+
+    def get_capture(self):
+        '''Timestamped readings of the last recording as a TriggerCapture.'''
+        if self.capture is None:
             raise Exception('Data unavailable.')
+        return self.capture
+
+    def close(self):
+        '''Stop the recording thread and close the connection to the board.'''
+        self.recorder_thread.terminate()
+        self.recorder_thread.join()
+
+
+@dataclass
+class TriggerJitter:
+    '''Timing statistics for the intervals between trigger samples, in seconds.'''
+    nominal_interval: float
+    mean_interval: float
+    std_interval: float
+    p99_interval: float
+    max_interval: float
+
+
+@dataclass
+class TriggerCapture:
+    '''Trigger readings with the time.monotonic() timestamp each was taken at.
+
+    Missing readings are stored as nan.
+    '''
+    timestamps: np.ndarray
+    values: np.ndarray
+    sample_period: float
+
+    @property
+    def sample_rate(self) -> float:
+        '''Average rate the samples were actually taken at.'''
+        if len(self.timestamps) < 2: return 0
+        return (len(self.timestamps) - 1) / (self.timestamps[-1] - self.timestamps[0])
+
+    def jitter(self) -> TriggerJitter:
+        '''Measured spread of the sampling intervals.'''
+        intervals = np.diff(self.timestamps)
+        if len(intervals) == 0:
+            return TriggerJitter(self.sample_period, 0.0, 0.0, 0.0, 0.0)
+        return TriggerJitter(nominal_interval=self.sample_period,
+                             mean_interval=float(np.mean(intervals)),
+                             std_interval=float(np.std(intervals)),
+                             p99_interval=float(np.percentile(intervals, 99)),
+                             max_interval=float(np.max(intervals)))
+
+    def align(self, start_time: float, sample_rate: int, num_frames: int) -> np.ndarray:
+        '''Readings linearly interpolated at the times of 'num_frames' frames
+        sampled at 'sample_rate', the first of them at 'start_time'. Missing
+        readings count as 0.
+        '''
+        frame_times = start_time + np.arange(num_frames) / sample_rate
+        return resampling.sample_at(self.timestamps, np.nan_to_num(self.values, nan=0.0), frame_times)
 
 
 class _TriggerRecorder(Thread):
 
     def __init__(self, port: str, pin: str,
-                 out_queue: Queue):
-        '''Thread for handling the recording of trigger data.'''
+                 out_queue: Queue, sample_period: float = 0.001):
+        '''Thread for handling the recording of trigger data.
+
+        The pin is read once every 'sample_period' seconds and every reading
+        is stored with the monotonic time it was taken at.
+        '''
 
         Thread.__init__(self, daemon=True)
 
+        import pyfirmata
+        from pyfirmata import util
+
         self._board = pyfirmata.Arduino(port)
         self._analog_pin = self._board.get_pin(pin)
         self._out_queue = out_queue
         self._it = util.Iterator(self._board)
         self._it.start()
 
-        self._samples = []
-        self._begin_time = None
-        self._end_time = None
+        self._sample_period = sample_period
+        self._timestamps = array('d')
+        self._values = array('d')
+        self._samples_lock = threading.Lock()
+        self._journal = None
 
         self._stop_event = Event()
         self._start_recording_event = Event()
@@ -197,35 +660,88 @@ class _TriggerRecorder(Thread):
 
             # idle until recording begins
             self._start_recording_event.wait() 
+            if self._stop_event.is_set(): break
             self._end_recording_event.clear()
             self._recording_finished.clear()
-            self._begin_time = time.time()
+            with self._samples_lock:
+                self._timestamps = array('d')
+                self._values = array('d')
+            journaled = 0
+            next_sample_time = time.monotonic()
 
             # recording loop
             while not self._end_recording_event.is_set():
 
-                # take samples of the trigger signal
-                sample = self._analog_pin.read()
-                time.sleep(.001)
-                self._samples.append(sample)
+                # take a timestamped sample of the trigger signal
+                value = self._analog_pin.read()
+                with self._samples_lock:
+                    self._timestamps.append(time.monotonic())
+                    self._values.append(math.nan if value is None else value)
+
+                # hand samples over to the journal in batches, only the
+                # recent tail is kept in memory after that
+                if self._journal and len(self._values) - journaled >= _JOURNAL_TRIGGER_BATCH:
+                    self._journal.write_trigger(self._timestamps[journaled:], self._values[journaled:])
+                    journaled = len(self._values)
+                    journaled -= self._trim_samples(keep_after=self._timestamps[-1] - _TRIGGER_TAIL_SECONDS,
+                                                    limit=journaled)
+
+                # sleep until the next scheduled sample, late samples do not
+                # push back the ones after them
+                next_sample_time += self._sample_period
+                delay = next_sample_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_sample_time = time.monotonic()
 
-            # calculate samplerate
-            self._end_time = time.time()
-            total_time = self._end_time - self._begin_time
-            sr = round(len(self._samples) / total_time)
+            if self._journal and len(self._values) > journaled:
+                self._journal.write_trigger(self._timestamps[journaled:], self._values[journaled:])
 
             # package recording onto queue
-            output_tuple = (sr, self._samples)
-            self._out_queue.put(output_tuple)
+            capture = TriggerCapture(timestamps=np.frombuffer(self._timestamps, dtype=np.float64),
+                                     values=np.frombuffer(self._values, dtype=np.float64),
+                                     sample_period=self._sample_period)
+            self._out_queue.put(capture)
 
             # signal recording is finished
             self._recording_finished.set()
 
             # reset start flag
             self._start_recording_event.clear()
-            
-    def start_recording(self):
-        '''Clear the output queue and begin recording.'''
+
+        # also ends the iterator thread, which stops once the port is closed
+        self._board.exit()
+
+    def _trim_samples(self, keep_after: float, limit: int) -> int:
+        '''Drop the samples taken before 'keep_after', at most the first
+        'limit' of them. Return the number dropped.'''
+
+        with self._samples_lock:
+            count = min(bisect.bisect_left(self._timestamps, keep_after), limit)
+            del self._timestamps[:count]
+            del self._values[:count]
+        return count
+
+    def readings_at(self, times: np.ndarray) -> np.ndarray:
+        '''Readings interpolated at increasing 'times', see TriggerCapture.align.
+        Only the samples around 'times' are copied out.'''
+
+        with self._samples_lock:
+            start = max(bisect.bisect_left(self._timestamps, times[0]) - 1, 0) if len(times) else 0
+            stop = bisect.bisect_right(self._timestamps, times[-1]) + 1 if len(times) else 0
+            timestamps = np.array(self._timestamps[start:stop])
+            values = np.array(self._values[start:stop])
+
+        return resampling.sample_at(timestamps, np.nan_to_num(values, nan=0.0), times)
+
+    def start_recording(self, journal=None):
+        '''Clear the output queue and begin recording.
+
+        Samples are written to 'journal' in batches as they are taken if
+        one is given.
+        '''
+        self._journal = journal
         self._cleared_event.clear()
         self.clear_queue()
         self._cleared_event.wait()
@@ -234,6 +750,10 @@ class _TriggerRecorder(Thread):
     def stop_recording(self):
         self._end_recording_event.set()
 
+    def read(self):
+        '''Most recent value reported by the trigger pin.'''
+        return self._analog_pin.read()
+
     def wait(self):
         self._recording_finished.wait()
 
@@ -244,45 +764,96 @@ class _TriggerRecorder(Thread):
         self._cleared_event.set()
 
     def terminate(self):
+        '''End the thread, finishing a recording in progress first.'''
         self._stop_event.set()
+        self._end_recording_event.set()
+        self._start_recording_event.set()
+
+
+class _DetectionThread(Thread):
+
+    def __init__(self, detector, block_queue: Queue,
+                 read_trigger_at: Callable,
+                 conditioner: 'processor.TriggerConditioner',
+                 out_queue: Queue):
+        '''Thread for feeding captured audio blocks to a streaming damage detector.
+
+        Runs off the audio callback so detection never holds up capture. The
+        trigger is read at the capture time of every frame of a block, with
+        'read_trigger_at', however long the block waited in the queue, and
+        converted to 0/1 by 'conditioner'. Audio is held back until the
+        conditioner has decided the trigger states of its frames.
+        '''
+
+        Thread.__init__(self, daemon=True)
+
+        self._detector = detector
+        self._block_queue = block_queue
+        self._read_trigger_at = read_trigger_at
+        self._conditioner = conditioner
+        self._out_queue = out_queue
+
+    def run(self):
+
+        held = None
+        while True:
+            item = self._block_queue.get()
+            if item is None: break
+
+            block, capture_time = item
+            frame_times = capture_time + np.arange(len(block)) / self._detector.sample_rate
+            states = self._conditioner.push(self._read_trigger_at(frame_times))
+
+            held = block if held is None or len(held) == 0 else np.concatenate((held, block))
+            self._push(held[:len(states)], states)
+            held = held[len(states):]
+
+        if held is not None:
+            self._push(held, self._conditioner.flush())
+
+    def _push(self, block: np.ndarray, trigger_block: np.ndarray):
+        for damage_range in self._detector.push(block, trigger_block):
+            self._out_queue.put(damage_range)
+
+    def stop(self):
+        '''Finish the blocks already queued, then exit.'''
+        self._block_queue.put(None)
 
 
 def match_signals(sig_1, sr_1, sig_2, sr_2):
-    '''Resample signals to use a common samplerate.
+    '''Bring a trigger signal and an audio signal to a common samplerate
+    and length.
 
-    Will resample the arrays provided by reference into this function. Pass
-    a copy into this function to avoid the original array being manipulated.
+    The trigger is interpolated (zero-order hold) onto the common rate and
+    then cut or padded to the length of the audio. The audio is only
+    resampled, with a polyphase filter, if its rate is the lower one.
     
     Parameters
     ----------
     sig_1: ndarray
-        Amplitude data for the first signal
+        Trigger readings
     sr_1: int
-        Samplerate of the first signal
+        Samplerate of the trigger
     sig_2: ndarray
-        Amplitude data for the second signal
+        Amplitude data for the audio
     sr_2: int
-        Samplerate of the seconds signal
+        Samplerate of the audio
 
     Returns
     -------
     sig_1: ndarray
-        First signal adjusted to the common sample rate
+        Trigger at the common sample rate, one reading per audio frame
     sig_2: ndarray
-        Second signal adjusted to the common sample rate
+        Audio at the common sample rate
     common_sr: int
         The common samplerate
     '''
 
     common_sr = max(sr_1, sr_2)
 
-    if len(sig_1) >= len(sig_2):
-
-        sig_2 = resample(sig_2, len(sig_1))
-
-    elif len(sig_1) <= len(sig_2):
-
-        sig_1 = resample(sig_1, len(sig_2))
+    sig_2 = resampling.resample(sig_2, sr_2, common_sr)
+    sig_1 = resampling.interpolate(np.asarray(sig_1, dtype=float), sr_1, common_sr,
+                                   num_samples=len(sig_2), method='hold')
 
     return sig_1, sig_2, common_sr
 
@@ -1,6 +1,7 @@
-
 import os
+import threading
 import yaml
+from dataclasses import dataclass, fields
 
 
 _ABSOLUTE_PATH = os.path.dirname(__file__)
@@ -15,10 +16,45 @@ _DEFAULT_SETTINGS = {
     'trigger_port': 'COM4',
     'trigger_pin': 'a:0:i',
     'audio_device_id': '1',
-    'audio_channels': '2'
+    'audio_channels': '2',
+    'record_to_disk': 'False',
+    'trigger_on_threshold': '300',
+    'trigger_off_threshold': '300',
+    'trigger_debounce_ms': '0'
 }
 
 
+@dataclass(frozen=True)
+class Settings:
+    '''The settings converted to their types. Values in the config file
+    that cannot be converted fall back to their default.'''
+    database_file_name: str
+    save_location: str
+    process_mode: str
+    trigger_port: str
+    trigger_pin: str
+    audio_device_id: int
+    audio_channels: int
+    record_to_disk: bool
+    trigger_on_threshold: float
+    trigger_off_threshold: float
+    trigger_debounce_ms: float
+
+    def trigger_conditioning(self, sample_rate: float) -> dict:
+        '''Keyword arguments for signal_processor.condition_trigger and
+        TriggerConditioner for a trigger sampled at 'sample_rate'.'''
+        return {'on_threshold': self.trigger_on_threshold,
+                'off_threshold': self.trigger_off_threshold,
+                'debounce_frames': int(self.trigger_debounce_ms * sample_rate / 1000)}
+
+
+# the parsed config file, reused for as long as the file is unchanged
+_cache_lock = threading.RLock()
+_cached_signature = None
+_cached_values = None
+_cached_settings = None
+
+
 def __init__():
     # create config file with default settings if no config file exists
     if not os.path.isfile(_CONFIG_FILE_PATH):
@@ -28,46 +64,51 @@ def __init__():
             # try to make the dir if it does not exist
             pass
 
-        with open(_CONFIG_FILE_PATH, 'w') as file:
-
-            # save settings
-            with open(_CONFIG_FILE_PATH, 'w') as file:
-                yaml.dump(_DEFAULT_SETTINGS, file)
-__init__()
+        _write_config_file(dict(_DEFAULT_SETTINGS))
 
 
 def get_setting(name: str):
-    '''Access the config file on disk and return the current value of the
-    specified settings.
+    '''Return the current value of the specified setting.
+
+    The config file is only parsed again when it has changed on disk.
+    Settings missing from an older config file fall back to their default.
     '''
 
-    with open(_CONFIG_FILE_PATH, 'r') as file:
-        settings_file = yaml.safe_load(file)
-        try:
-            return settings_file[name]
-        except KeyError:
-            return ''
+    values = _load()
+    try:
+        return values[name]
+    except KeyError:
+        return _DEFAULT_SETTINGS.get(name, '')
+
+
+def get_settings() -> Settings:
+    '''Return all settings converted to their types (see Settings).'''
+
+    with _cache_lock:
+        _load()
+        return _cached_settings
 
 
 def configure_setting(name: str, value: str):
-    '''Access the config file on disk and update the specified setting to
-    the specified value. 
-    
+    '''Update the specified setting to the specified value.
+
     If the specified setting does not exist in the config file, it is added.
     '''
 
-    settings_file = None
+    configure_settings({name: value})
+
 
-    # load settings from memory
-    with open(_CONFIG_FILE_PATH, 'r') as file:
-        settings_file = yaml.safe_load(file)
-    
-    # edit setting
-    settings_file[name] = str(value)
+def configure_settings(values: dict):
+    '''Update several settings with a single write of the config file.
 
-    # save settings
-    with open(_CONFIG_FILE_PATH, 'w') as file:
-        yaml.dump(settings_file, file)
+    The file is written to a temporary file first and then renamed over the
+    config file, so it is never seen half written.
+    '''
+
+    with _cache_lock:
+        settings_file = dict(_load())
+        settings_file.update({name: str(value) for name, value in values.items()})
+        _write_config_file(settings_file)
 
 
 def _get_settings():
@@ -75,12 +116,75 @@ def _get_settings():
     config file.
     '''
 
-    with open(_CONFIG_FILE_PATH, 'r') as file:
-        return yaml.safe_load(file)
-    
+    return dict(_load())
+
+
+def _load() -> dict:
+    '''The parsed config file, read again only if its modification time,
+    inode or size changed since it was last read. A missing config file is
+    recreated with the default settings.'''
+
+    global _cached_signature, _cached_values, _cached_settings
+
+    with _cache_lock:
+        try:
+            signature = _file_signature()
+        except FileNotFoundError:
+            __init__()
+            signature = _file_signature()
+
+        if signature != _cached_signature:
+            with open(_CONFIG_FILE_PATH, 'r') as file:
+                values = yaml.safe_load(file) or {}
+            _cached_values = values
+            _cached_settings = _typed_settings(values)
+            _cached_signature = signature
+
+        return _cached_values
+
+
+def _file_signature() -> tuple:
+    stat = os.stat(_CONFIG_FILE_PATH)
+    return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+
+def _write_config_file(values: dict):
+    '''Atomically replace the config file and remember what it now holds.'''
+
+    global _cached_signature, _cached_values, _cached_settings
+
+    with _cache_lock:
+        temp_path = _CONFIG_FILE_PATH + '.tmp'
+        with open(temp_path, 'w') as file:
+            yaml.dump(values, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, _CONFIG_FILE_PATH)
+
+        _cached_values = values
+        _cached_settings = _typed_settings(values)
+        _cached_signature = _file_signature()
+
+
+def _typed_settings(values: dict) -> Settings:
+
+    typed = {}
+    for setting in fields(Settings):
+        convert = _to_bool if setting.type is bool else setting.type
+        try:
+            typed[setting.name] = convert(values.get(setting.name, _DEFAULT_SETTINGS[setting.name]))
+        except (TypeError, ValueError):
+            typed[setting.name] = convert(_DEFAULT_SETTINGS[setting.name])
+    return Settings(**typed)
+
+
+def _to_bool(value) -> bool:
+    if isinstance(value, bool): return value
+    if str(value) in ('True', 'False'): return str(value) == 'True'
+    raise ValueError('Not a boolean: ' + str(value))
+
+
 
 if __name__ == '__main__':
 
     pass
-
-    
\ No newline at end of file
@@ -1,12 +1,26 @@
 
-import matplotlib.pyplot as plt
 import numpy as np
 from numpy import ndarray, zeros, insert
 from typing import List, Tuple
+from dataclasses import dataclass, field
 
 
-def detect_damage_analytically(audio_data: ndarray, audio_sample_rate: int, threshold: float = 0.225) -> ndarray:
+# number of chunks whose |x| is materialized at once by _chunk_abs_sums
+_CHUNKS_PER_PASS = 4096
+
+# relative change in mean amplitude that the analytical detector flags as damage
+DAMAGE_THRESHOLD = 0.225
+
+
+def detect_damage_analytically(audio_data: ndarray, audio_sample_rate: int, threshold: float = DAMAGE_THRESHOLD) -> ndarray:
     '''Using analytical means, detects occurrences of damage in the sample.
+
+    The recording is split into 0.2 second chunks starting at the 0.4 second
+    mark. A chunk is flagged as damage when its mean absolute amplitude
+    deviates from the mean absolute amplitude of everything before it (back
+    to the 0.4 second mark) by more than 'threshold'. The running mean is
+    kept as a cumulative sum of chunk sums so a full pass is linear in the
+    length of the recording.
     
     Parameters
     ----------
@@ -33,25 +47,107 @@ def detect_damage_analytically(audio_data: ndarray, audio_sample_rate: int, thre
 
     # Initialize the damage detections array with zeros for the first second
     dmg_detections = np.zeros(len(audio_data), dtype=int)
+    if start_index >= len(audio_data): return dmg_detections
+
+    # sum of |x| for every chunk, and the number of values that went into it
+    chunk_sums = _chunk_abs_sums(audio_data[start_index:], frames_per_qtr_sec)
+    values_per_frame = audio_data[0].size
+    chunk_starts = np.arange(start_index, len(audio_data), frames_per_qtr_sec)
+    chunk_sizes = np.minimum(frames_per_qtr_sec, len(audio_data) - chunk_starts) * values_per_frame
 
     # Detect significant changes in amplitude
-    amp_threshold = .002  # Threshold for minimum amplitude to consider
-    for i in range(start_index, len(audio_data), frames_per_qtr_sec):
-        chunk = audio_data[i:i+frames_per_qtr_sec]
-        chunk_mean = np.mean(np.abs(chunk))
-        if chunk_mean < amp_threshold:
-            dmg_detections[i:i+frames_per_qtr_sec] = 0
-            continue
-        if i >= start_index + frames_per_qtr_sec:  # Start averaging after 0.4 seconds
-            avg_amplitude = np.mean(np.abs(audio_data[start_index:i]))
-            if abs(chunk_mean - avg_amplitude) > threshold * avg_amplitude:
-                # Timestamp every frame 0.2 seconds after the detected frame
-                for j in range(i, min(i + frames_per_qtr_sec, len(audio_data))):
-                    dmg_detections[j] = 1
+    chunk_detections, _ = _detect_chunks(chunk_sums, chunk_sizes,
+                                         first_chunk=0,
+                                         preceding_sum=0.0,
+                                         full_chunk_size=frames_per_qtr_sec * values_per_frame,
+                                         threshold=threshold)
+
+    # Timestamp every frame 0.2 seconds after the detected frame
+    dmg_detections[start_index:] = np.repeat(chunk_detections, frames_per_qtr_sec)[:len(audio_data) - start_index]
 
     return dmg_detections
 
 
+def _detect_chunks(chunk_sums: ndarray,
+                   chunk_sizes: ndarray,
+                   first_chunk: int,
+                   preceding_sum: float,
+                   full_chunk_size: int,
+                   threshold: float) -> Tuple[ndarray, float]:
+    '''Decide which chunks of a recording contain damage.
+
+    Compares the mean |x| of each chunk with the mean |x| of all chunks
+    before it. Chunks may be handed over a few at a time as long as each
+    call continues from the previous one.
+
+    Parameters
+    ----------
+    chunk_sums: ndarray
+        Sum of |x| over each chunk
+    chunk_sizes: ndarray
+        Number of values summed for each chunk
+    first_chunk: int
+        Index of the first chunk in this call, counted from the 0.4 second mark
+    preceding_sum: float
+        Sum of |x| over all chunks before 'first_chunk'
+    full_chunk_size: int
+        Number of values in every chunk but the last one of the recording
+    threshold: float
+        See detect_damage_analytically
+
+    Return
+    ------
+    chunk_detections: ndarray
+        True for each chunk found to contain damage
+    preceding_sum: float
+        Sum of |x| over all chunks up to and including this call's
+    '''
+    chunk_means = chunk_sums / chunk_sizes
+
+    # mean of everything between the 0.4 second mark and the start of each chunk
+    running_sums = np.cumsum(np.concatenate(([preceding_sum], chunk_sums)))[1:]
+    preceding_sums = running_sums - chunk_sums
+    preceding_sizes = np.arange(first_chunk, first_chunk + len(chunk_sums)) * full_chunk_size
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_amplitudes = preceding_sums / preceding_sizes
+
+    amp_threshold = .002  # Threshold for minimum amplitude to consider
+    chunk_detections = np.abs(chunk_means - avg_amplitudes) > threshold * avg_amplitudes
+    chunk_detections &= chunk_means >= amp_threshold
+    if first_chunk == 0 and len(chunk_detections):
+        chunk_detections[0] = False  # Start averaging after 0.4 seconds
+
+    if len(running_sums): preceding_sum = float(running_sums[-1])
+    return chunk_detections, preceding_sum
+
+
+def _chunk_abs_sums(audio_data: ndarray, chunk_width: int) -> ndarray:
+    '''Sum the absolute amplitude of every 'chunk_width' sized chunk of the
+    audio data, across all channels.
+
+    Sums are accumulated in float64 and the input is handled a few thousand
+    chunks at a time so the temporary |x| array stays small no matter how
+    long the recording is.
+
+    Return
+    ------
+    chunk_sums: ndarray
+        One value per chunk; the last chunk may be shorter than 'chunk_width'.
+    '''
+    num_chunks = -(-len(audio_data) // chunk_width)
+    chunk_sums = np.empty(num_chunks)
+
+    for first_chunk in range(0, num_chunks, _CHUNKS_PER_PASS):
+        last_chunk = min(first_chunk + _CHUNKS_PER_PASS, num_chunks)
+        block = np.abs(audio_data[first_chunk * chunk_width:last_chunk * chunk_width])
+        offsets = np.arange(0, len(block), chunk_width)
+        sums = np.add.reduceat(block, offsets, axis=0, dtype=np.float64)
+        if sums.ndim > 1: sums = sums.sum(axis=1)
+        chunk_sums[first_chunk:last_chunk] = sums
+
+    return chunk_sums
+
+
 def detect_damage_with_AI(audio_data: ndarray, audio_sample_rate: int) -> ndarray:
     '''Using machine learning, detects occurances of damage in the sample.
     
@@ -72,6 +168,166 @@ def detect_damage_with_AI(audio_data: ndarray, audio_sample_rate: int) -> ndarra
     return None
 
 
+@dataclass
+class TriggerSignal:
+    '''Conditioned trigger channel.
+
+    'states' holds the 0/1 trigger state of every frame. 'rising_edges' and
+    'falling_edges' hold the frame indices where the state changes from 0 to
+    1 and from 1 to 0, which is enough to rebuild 'states' (see
+    trigger_from_edges) for a fraction of the memory. score_damage works
+    from the edges.
+    '''
+    states: ndarray
+    rising_edges: ndarray
+    falling_edges: ndarray
+
+    def __len__(self):
+        return len(self.states)
+
+
+def condition_trigger(raw_trigger: ndarray,
+                      on_threshold: float = 300,
+                      off_threshold: float = None,
+                      debounce_frames: int = 0,
+                      full_scale: float = 1023) -> TriggerSignal:
+    '''Convert raw trigger pin readings into a clean 0/1 trigger channel.
+
+    Readings are scaled by 'full_scale' (pyfirmata reports analog pins as
+    0.0-1.0) before they are compared to the thresholds. Missing readings
+    (None or nan) count as 0. A recording handed over in blocks is
+    conditioned the same way by a TriggerConditioner.
+
+    Parameters
+    ----------
+    raw_trigger: ndarray
+        One reading per frame, 'frames' or 'frames x 1'
+    on_threshold: float, optional
+        A reading at or above this level turns the trigger on
+    off_threshold: float, optional
+        A reading below this level turns the trigger off. Readings between
+        the two thresholds keep the previous state. Defaults to
+        'on_threshold', i.e. no hysteresis.
+    debounce_frames: int, optional
+        A state has to last at least this many frames to be accepted,
+        shorter blips keep the state that came before them.
+    full_scale: float, optional
+        Multiplier applied to the readings before thresholding
+
+    Return
+    ------
+    trigger: TriggerSignal
+        Dense 0/1 states along with the rising and falling edge indices
+    '''
+
+    conditioner = TriggerConditioner(on_threshold, off_threshold, debounce_frames, full_scale)
+    states = np.concatenate((conditioner.push(raw_trigger), conditioner.flush()))
+    rising_edges, falling_edges = _find_edges(states)
+    return TriggerSignal(states, rising_edges, falling_edges)
+
+
+class TriggerConditioner:
+    '''condition_trigger for a recording handed over in blocks.
+
+    Raw readings are given to 'push' in order and the states of the frames
+    decided so far are returned. A frame is only decided once the run of
+    states it belongs to has lasted 'debounce_frames' or has ended, so up to
+    'debounce_frames' - 1 frames are held back between calls; 'flush'
+    returns them. Together the returned states are identical to what
+    condition_trigger gives for the whole recording.
+    '''
+
+    def __init__(self,
+                 on_threshold: float = 300,
+                 off_threshold: float = None,
+                 debounce_frames: int = 0,
+                 full_scale: float = 1023):
+
+        if off_threshold is None:
+            off_threshold = on_threshold
+        if off_threshold > on_threshold:
+            raise ValueError('off_threshold must not be above on_threshold.')
+
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.debounce_frames = int(debounce_frames)
+        self.full_scale = full_scale
+
+        # state last decided by the thresholds, and of the last run long enough to be accepted
+        self._state = False
+        self._stable_state = False
+
+        # the run of states still open at the end of the last block
+        self._run_state = False
+        self._run_length = 0
+        self._run_emitted = 0
+
+    def push(self, raw_block: ndarray) -> ndarray:
+        '''Condition the next block of readings. Return the 0/1 states of
+        the frames decided so far that were not returned before.'''
+
+        values = np.ravel(np.asarray(raw_block, dtype=float)) * self.full_scale
+        values = np.nan_to_num(values, nan=0.0)
+        if len(values) == 0: return np.zeros(0, dtype=int)
+
+        # hysteresis, readings between the thresholds hold the last decided state
+        high = values >= self.on_threshold
+        decided = high | (values < self.off_threshold)
+        last_decided = np.maximum.accumulate(np.where(decided, np.arange(len(values)), -1))
+        states = np.where(last_decided >= 0, high[np.maximum(last_decided, 0)], self._state)
+        self._state = bool(states[-1])
+
+        if self.debounce_frames <= 1:
+            return states.astype(int)
+
+        # debounce, runs shorter than the limit take the state of the last long run
+        held = self._run_length - self._run_emitted
+        states = np.concatenate((np.full(held, self._run_state), states))
+        run_starts, run_ends = _find_runs(states)
+        run_lengths = run_ends - run_starts
+        if self._run_length and states[0] == self._run_state:
+            run_lengths[0] += self._run_emitted
+
+        stable = run_lengths >= self.debounce_frames
+        last_stable = np.maximum.accumulate(np.where(stable, np.arange(len(run_starts)), -1))
+        run_states = np.where(last_stable >= 0, states[run_starts[np.maximum(last_stable, 0)]], self._stable_state)
+
+        # the last run may still go on, it is only returned once it is long enough
+        decided_runs = len(run_starts) if stable[-1] else len(run_starts) - 1
+        self._stable_state = bool(run_states[-1])
+        self._run_state = bool(states[-1])
+        self._run_length = int(run_lengths[-1])
+        self._run_emitted = self._run_length if stable[-1] else 0
+
+        return np.repeat(run_states[:decided_runs], run_ends[:decided_runs] - run_starts[:decided_runs]).astype(int)
+
+    def flush(self) -> ndarray:
+        '''States of the frames held back, the recording has ended.'''
+
+        held = self._run_length - self._run_emitted
+        states = np.full(held, self._stable_state).astype(int)
+        self._run_length = self._run_emitted = 0
+        return states
+
+
+def trigger_from_edges(rising_edges: ndarray, falling_edges: ndarray, num_frames: int) -> ndarray:
+    '''Rebuild the per-frame 0/1 trigger states from edge indices. The
+    trigger is off before the first edge.'''
+
+    steps = np.zeros(num_frames + 1, dtype=int)
+    np.add.at(steps, np.asarray(rising_edges, dtype=int), 1)
+    np.add.at(steps, np.asarray(falling_edges, dtype=int), -1)
+    return np.cumsum(steps[:-1])
+
+
+def _find_edges(states: ndarray, initial_state: int = 0, offset: int = 0) -> Tuple[ndarray, ndarray]:
+    '''Frame indices where a 0/1 signal rises and falls. The signal is taken
+    to be in 'initial_state' before its first frame, whose index is 'offset'.'''
+
+    steps = np.diff(np.asarray(states, dtype=int), prepend=int(initial_state))
+    return np.flatnonzero(steps > 0) + offset, np.flatnonzero(steps < 0) + offset
+
+
 def score_damage(dmg_detections: ndarray, trigger_detections: ndarray, sampleRate: int) -> ndarray:
     '''Analyzes damage detections alongside trigger detections to rate and score the
     occurances of damage in the sample.
@@ -88,15 +344,22 @@ def score_damage(dmg_detections: ndarray, trigger_detections: ndarray, sampleRat
     seconds or less beyond the point when trigger transitions to 'off'
     Class 4: Damage is detected while the trigger is 'on' and persists for 
     longer than 5 seconds beyond the point when trigger transitions to 'off'
+
+    Damage found while the trigger is off but before its first on-to-off
+    transition is left as class 0.
+
+    If the trigger turned off at least once, damage_score[0] is overwritten
+    with a trigger noise value of 100 minus twice the number of transitions.
     
     Parameters
     ----------
     dmg_detections: ndarray
         An array representing damage occurances on a per-frame basis. A 1 indicates damage
         found to be present within that frame, a 0 indicates the opposite.
-    trigger_detections: ndarray
+    trigger_detections: ndarray or TriggerSignal
         An array representing detections of a trigger signal on a per-frame basis. 1 indicates
-        signal-active, 0 indicates signal-inactive
+        signal-active, 0 indicates signal-inactive. A TriggerSignal from condition_trigger is
+        scored from its edges without looking at its states.
     sampleRate:
         The rate at which the trigger signal is being operated. Needs to be converted to time in order to evaluate.
 
@@ -105,77 +368,415 @@ def score_damage(dmg_detections: ndarray, trigger_detections: ndarray, sampleRat
     damage_score: ndarray
         An array which contains the damage rating/score for each frame in the input sample. Values
         in this array may be 0-4 indicating the class of damage present in each sample. 
+    consecutive_scores: list[tuple]
+        (start_time, end_time, score) for every run of at least two identical scores.
     '''
+
+    # trigger data may arrive as an 'n x 1' column
+    dmg_detections = np.ravel(dmg_detections)
+    if isinstance(trigger_detections, TriggerSignal):
+        rising_edges, falling_edges = trigger_detections.rising_edges, trigger_detections.falling_edges
+    else:
+        trigger_detections = np.ravel(trigger_detections)
+        rising_edges, falling_edges = _find_edges(trigger_detections > 0.5)
     
     if len(dmg_detections) != len(trigger_detections):
         raise ValueError("Arrays must be the same size.")
 
-    damage_score = zeros(len(dmg_detections))
-    scoring_difference = 0
-    trigger_noise = 0
-    trigger_on = False
-    trigger_on_frame = -1
-    trigger_off_frame = -1
-
-    # Calculate the number of frames corresponding to 5 seconds
-    num_frames_5_seconds = sampleRate * 5
-
-
-    duration_of_test = len(dmg_detections)/sampleRate
-
-    for i in range(len(dmg_detections)):
-        if trigger_detections[i] == 1:
-            trigger_on = True
-            trigger_on_frame = i # i-(5 seconds) ?
-
-        if trigger_detections[i] == 0:
-            trigger_on = False
-        
-        if i >= 2 and trigger_detections[i] == 0 and trigger_detections[i-1] == 1:
-            trigger_noise += 1
-            trigger_off_frame = i #most recent high to low frame signal from the ttl
-
-        if(trigger_off_frame > 0):
-            time_from_off_frame = ((i/sampleRate) - (trigger_off_frame/sampleRate))
-
-        if dmg_detections[i] == 0 and not trigger_on and trigger_off_frame < 0:
-            damage_score[i] = 0
-        
-        elif dmg_detections[i] == 0 and trigger_on:
-            damage_score[i] = 1
-        elif dmg_detections[i] == 0 and not trigger_on and i - trigger_on_frame > 1 and time_from_off_frame < 5: # 1 frame difference
-            damage_score[i] = 2
-        elif dmg_detections[i] == 1 and not trigger_on and time_from_off_frame >= 5: # 5 second difference
-            damage_score[i] = 4
-        elif dmg_detections[i] == 1 and not trigger_on:
-            damage_score[i] = 3
-        
+    scoring_state = _ScoringState()
+    damage_score = _classify_frames(dmg_detections, rising_edges, falling_edges, sampleRate, scoring_state)
+
+    trigger_noise = scoring_state.trigger_noise
     if(trigger_noise > 0):
         trigger_noise = 100 - (trigger_noise*2)
         damage_score[0] = trigger_noise   #becasue this number will always be insignificant
 
     #OUTPUT CONFIG
     #if there are at least two identical consecutive scorings , range of the score will be packed as a tuple and included in the output. Format: [start_time_ms, end_time_ms, score]
-    consecutive_scores = []
-    start_index = 0
-    for i in range(1, len(damage_score)):
-        if damage_score[i] != damage_score[i-1]:
-            if start_index != i - 1:
-                # Found a range of consecutive scores
-                consecutive_scores.append((start_index/sampleRate, i/sampleRate, damage_score[start_index]))
-            start_index = i
-
-    # Check for the last range if it continues to the end
-    if start_index != len(damage_score) - 1:
-        consecutive_scores.append((start_index/sampleRate, duration_of_test, damage_score[start_index]))
+    run_starts, run_ends = _find_runs(damage_score)
+    long_runs = run_ends - run_starts > 1
+    consecutive_scores = [
+        (start/sampleRate, end/sampleRate, damage_score[start])
+        for start, end in zip(run_starts[long_runs].tolist(), run_ends[long_runs].tolist())
+    ]
 
     return damage_score, consecutive_scores
+
+
+@dataclass
+class _ScoringState:
+    '''Trigger state carried from one block of frames to the next while scoring.'''
+    frames_scored: int = 0
+    trigger_on: bool = False
+    trigger_on_frame: int = -1
+    trigger_off_frame: int = -1
+    trigger_noise: int = 0
+
+
+def _classify_frames(dmg_detections: ndarray,
+                     rising_edges: ndarray,
+                     falling_edges: ndarray,
+                     sampleRate: int,
+                     state: _ScoringState) -> ndarray:
+    '''Assign damage classes 0-4 to a block of frames (see score_damage).
     
-    # I believe this should work, but I am under the assumption that larger sampling rates would make for much larger length input arrays. Not something I can create by hand in main lol
+    The trigger is given by the indices of the frames in the block where it
+    turns on and off, in frames of the whole recording. The block continues
+    where the previous block scored with 'state' left off, and 'state' is
+    updated to the end of this block. The trigger noise value is not
+    written into the output.
+    '''
+
+    frames = np.arange(state.frames_scored, state.frames_scored + len(dmg_detections))
+    rising_edges = np.asarray(rising_edges, dtype=int)
+    falling_edges = np.asarray(falling_edges, dtype=int)
+
+    # edges alternate, so the trigger is on wherever more have risen than fallen
+    rises_so_far = np.searchsorted(rising_edges, frames, side='right')
+    falls_so_far = np.searchsorted(falling_edges, frames, side='right')
+    trigger_on = int(state.trigger_on) + rises_so_far - falls_so_far > 0
+
+    # last frame the trigger was on, the one before its latest falling edge while off
+    latest_fall = _latest_edge(falling_edges, frames, -1)
+    trigger_on_frame = np.where(trigger_on, frames,
+                                np.where(latest_fall >= 0, latest_fall - 1, state.trigger_on_frame))
+
+    # high to low edges of the ttl, ignoring the first two frames
+    off_edges = falling_edges[falling_edges >= 2]
+    trigger_off_frame = _latest_edge(off_edges, frames, state.trigger_off_frame) #most recent high to low frame
+    trigger_was_off = trigger_off_frame >= 0
+    time_from_off_frame = (frames / sampleRate) - (trigger_off_frame / sampleRate)
+
+    no_damage = dmg_detections == 0
+    damage = dmg_detections == 1
+    trigger_off = ~trigger_on
+
+    # conditions are checked in order, first match wins
+    damage_score = np.select(
+        [
+            no_damage & trigger_off & ~trigger_was_off,
+            no_damage & trigger_on,
+            no_damage & trigger_off & (frames - trigger_on_frame > 1) & (time_from_off_frame < 5), # 1 frame difference
+            damage & trigger_off & trigger_was_off & (time_from_off_frame >= 5), # 5 second difference
+            damage & trigger_off & trigger_was_off,
+        ],
+        [0, 1, 2, 4, 3],
+        default=0
+    ).astype(float)
+
+    if len(frames):
+        state.frames_scored = int(frames[-1]) + 1
+        state.trigger_on = bool(trigger_on[-1])
+        state.trigger_on_frame = int(trigger_on_frame[-1])
+        state.trigger_off_frame = int(trigger_off_frame[-1])
+        state.trigger_noise += len(off_edges)
+
+    return damage_score
+
+
+def _latest_edge(edges: ndarray, frames: ndarray, default: int) -> ndarray:
+    '''For every frame the latest of the sorted 'edges' at or before it, or
+    'default' if there is none.'''
+
+    if len(edges) == 0: return np.full(len(frames), default)
+    count = np.searchsorted(edges, frames, side='right')
+    return np.where(count > 0, edges[np.maximum(count - 1, 0)], default)
+
+
+def _find_runs(values: ndarray) -> Tuple[ndarray, ndarray]:
+    '''Run-length encode an array.
     
+    Return
+    ------
+    run_starts: ndarray
+        Index of the first element of every run of identical values
+    run_ends: ndarray
+        Index one past the last element of every run
+    '''
+    if len(values) == 0: return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    boundaries = np.flatnonzero(values[1:] != values[:-1]) + 1
+    run_starts = np.concatenate(([0], boundaries))
+    run_ends = np.concatenate((boundaries, [len(values)]))
+    return run_starts, run_ends
+
+
+class BlockDamageDetector:
+    '''detect_damage_analytically for a recording handed over in blocks.
+
+    Blocks of audio are given to 'push' in order. Each 0.2 second chunk is
+    judged as soon as it is complete, so the detections returned for a
+    block lag it by at most one partial chunk; 'flush' returns the rest.
+    Only that partial chunk of audio is held between calls, plus one flag
+    per chunk judged, so memory use does not grow with the recording.
+
+    All the detections returned, joined together, are identical to what
+    detect_damage_analytically gives for the whole recording.
+    '''
+
+    def __init__(self, sample_rate: int, threshold: float = DAMAGE_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+
+        self._chunk_width = int(0.2 * sample_rate)
+        self._start_index = int(0.4 * sample_rate)
+
+        self._lead_in_remaining = self._start_index
+        self._pending_audio = None
+        self._values_per_frame = None
+
+        self._chunk_detections = bytearray()
+        self._preceding_sum = 0.0
+        self.frames_detected = 0
+        self._is_flushed = False
+
+    def push(self, audio_block: ndarray) -> ndarray:
+        '''Add the next 'frames' or 'frames x channels' block of audio.
+
+        Return
+        ------
+        dmg_detections: ndarray
+            0/1 detections for the frames following those returned so far,
+            as far as they can be decided yet
+        '''
+        if self._is_flushed: raise Exception('Detector has already been flushed.')
+
+        if self._values_per_frame is None and len(audio_block):
+            self._values_per_frame = audio_block[0].size
+            self._pending_audio = np.zeros((0,) + audio_block.shape[1:], dtype=audio_block.dtype)
+
+        detections = []
+
+        # nothing can be damage before the 0.4 second mark
+        if self._lead_in_remaining:
+            lead_in = min(self._lead_in_remaining, len(audio_block))
+            self._lead_in_remaining -= lead_in
+            audio_block = audio_block[lead_in:]
+            detections.append(np.zeros(lead_in, dtype=int))
+        if len(audio_block):
+            self._pending_audio = np.concatenate((self._pending_audio, audio_block))
+
+        # judge every complete chunk
+        num_chunks = len(self._pending_audio) // self._chunk_width if self._pending_audio is not None else 0
+        if num_chunks:
+            chunk_audio = self._pending_audio[:num_chunks * self._chunk_width]
+            self._pending_audio = self._pending_audio[num_chunks * self._chunk_width:]
+            detections.append(self._judge_chunks(chunk_audio))
+
+        return self._emit(detections)
+
+    def flush(self) -> ndarray:
+        '''Judge whatever is left of the recording and return its detections.'''
+
+        detections = []
+        if not self._is_flushed:
+            if self._pending_audio is not None and len(self._pending_audio):
+                detections.append(self._judge_chunks(self._pending_audio))
+                self._pending_audio = self._pending_audio[:0]
+            self._is_flushed = True
+        return self._emit(detections)
+
+    def get_detections(self) -> ndarray:
+        '''Per-frame detections for everything judged so far, rebuilt from
+        the per-chunk flags.'''
+
+        chunk_detections = np.frombuffer(bytes(self._chunk_detections), dtype=np.uint8).astype(int)
+        dmg_detections = np.zeros(self.frames_detected, dtype=int)
+        if self.frames_detected > self._start_index:
+            dmg_detections[self._start_index:] = np.repeat(chunk_detections, self._chunk_width)[:self.frames_detected - self._start_index]
+        return dmg_detections
+
+    def _emit(self, detections: list) -> ndarray:
+        detections = np.concatenate(detections) if detections else np.zeros(0, dtype=int)
+        self.frames_detected += len(detections)
+        return detections
+
+    def _judge_chunks(self, chunk_audio: ndarray) -> ndarray:
+
+        first_chunk = len(self._chunk_detections)
+        chunk_sums = _chunk_abs_sums(chunk_audio, self._chunk_width)
+        chunk_sizes = np.full(len(chunk_sums), self._chunk_width)
+        chunk_sizes[-1] = len(chunk_audio) - (len(chunk_sums) - 1) * self._chunk_width
+        chunk_sizes *= self._values_per_frame
+
+        chunk_detections, self._preceding_sum = _detect_chunks(chunk_sums, chunk_sizes,
+                                                               first_chunk=first_chunk,
+                                                               preceding_sum=self._preceding_sum,
+                                                               full_chunk_size=self._chunk_width * self._values_per_frame,
+                                                               threshold=self.threshold)
+        self._chunk_detections.extend(chunk_detections.astype(np.uint8).tobytes())
+
+        return np.repeat(chunk_detections.astype(int), self._chunk_width)[:len(chunk_audio)]
+
+
+class BlockDamageScorer:
+    '''score_damage for detections and trigger states handed over in blocks.
+
+    The trigger state is carried from one block to the next, and only one
+    entry per change of class is kept, so memory use does not depend on the
+    length of the recording.
+    '''
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+
+        self._state = _ScoringState()
+        self._runs = []  # [start_frame, end_frame, score] for every run of scores so far
+        self._runs_reported = 0
+
+    @property
+    def frames_scored(self) -> int:
+        return self._state.frames_scored
+
+    @property
+    def current_class(self) -> float:
+        '''Class of the most recently scored frame, or None before any frame was scored.'''
+        if not self._runs: return None
+        return self._runs[-1][2]
+
+    def push(self, dmg_detections: ndarray, trigger_detections: ndarray) -> List[tuple]:
+        '''Score the next block of frames.
+
+        Return
+        ------
+        ranges: list[tuple]
+            (start_time, end_time, score) for each run of at least two
+            identical scores that ended within this block
+        '''
+
+        dmg_detections = np.ravel(dmg_detections)
+        trigger_detections = np.ravel(trigger_detections)
+        if len(dmg_detections) != len(trigger_detections):
+            raise ValueError("Arrays must be the same size.")
+
+        first_frame = self._state.frames_scored
+        rising_edges, falling_edges = _find_edges(trigger_detections > 0.5, self._state.trigger_on, first_frame)
+        damage_score = _classify_frames(dmg_detections, rising_edges, falling_edges, self.sample_rate, self._state)
+
+        run_starts, run_ends = _find_runs(damage_score)
+        for start, end in zip(run_starts.tolist(), run_ends.tolist()):
+            score = damage_score[start]
+            if self._runs and self._runs[-1][2] == score and self._runs[-1][1] == first_frame + start:
+                self._runs[-1][1] = first_frame + end
+            else:
+                self._runs.append([first_frame + start, first_frame + end, score])
+
+        # every run but the last one is finished
+        closed = self._runs[self._runs_reported:-1]
+        self._runs_reported = max(self._runs_reported, len(self._runs) - 1)
+
+        return [(start/self.sample_rate, end/self.sample_rate, score)
+                for start, end, score in closed if end - start > 1]
+
+    def finish(self) -> List[tuple]:
+        '''The consecutive_scores score_damage gives for all frames pushed.'''
+
+        runs = [list(run) for run in self._runs]
+
+        # score_damage writes the trigger noise value over the first frame
+        trigger_noise = self._state.trigger_noise
+        if trigger_noise > 0 and runs:
+            start, end, score = runs[0]
+            runs[0:1] = [[0, 1, 100 - (trigger_noise*2)]] + ([[1, end, score]] if end > 1 else [])
+
+            if len(runs) > 1 and runs[0][2] == runs[1][2]:
+                runs[0:2] = [[0, runs[1][1], runs[1][2]]]
+
+        return [(start/self.sample_rate, end/self.sample_rate, score)
+                for start, end, score in runs if end - start > 1]
+
+
+class StreamingDamageDetector:
+    '''Runs detect_damage_analytically and score_damage on a recording while it
+    is still being captured (or while it is read back block by block).
+
+    Blocks of audio (and optionally the matching trigger samples) are handed
+    to 'push' in the order they were recorded. Every 0.2 second chunk is
+    judged as soon as it is complete (BlockDamageDetector), and the frames
+    it covers are scored right away (BlockDamageScorer), so a class change
+    is reported at most one chunk plus one block after it happens.
+
+    Once 'flush' has been called, 'get_detections' and the returned ranges
+    are identical to what detect_damage_analytically and score_damage give
+    for the whole recording.
+    '''
+
+    def __init__(self, sample_rate: int, threshold: float = DAMAGE_THRESHOLD):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+
+        self._detector = BlockDamageDetector(sample_rate, threshold)
+        self._scorer = BlockDamageScorer(sample_rate)
+
+        # trigger samples of frames not judged yet
+        self._pending_trigger = np.zeros(0)
+        self._is_flushed = False
+
+    @property
+    def current_class(self) -> float:
+        '''Class of the most recently scored frame, or None before any frame was scored.'''
+        return self._scorer.current_class
+
+    def push(self, audio_block: ndarray, trigger_block: ndarray = None) -> List[tuple]:
+        '''Add the next block of the recording.
+
+        Parameters
+        ----------
+        audio_block: ndarray
+            'frames' or 'frames x channels' amplitude data
+        trigger_block: ndarray, optional
+            0/1 trigger state for each frame of the block. Treated as all 0
+            (trigger off) if not given.
+
+        Return
+        ------
+        ranges: list[tuple]
+            (start_time, end_time, score) for each run of at least two
+            identical scores that ended within this block.
+        '''
+        if self._is_flushed: raise Exception('Detector has already been flushed.')
+
+        if trigger_block is None:
+            trigger_block = np.zeros(len(audio_block))
+        trigger_block = np.ravel(trigger_block)
+        if len(trigger_block) != len(audio_block):
+            raise ValueError("Arrays must be the same size.")
+
+        self._pending_trigger = np.concatenate((self._pending_trigger, trigger_block))
+        return self._score(self._detector.push(audio_block))
+
+    def flush(self) -> List[tuple]:
+        '''Judge whatever is left of the recording and finish scoring it.
+
+        Return
+        ------
+        consecutive_scores: list[tuple]
+            The same (start_time, end_time, score) ranges score_damage gives
+            for the whole recording.
+        '''
+        if not self._is_flushed:
+            self._score(self._detector.flush())
+            self._is_flushed = True
+
+        return self._scorer.finish()
+
+    def get_detections(self) -> ndarray:
+        '''Per-frame damage detections for everything judged so far, as
+        returned by detect_damage_analytically.'''
+        return self._detector.get_detections()
+
+    def _score(self, dmg_detections: ndarray) -> List[tuple]:
+
+        trigger_detections = self._pending_trigger[:len(dmg_detections)]
+        self._pending_trigger = self._pending_trigger[len(dmg_detections):]
+        return self._scorer.push(dmg_detections, trigger_detections)
+
 
 def plot_dmg_data(audio_data, dmg_data, elapsed_time, audio_downsample_factor=50):
-    
+
+    # only needed for plotting, and slow to import
+    import matplotlib.pyplot as plt
+
     # Generate time axis
     audio_downsampled = audio_data[::audio_downsample_factor]
     time_axis = np.linspace(0, elapsed_time, len(audio_downsampled))
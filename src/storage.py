@@ -1,23 +1,258 @@
 import sqlite3
 import os
+import re
+import json
+import hashlib
 import datetime
+import struct
+import time
+import threading
+import warnings
 import numpy
-import taglib
+import yaml
 import settings
+import resampling
+import signal_processor as processor
 
-from scipy.io import wavfile
+from tag_query import compile_query
 from dataclasses import dataclass, field
 from numpy import ndarray
+from queue import Queue, Full
+from threading import Thread
+from contextlib import contextmanager
+
+
+@dataclass
+class ChannelRuns:
+    """A per-frame channel that changes value rarely (the 0/1 trigger, the
+    damage detections) held as the frames where its value changes.
+
+    Attributes
+    ----------
+    num_frames: int
+        Length of the channel in frames
+    starts: ndarray
+        First frame of each run, starting with 0
+    values: ndarray
+        Value of each run
+    """
+
+    num_frames: int
+    starts: ndarray
+    values: ndarray
+
+    @classmethod
+    def from_dense(cls, channel: ndarray) -> 'ChannelRuns':
+        channel = numpy.ravel(channel)
+        if len(channel) == 0:
+            return cls(0, numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0))
+
+        starts = numpy.concatenate(([0], numpy.flatnonzero(channel[1:] != channel[:-1]) + 1))
+        return cls(len(channel), starts.astype(numpy.int64), channel[starts].astype(numpy.float64))
+
+    @classmethod
+    def join(cls, parts: list) -> 'ChannelRuns':
+        '''Runs of consecutive pieces of a channel, as one channel.'''
+
+        starts, values = [], []
+        offset = 0
+        previous = None
+        for part in parts:
+            part_starts, part_values = part.starts + offset, part.values
+
+            # a run carrying on from the previous piece is not a new run
+            if previous is not None and len(part_values) and part_values[0] == previous:
+                part_starts, part_values = part_starts[1:], part_values[1:]
+
+            starts.append(part_starts)
+            values.append(part_values)
+            offset += part.num_frames
+            if len(part.values): previous = part.values[-1]
+
+        if not parts: return cls.from_dense(numpy.zeros(0))
+        return cls(offset, numpy.concatenate(starts).astype(numpy.int64), numpy.concatenate(values))
+
+    def run_lengths(self) -> ndarray:
+        return numpy.diff(self.starts, append=self.num_frames)
+
+    def dense_range(self, start: int, stop: int) -> ndarray:
+        '''Dense values of frames 'start' up to 'stop', expanding only the
+        runs that overlap them.'''
+
+        start, stop = max(start, 0), min(stop, self.num_frames)
+        if stop <= start: return numpy.zeros(0, dtype=self.values.dtype)
+
+        first = numpy.searchsorted(self.starts, start, side='right') - 1
+        last = numpy.searchsorted(self.starts, stop, side='left')
+        starts = numpy.maximum(self.starts[first:last], start) - start
+        return numpy.repeat(self.values[first:last], numpy.diff(starts, append=stop - start))
+
+    def to_dense(self) -> ndarray:
+        return numpy.repeat(self.values, self.run_lengths())
+
+    def __len__(self):
+        return self.num_frames
 
 
 @dataclass
 class DmgData:
-    """Data class for serving test data between modules"""
+    """Data class for serving test data between modules.
+
+    'trigger_data' and 'output_data' hold one value per audio frame. Data
+    read from a file keeps them as ChannelRuns, which are only expanded to
+    dense arrays the first time they are accessed. 'audio_data' is
+    'frames x channels' and may be a read-only memory map of the file.
+    """
     sample_rate: int = None
     audio_data: ndarray = None
-    trigger_data: ndarray = None
-    output_data: ndarray = None
     is_processed: bool = False
+    _trigger: object = field(default=None, repr=False)
+    _output: object = field(default=None, repr=False)
+
+    @property
+    def trigger_data(self) -> ndarray:
+        if isinstance(self._trigger, ChannelRuns):
+            self._trigger = self._trigger.to_dense()
+        return self._trigger
+
+    @trigger_data.setter
+    def trigger_data(self, trigger_data):
+        self._trigger = trigger_data
+
+    @property
+    def output_data(self) -> ndarray:
+        if isinstance(self._output, ChannelRuns):
+            self._output = self._output.to_dense()
+        return self._output
+
+    @output_data.setter
+    def output_data(self, output_data):
+        self._output = output_data
+
+    def audio_channel(self, index: int) -> ndarray:
+        '''One audio channel as a strided view of 'audio_data', without
+        copying it (or reading a mapped file beyond what is used).'''
+        return self.audio_data[:, index]
+
+    @property
+    def trigger_runs(self) -> ChannelRuns:
+        '''The trigger as ChannelRuns, without expanding it.'''
+        return _channel_runs(self._trigger)
+
+    @property
+    def output_runs(self) -> ChannelRuns:
+        '''The detections as ChannelRuns, without expanding them.'''
+        return _channel_runs(self._output)
+
+
+def _channel_runs(channel) -> ChannelRuns:
+    if channel is None or isinstance(channel, ChannelRuns): return channel
+    return ChannelRuns.from_dense(channel)
+
+
+@dataclass
+class DataBlock:
+    """A stretch of a stored test's data, see DatabaseManager.iter_blocks.
+
+    Attributes
+    ----------
+    start_frame: int
+        Index in the recording of the first frame of the block
+    overlap_frames: int
+        Number of frames at the start of the block that ended the previous
+        block as well
+    sample_rate: int
+        Frames per second
+    audio: ndarray
+        'frames x channels' audio
+    trigger: ndarray
+        Trigger value of each frame
+    output: ndarray
+        Detection of each frame, or None if the test was not processed
+    """
+
+    start_frame: int
+    overlap_frames: int
+    sample_rate: int
+    audio: ndarray
+    trigger: ndarray
+    output: ndarray = None
+
+    def without_overlap(self) -> 'DataBlock':
+        '''The part of the block not shared with the previous block.'''
+
+        skip = self.overlap_frames
+        return DataBlock(self.start_frame + skip, 0, self.sample_rate,
+                         self.audio[skip:], self.trigger[skip:],
+                         None if self.output is None else self.output[skip:])
+
+
+@dataclass
+class TestSummary:
+    """Figures describing a test's recorded data, kept in the 'test' table so
+    they can be listed, sorted and filtered without opening the data file.
+
+    Attributes
+    ----------
+    sample_count: int
+        Number of frames recorded
+    sample_rate: int
+        Frames per second
+    channel_count: int
+        Number of audio channels
+    duration: float
+        Length of the recording in seconds
+    peak_level: float
+        Largest absolute audio sample, in the audio's own units
+    rms_level: float
+        Root mean square of all audio samples
+    is_processed: bool
+        Whether the file holds an output channel
+    trigger_active_time: float
+        Seconds during which the trigger was on
+    """
+
+    sample_count: int = None
+    sample_rate: int = None
+    channel_count: int = None
+    duration: float = None
+    peak_level: float = None
+    rms_level: float = None
+    is_processed: bool = False
+    trigger_active_time: float = None
+
+
+@dataclass
+class DamageEvent:
+    """A range of frames given one damage class by score_damage.
+
+    Attributes
+    ----------
+    start_s: float
+        Start of the range in seconds from the start of the recording
+    end_s: float
+        End of the range in seconds
+    damage_class: int
+        Class 1-4 (see signal_processor.score_damage)
+    detector: str
+        Process mode that produced the detections, e.g. 'ANALYTICAL'
+    params_hash: str
+        Hash of the detector's parameters (see damage_params_hash), telling
+        apart results of the same detector run with different settings
+    test_id: int
+        Test the event belongs to, once saved
+    """
+
+    start_s: float
+    end_s: float
+    damage_class: int
+    detector: str = None
+    params_hash: str = None
+    test_id: int = None
+
+    @property
+    def duration(self) -> float:
+        return self.end_s - self.start_s
 
 
 @dataclass
@@ -40,8 +275,16 @@ class TestEntry:
         was first saved.
     data_file_path: str
         Path to file in which test data is saved 
+    summary: TestSummary
+        Figures describing the recorded data, or None if nothing has been
+        saved (or an older test has not been backfilled yet).
+    damage_events: list[DamageEvent]
+        Results of the last processing run not yet written to the database.
+        None once they are stored (or if the test was never processed).
     data: DmgData
-        Recorded audio and trigger data
+        Recorded audio and trigger data. For a test loaded from the database
+        the file is memory-mapped the first time this is accessed, so only
+        the parts of the recording that are used are read.
     """
 
     id: int = None
@@ -50,13 +293,42 @@ class TestEntry:
     tags: list = None
     creation_date: datetime.datetime = None
     data_file_path: str = None
-    data: DmgData = None
+    summary: TestSummary = None
+    damage_events: list = field(default=None, repr=False, compare=False)
+    _data: DmgData = field(default=None, repr=False, compare=False)
+    _data_loaded: bool = field(default=False, repr=False, compare=False)
+
+    @property
+    def data(self) -> DmgData:
+        if not self._data_loaded:
+            self.load_data(mmap=True)
+        return self._data
+
+    @data.setter
+    def data(self, data: DmgData):
+        self._data = data
+        self._data_loaded = True
+
+    def load_data(self, mmap: bool = False) -> DmgData:
+        '''Read the recorded data from 'data_file_path' now.
+
+        With 'mmap' the samples are memory-mapped rather than read into
+        memory, which suits long recordings that are only partly used. The
+        mapped audio is read-only.
+        '''
+        if self.data_file_path:
+            self._data = _read_test_data_from_file(self.data_file_path, mmap=mmap)
+        self._data_loaded = True
+        return self._data
 
 
 class DatabaseManager:
     def __init__(self):
         self._active_test = None
 
+        # one connection per thread, reopened after the database is reconfigured
+        self._local = threading.local()
+
     def get_active_test(self):
         return self._active_test
 
@@ -84,15 +356,12 @@ class DatabaseManager:
             found or None if entry matching provided name does not exist.
         '''
 
-        con = _connect()
-
-        test_id = _read_test_id_by_name(con, name)
-        test_entry = self.load_existing_test_by_id(test_id)
+        with self.transaction() as con:
+            test_id = _read_test_id_by_name(con, name)
+            test_entry = self.load_existing_test_by_id(test_id)
 
         self._active_test = test_entry
 
-        con.close()
-
         return self._active_test
 
     def load_existing_test_by_id(self, id: int) -> TestEntry:
@@ -108,80 +377,158 @@ class DatabaseManager:
 
         '''
 
-        con = _connect()
-        cur = con.cursor()
+        with self.transaction() as con:
+            cur = con.cursor()
+
+            test_entry = self._active_test
+
+            # a finalized recording is mapped from its own file until it is saved
+            recording_file = _recording_file_of(test_entry._data)
+
+            # check if test with name exists
+            sql = """
+                    SELECT id
+                    FROM test
+                    WHERE name=?
+                """
+            existing_test = cur.execute(sql, (test_entry.name,)).fetchone()
+
+            if existing_test == None:
+                # insert if no test with matching name exists
+                test_id, data_file_path = _create_test(con,
+                                       name=test_entry.name,
+                                       creation_date=test_entry.creation_date,
+                                       notes=test_entry.notes)
+                test_entry.id = test_id
+                test_entry.data_file_path = data_file_path
+
+                if test_entry._data:
+                    test_entry.summary = _save_test_data_to_file(path=data_file_path,
+                                                                 data=test_entry._data,)
+                    _update_test_summary(con, test_entry.id, test_entry.summary)
+                _update_tag_links(con, test_entry.id, test_entry.tags)
+                self._store_damage_events(con, test_entry)
+
+            else:
+                # update if yes
+                test_entry.id = existing_test[0]
+                
+                _update_test_by_name(con,
+                             name=test_entry.name,
+                             notes=test_entry.notes)
+                
+                # overrite data in file if it was loaded or replaced
+                if test_entry._data:
+                    test_entry.summary = _save_test_data_to_file(path=test_entry.data_file_path,
+                                                                 data=test_entry._data)
+                    _update_test_summary(con, test_entry.id, test_entry.summary)
+                
+                _update_tag_links(con, test_entry.id, test_entry.tags)
+                self._store_damage_events(con, test_entry)
+
+        # map the audio from the test's file instead, the recording file is
+        # then no longer needed (or removed on the next start if still mapped)
+        if recording_file and test_entry.data_file_path:
+            saved = _read_test_data_from_file(test_entry.data_file_path, mmap=True)
+            if saved is not None:
+                test_entry._data.audio_data = saved.audio_data
+                _remove_file(recording_file)
+
+    def record_damage_events(self,
+                             consecutive_scores: list[tuple],
+                             detector: str,
+                             params: dict = None,
+                             test_entry: TestEntry = None):
+        '''Keep the result of processing a test (the active one by default)
+        as DamageEvent rows.
+
+        The (start_time, end_time, score) ranges from score_damage with a
+        class of 1-4 replace any earlier results for the test. They are
+        written right away if the test is already saved, otherwise with its
+        next save.
 
-        test_entry = self._active_test
+        Parameters
+        ----------
+        consecutive_scores: list[tuple]
+            Ranges returned by score_damage
+        detector: str
+            Process mode the detections came from
+        params: dict, optional
+            Detector parameters, stored as a hash (see damage_params_hash)
+        test_entry: TestEntry, optional
+            Test the ranges belong to, if not the active test
+        '''
 
-        # check if test with name exists
-        sql = """
-                SELECT id
-                FROM test
-                WHERE name=?
-            """
-        existing_test = cur.execute(sql, (test_entry.name,)).fetchone()
-
-        if existing_test == None:
-            # insert if no test with matching name exists
-            test_id, data_file_path = _create_test(con,
-                                   name=test_entry.name,
-                                   creation_date=test_entry.creation_date,
-                                   notes=test_entry.notes)
-            test_entry.id = test_id
-
-            if test_entry.data:
-                _save_test_data_to_file(path=data_file_path,
-                                        data=test_entry.data,)
-            _update_tag_links(con, test_entry.id, test_entry.tags)
+        if test_entry is None: test_entry = self._active_test
+        if test_entry is None: return
 
-        else:
-            # update if yes
-            test_entry.id = _read_test_id_by_name(con, test_entry.name)
-            
-            _update_test_by_name(con,
-                         name=test_entry.name,
-                         notes=test_entry.notes)
-            
-            # overrite data in file
-            if test_entry.data:
-                _save_test_data_to_file(path=test_entry.data_file_path,
-                                        data=test_entry.data)
-            
-            _update_tag_links(con, test_entry.id, test_entry.tags)
+        params_hash = damage_params_hash(params)
+        test_entry.damage_events = [
+            DamageEvent(start_s=float(start), end_s=float(end), damage_class=int(score),
+                        detector=detector, params_hash=params_hash)
+            for start, end, score in consecutive_scores
+            if score in DAMAGE_CLASSES
+        ]
+
+        if test_entry.id is not None:
+            with self.transaction() as con:
+                self._store_damage_events(con, test_entry)
+
+    def list_damage_events(self,
+                           test_id: int = None,
+                           damage_class: int = None,
+                           min_duration: float = None) -> list[DamageEvent]:
+        '''Return stored damage events, optionally only those of one test,
+        of one class and/or lasting longer than 'min_duration' seconds,
+        ordered by test and start time.'''
+
+        with self.transaction() as con:
+            return _read_damage_events(con, test_id, damage_class, min_duration)
+
+    def list_tests_with_damage(self, damage_class: int, min_duration: float = 0.0) -> list[TestEntry]:
+        '''Return the tests with at least one event of 'damage_class' lasting
+        longer than 'min_duration' seconds, e.g. all tests with class 4
+        damage longer than 2 s. No data files are read.'''
+
+        with self.transaction() as con:
+            test_ids = _read_test_ids_with_damage(con, damage_class, min_duration)
+            if not test_ids: return []
+            rows = _read_test_summaries(con, test_ids=test_ids)
 
-        con.commit()
-        con.close()
+        return [_test_entry_from_summary(row) for row in rows]
 
     def delete_active_test_entry(self):
         '''Deletes only the test entry currently loaded in the DatabaseManager'''
         
-        con = _connect()
+        # release a memory map of the test's file so it can be removed
+        recording_file = _recording_file_of(self._active_test._data)
+        self._active_test._data = None
+        if recording_file: _remove_file(recording_file)
+
+        with self.transaction() as con:
 
-        # check if test has been assigned an entry in the database tables 
-        test_id = _read_test_id_by_name(con, self._active_test.name)
+            # check if test has been assigned an entry in the database tables 
+            test_id = _read_test_id_by_name(con, self._active_test.name)
 
-        # delete it
-        if test_id:
-            self._delete_entry_by_id(test_id)
+            # delete it
+            if test_id:
+                self._delete_entry_by_id(test_id)
 
         # reset manager
         self._active_test = None
-        con.commit()
-        con.close()
 
     def delete_test_entry_by_name(self, name: str):
         '''Deletes the specific entry in storage specified'''
         
-        con = _connect()
-
-        test_id = _read_test_id_by_name(con, name)
-        if test_id: self._delete_entry_by_id(test_id)
-
-        con.commit()
-        con.close()
+        with self.transaction() as con:
+            test_id = _read_test_id_by_name(con, name)
+            if test_id: self._delete_entry_by_id(test_id)
 
     def discard_active_entry(self):
+        # a discarded recording is not recovered on the next start
+        recording_file = _recording_file_of(self._active_test._data) if self._active_test else None
         self._active_test = None
+        if recording_file: _remove_file(recording_file)
 
     def create_new_tag(self, value: str):
         '''Create a new tag with the specified value.
@@ -191,16 +538,13 @@ class DatabaseManager:
         Otherwise, add tag and return value.
         '''
 
-        con = _connect()
-
-        try:
-            _create_tag(con, value)
-        
-        except DatabaseError:
-            value = None
+        with self.transaction() as con:
+            try:
+                _create_tag(con, value)
+            
+            except DatabaseError:
+                value = None
 
-        con.commit()
-        con.close()
         return value
     
     def list_test_ids(self) -> list[int]:
@@ -212,152 +556,370 @@ class DatabaseManager:
             A list containing all unique entries stored in the database.    
         '''
 
-        con = _connect()
-        existing_test_ids = _read_all_test_ids(con)
+        with self.transaction() as con:
+            existing_test_ids = _read_all_test_ids(con)
         return existing_test_ids
 
+    def list_tests(self,
+                   tags: list[str] = None,
+                   test_ids: list[int] = None,
+                   order_by: str = 'id',
+                   descending: bool = False) -> list[TestEntry]:
+        '''Return the metadata of every test, or of the tests linked to any of
+        'tags' and/or with an id in 'test_ids', in one query. Data files are
+        not read (see TestEntry.data).
+
+        Tests can be sorted by 'id', 'name', 'created' or any TestSummary
+        field; tests without a summary come last.
+
+        Return
+        ------
+        tests: list[TestEntry]
+            Matching tests, with their tags and summary filled in.
+        '''
+
+        with self.transaction() as con:
+            rows = _read_test_summaries(con, tag_values=tags, test_ids=test_ids,
+                                        order_by=order_by, descending=descending)
+
+        return [_test_entry_from_summary(row) for row in rows]
+
+    def iter_blocks(self, test_id: int, block_seconds: float = 10.0, overlap: float = 0.0):
+        '''Read a stored test's data from disk a block at a time.
+
+        Each block holds aligned audio, trigger and output for
+        'block_seconds' of the recording (the last may be shorter), preceded
+        by the last 'overlap' seconds of the previous block. Only one block
+        is read into memory at a time, so e.g. a StreamingDamageDetector fed
+        with block.without_overlap() processes a recording of any length
+        with bounded memory.
+
+        Yields
+        ------
+        block: DataBlock
+        '''
+
+        with self.transaction() as con:
+            path = _read_data_file_path_by_id(con, test_id)
+        if path is None:
+            raise DatabaseError('No test with id {}'.format(test_id))
+
+        yield from _iter_test_data_blocks(path, block_seconds, overlap)
+
     def list_tests_by_tags(self, tags: list[str]) -> list[TestEntry]:
         '''Return a list of tests for all entries in the database which are linked
         to any of the tags provided.'''
 
-        con = _connect()
+        if not tags: return None
 
-        tests = []
+        tests = self.list_tests(tags=tags)
+        if tests == []: return None
+        return tests
 
-        if tags:
-            for tag in tags:
-                # get tests linked to tag
-                linked_test_ids = _read_test_ids_linked_to_tag(con, tag)
+    def query_tests(self, tag_query: str, ids_only: bool = False) -> list:
+        '''Return the tests matching a boolean tag query such as
+        '(range-A OR range-B) AND drill AND NOT calibration AND
+        created >= 2024-01-01' (see tag_query). Data files are not read.
 
-                # load and add test if not already added
-                if linked_test_ids:
-                    for id in linked_test_ids:
-                        test = self._load_test_by_id(id)
-                        if test not in tests: tests.append(test)
+        Raises tag_query.TagQueryError if the query cannot be parsed.
 
-        con.close()
-        if tests == []: return None
-        return tests
+        Return
+        ------
+        tests: list[TestEntry] or list[int]
+            Matching tests ordered by id, or only their ids with 'ids_only'
+        '''
+
+        with self.transaction() as con:
+            if ids_only:
+                return _read_test_ids_by_query(con, tag_query)
+            rows = _read_test_summaries(con, tag_query=tag_query)
+
+        return [_test_entry_from_summary(row) for row in rows]
+
+    def search(self, query: str, limit: int = 50, offset: int = 0) -> list[TestEntry]:
+        '''Return tests whose name, notes or tags match every word of 'query'.
+
+        Words match as prefixes, so partial input already finds results.
+        Results are ranked with name matches first, then tags, then notes.
+        An empty query lists every test by id.
+
+        Parameters
+        ----------
+        query: str
+            Words to look for
+        limit: int, optional
+            Largest number of tests to return
+        offset: int, optional
+            Number of results to skip, for paging
+
+        Return
+        ------
+        tests: list[TestEntry]
+            Matching tests, without their data loaded
+        '''
+
+        with self.transaction() as con:
+            if not re.search(r'\w', query):
+                rows = _read_test_summaries(con, limit=limit, offset=offset)
+                return [_test_entry_from_summary(row) for row in rows]
+
+            test_ids = _search_test_ids(con, query, limit, offset)
+            rows = _read_test_summaries(con, test_ids=test_ids)
+
+        # keep the ranking
+        tests = {row[0]: _test_entry_from_summary(row) for row in rows}
+        return [tests[test_id] for test_id in test_ids if test_id in tests]
 
     def list_existing_tags(self) -> list[str]:
         '''Return a list of all tag values currently in the database'''
-        con = _connect()
 
-        tag_list = _read_all_tag_values(con)
-
-        con.commit()
-        con.close()
+        with self.transaction() as con:
+            tag_list = list(_read_tag_ids(con))
 
+        if tag_list == []: return None
         return tag_list
 
     def delete_tag_by_value(self, value: str):
-        con = _connect()
 
-        tag_id = _read_tag_id_by_value(con, value)
-        _delete_tag_by_id(con, tag_id)
-        _delete_tag_links_by_tag_id(con, tag_id)
+        with self.transaction() as con:
+            tag_id = _read_tag_id_by_value(con, value)
+            _delete_tag_by_id(con, tag_id)
+            _delete_tag_links_by_tag_id(con, tag_id)
 
-        con.commit()
-        con.close()
+    def recover_interrupted_recordings(self, on_error=None) -> list[TestEntry]:
+        '''Turn recordings left behind by a crash into test entries.
 
-    def _load_test_by_name(self, name: str):
+        Journals of interrupted recordings are finalized into .dmg files, and
+        finalized recordings that were never saved (see finalize_recording)
+        are moved into place. Each becomes a new test named after the
+        recording. A journal or recording file is only removed once its test
+        has been committed.
 
-        con = _connect()
+        Parameters
+        ----------
+        on_error: callable, optional
+            Called as on_error(path, error) with a DatabaseError for each
+            journal or recording file that could not be recovered, after
+            which the others are still tried. Without it the DatabaseError
+            is raised.
 
-        test_id = _read_test_id_by_name(con, name)
+        Return
+        ------
+        recovered: list[TestEntry]
+            The tests created, without their data loaded.
+        '''
 
-        test_entry = None
+        recovered = []
+        sources = ([(path, _JOURNAL_EXTENSION) for path in list_journals()]
+                   + [(path, _RECORDING_EXTENSION) for path in list_recording_files()])
 
-        if test_id:
-            test_entry = self._load_test_by_id(test_id)
+        for source_path, extension in sources:
+            name = os.path.basename(source_path)[:-len(extension)]
+            written_path = None
 
-        con.close()
+            try:
+                with self.transaction() as con:
+                    if _read_test_id_by_name(con, name) is not None:
+                        name = name + '_' + datetime.datetime.now().strftime("%H%M%S")
+
+                    test_id, data_file_path = _create_test(con,
+                                                           name=name,
+                                                           creation_date=datetime.datetime.now(),
+                                                           notes='Recovered from an interrupted recording.')
+                    full_path = os.path.join(_files_location(), data_file_path)
+
+                    if extension == _JOURNAL_EXTENSION:
+                        summary = finalize_journal(source_path, data_file_path, delete_journal=False)
+                    else:
+                        summary = _summarize_test_data(_read_test_data_from_file(os.path.basename(source_path), mmap=True))
+                        os.replace(source_path, full_path)
+                    written_path = full_path
+                    _update_test_summary(con, test_id, summary)
+
+            except Exception as e:
+                # the journal or recording file is kept for the next attempt
+                if written_path is not None:
+                    if extension == _JOURNAL_EXTENSION: _remove_file(written_path)
+                    else: os.replace(written_path, source_path)
+
+                error = DatabaseError('Could not recover {}: {}'.format(source_path, e))
+                if on_error is None: raise error from e
+                on_error(source_path, error)
+                continue
+
+            if extension == _JOURNAL_EXTENSION: _remove_journal(source_path)
+            recovered.append(self._quick_load_test_by_id(test_id))
+
+        return recovered
+
+    def backfill_test_summaries(self, progress=None) -> int:
+        '''Compute the summary of every test saved before summaries were kept.
+
+        Each data file is memory-mapped and scanned once, and each summary is
+        committed on its own, so the job can be stopped and run again later.
+        Tests whose file is missing are left without a summary.
 
-        return test_entry
+        Parameters
+        ----------
+        progress: callable, optional
+            Called as progress(done, total) after each test
 
-    def _load_test_by_id(self, id: int):
+        Return
+        ------
+        count: int
+            Number of summaries written
+        '''
+
+        with self.transaction() as con:
+            pending = _read_tests_without_summary(con)
+
+        count = 0
+        for done, (test_id, data_file_path) in enumerate(pending, start=1):
+            data = _read_test_data_from_file(data_file_path, mmap=True) if data_file_path else None
+            if data is not None:
+                summary = _summarize_test_data(data)
+                del data
+                with self.transaction() as con:
+                    _update_test_summary(con, test_id, summary)
+                count += 1
+            if progress is not None:
+                progress(done, len(pending))
+
+        return count
+
+    @contextmanager
+    def transaction(self):
+        '''Context manager that runs the enclosed statements as one transaction
+        on this thread's connection, which it yields.
+
+        The transaction is committed when the block exits and rolled back if
+        it raises. Nested blocks join the outermost transaction.
+        '''
+
+        con = self._connection()
+        local = self._local
+
+        if local.depth:
+            local.depth += 1
+            try:
+                yield con
+            finally:
+                local.depth -= 1
+            return
 
+        local.depth = 1
+        try:
+            yield con
+            con.commit()
+        except BaseException:
+            con.rollback()
+            # the tag cache may hold rows that were just rolled back
+            _invalidate_tag_cache()
+            raise
+        finally:
+            local.depth = 0
+
+    def close(self):
+        '''Close the connection held for the calling thread.'''
+
+        con = getattr(self._local, 'con', None)
+        if con is not None:
+            con.close()
+            self._local.con = None
+
+    def _connection(self) -> sqlite3.Connection:
+        '''Connection held for the calling thread, opened on first use.'''
+
+        local = self._local
+        con = getattr(local, 'con', None)
+
+        # a transaction in progress keeps its connection
+        if con is not None and (local.depth or local.generation == _generation):
+            return con
+
+        if con is not None: con.close()
         con = _connect()
-        test_row = _read_test_by_id(con, id)
-        if test_row == None: return None
-
-        test_entry = TestEntry()
-        test_entry.id = test_row[0]
-        test_entry.name = test_row[1]
-        test_entry.creation_date = test_row[2]
-        test_entry.notes = test_row[3]
-        test_entry.data_file_path = test_row[4]
-        
-        test_entry.data = _read_test_data_from_file(test_entry.data_file_path)
-        linked_tag_ids = _read_linked_tag_ids_by_test_id(con, test_entry.id)
+        if con is None: raise DatabaseError('Could not connect to the database.')
+        local.con = con
+        local.generation = _generation
+        local.depth = 0
+
+        return con
+
+    def _load_test_by_name(self, name: str):
+
+        with self.transaction() as con:
+            test_id = _read_test_id_by_name(con, name)
+
+            test_entry = None
 
-        if linked_tag_ids:
-            test_entry.tags = []
-            for id in linked_tag_ids:
-                test_entry.tags.append(_read_tag_value_by_tag_id(con, id))
+            if test_id:
+                test_entry = self._load_test_by_id(test_id)
 
-        con.close()
         return test_entry
+
+    def _load_test_by_id(self, id: int):
+        '''Load a test's metadata. Its data file is read when 'data' is
+        first accessed.'''
+        return self._quick_load_test_by_id(id)
     
     def _quick_load_test_by_id(self, id: int):
 
-        con = _connect()
-        test_row = _read_test_by_id(con, id)
-        if test_row == None: return None
-
-        test_entry = TestEntry()
-        test_entry.id = test_row[0]
-        test_entry.name = test_row[1]
-        test_entry.creation_date = test_row[2]
-        test_entry.notes = test_row[3]
-        test_entry.data_file_path = test_row[4]
-        
-        #test_entry.data = _read_data_from_file(test_entry.data_file_path)
-        linked_tag_ids = _read_linked_tag_ids_by_test_id(con, test_entry.id)
+        tests = self.list_tests(test_ids=[id])
+        if tests == []: return None
+        return tests[0]
+    
+    def _store_damage_events(self, con: sqlite3.Connection, test_entry: TestEntry):
+        '''Replace a saved test's damage events with its pending ones, if any.'''
 
-        if linked_tag_ids:
-            test_entry.tags = []
-            for id in linked_tag_ids:
-                test_entry.tags.append(_read_tag_value_by_tag_id(con, id))
+        if test_entry.damage_events is None: return
+
+        _replace_damage_events(con, test_entry.id, test_entry.damage_events)
+        for event in test_entry.damage_events:
+            event.test_id = test_entry.id
+        test_entry.damage_events = None
 
-        con.close()
-        return test_entry
-    
     def _delete_entry_by_id(self, test_id):
 
-        con = _connect()
+        with self.transaction() as con:
 
-        if (test_id != None):
+            if (test_id != None):
 
-            test_info = _read_test_by_id(con, test_id)
+                test_info = _read_test_by_id(con, test_id)
 
-            # delete the test meta data from database
-            _delete_test_by_id(con, test_id)
+                # delete the test meta data from database
+                _delete_test_by_id(con, test_id)
 
-            # delete tag links referencing this test
-            _delete_tag_links_by_test_id(con, test_id)
+                # delete tag links and processing results referencing this test
+                _delete_tag_links_by_test_id(con, test_id)
+                _delete_damage_events_by_test_id(con, test_id)
 
-            # delete relevant test files
-            path = test_info[4]
-            files_location = os.path.join(settings.get_setting('save_location'), 'files')
-            file_path = os.path.join(files_location, path)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
- 
-        con.commit()
-        con.close()
+                # delete relevant test files
+                path = test_info[4]
+                file_path = os.path.join(_files_location(), path)
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
     
 
+# storage locations, read from the settings on first use and replaced by configure()
+_generation = 0
+_database_file = None
+_files_folder = None
+_locations_lock = threading.RLock()
+
+# statements kept prepared on each connection
+_CACHED_STATEMENTS = 256
+
+
 def _connect() -> sqlite3.Connection:
     """Form connection to the database"""
 
     con = None
     try:
-        db_file_location = os.path.join(settings.get_setting('save_location'), 'db')
-        db_file = os.path.join(db_file_location, settings.get_setting('database_file_name'))
-        con = sqlite3.connect(db_file,
+        con = sqlite3.connect(_database_file_path(),
                                detect_types=sqlite3.PARSE_DECLTYPES |
-                                            sqlite3.PARSE_COLNAMES)
+                                            sqlite3.PARSE_COLNAMES,
+                               cached_statements=_CACHED_STATEMENTS)
         
     except Exception as e:
         print('<_connect()> connection to database failed')
@@ -367,7 +929,8 @@ def _connect() -> sqlite3.Connection:
 
 
 def _initialize_database_tables(con: sqlite3.Connection):
-    """Set up the database tables.
+    """Set up the database tables, or bring an existing database up to the
+    current schema version.
     
     Parameters
     ----------
@@ -376,6 +939,35 @@ def _initialize_database_tables(con: sqlite3.Connection):
     """
 
     con.execute("PRAGMA foreign_keys = ON")
+    _migrate(con)
+
+
+def _migrate(con: sqlite3.Connection):
+    '''Apply every migration newer than the database's schema version.
+
+    The version is kept in the database's user_version. Each migration runs
+    in its own transaction together with the version bump, so an interrupted
+    upgrade resumes where it stopped.
+    '''
+
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise DatabaseError('Database was created by a newer version (schema {}).'.format(version))
+
+    for number, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+        con.execute("BEGIN")
+        try:
+            migration(con)
+            con.execute("PRAGMA user_version = {}".format(number))
+            con.commit()
+        except BaseException:
+            con.rollback()
+            _invalidate_tag_cache()
+            raise
+
+
+def _migration_create_tables(con: sqlite3.Connection):
+    '''Schema 1: the original tables.'''
 
     query = ('''
                 CREATE TABLE IF NOT EXISTS test (
@@ -406,24 +998,211 @@ def _initialize_database_tables(con: sqlite3.Connection):
             ''')
     con.execute(query)
 
-    con.commit()
 
+def _migration_add_indexes(con: sqlite3.Connection):
+    '''Schema 2: unique indexes on test names, tag values and tag links, and
+    lookup indexes on creation date and linked tag.
+
+    Duplicates that older versions may have let through are merged first:
+    links to a duplicated tag move to the oldest tag with that value,
+    repeated links are dropped, and later tests sharing a name get their
+    id appended to it.
+    '''
+
+    con.execute("""
+                   UPDATE test_tag
+                   SET tag_id = (SELECT MIN(original.id)
+                                 FROM tag AS original
+                                 JOIN tag AS duplicate ON duplicate.value = original.value
+                                 WHERE duplicate.id = test_tag.tag_id)
+                   WHERE tag_id NOT IN (SELECT MIN(id) FROM tag GROUP BY value)
+                """)
+    con.execute("DELETE FROM tag WHERE id NOT IN (SELECT MIN(id) FROM tag GROUP BY value)")
+    con.execute("""
+                   DELETE FROM test_tag
+                   WHERE rowid NOT IN (SELECT MIN(rowid) FROM test_tag GROUP BY test_id, tag_id)
+                """)
+    con.execute("""
+                   UPDATE test
+                   SET name = name || ' (' || id || ')'
+                   WHERE id NOT IN (SELECT MIN(id) FROM test GROUP BY name)
+                """)
+
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS test_name ON test(name)")
+    con.execute("CREATE INDEX IF NOT EXISTS test_created ON test(created)")
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS tag_value ON tag(value)")
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS test_tag_link ON test_tag(test_id, tag_id)")
+    con.execute("CREATE INDEX IF NOT EXISTS test_tag_tag_id ON test_tag(tag_id)")
+
+
+def _migration_add_search_index(con: sqlite3.Connection):
+    '''Schema 3: full text index over test names, notes and tag values.
+
+    'test_search' holds one row per test (rowid = test id) and is kept in
+    sync by triggers on test, test_tag and tag. It is skipped if the SQLite
+    library was built without FTS5, in which case search falls back to
+    LIKE matching.
+    '''
+
+    try:
+        con.execute("""
+                       CREATE VIRTUAL TABLE IF NOT EXISTS test_search
+                       USING fts5(name, notes, tags, tokenize = 'unicode61 remove_diacritics 2')
+                    """)
+    except sqlite3.OperationalError:
+        return
+
+    # joined tag values of one test
+    test_tags = """(SELECT group_concat(tag.value, ' ')
+                    FROM test_tag
+                    JOIN tag ON tag.id = test_tag.tag_id
+                    WHERE test_tag.test_id = {})"""
+
+    con.execute("""
+                   CREATE TRIGGER IF NOT EXISTS test_search_insert AFTER INSERT ON test BEGIN
+                       INSERT INTO test_search(rowid, name, notes, tags)
+                       VALUES (new.id, new.name, new.notes, {});
+                   END
+                """.format(test_tags.format('new.id')))
+    con.execute("""
+                   CREATE TRIGGER IF NOT EXISTS test_search_update AFTER UPDATE OF name, notes ON test BEGIN
+                       UPDATE test_search SET name = new.name, notes = new.notes
+                       WHERE rowid = new.id;
+                   END
+                """)
+    con.execute("""
+                   CREATE TRIGGER IF NOT EXISTS test_search_delete AFTER DELETE ON test BEGIN
+                       DELETE FROM test_search WHERE rowid = old.id;
+                   END
+                """)
+    con.execute("""
+                   CREATE TRIGGER IF NOT EXISTS test_search_link AFTER INSERT ON test_tag BEGIN
+                       UPDATE test_search SET tags = {} WHERE rowid = new.test_id;
+                   END
+                """.format(test_tags.format('new.test_id')))
+    con.execute("""
+                   CREATE TRIGGER IF NOT EXISTS test_search_unlink AFTER DELETE ON test_tag BEGIN
+                       UPDATE test_search SET tags = {} WHERE rowid = old.test_id;
+                   END
+                """.format(test_tags.format('old.test_id')))
+    con.execute("""
+                   CREATE TRIGGER IF NOT EXISTS test_search_tag_update AFTER UPDATE OF value ON tag BEGIN
+                       UPDATE test_search SET tags = {}
+                       WHERE rowid IN (SELECT test_id FROM test_tag WHERE tag_id = new.id);
+                   END
+                """.format(test_tags.format('test_search.rowid')))
+    con.execute("""
+                   CREATE TRIGGER IF NOT EXISTS test_search_tag_delete AFTER DELETE ON tag BEGIN
+                       UPDATE test_search SET tags = {}
+                       WHERE rowid IN (SELECT test_id FROM test_tag WHERE tag_id = old.id);
+                   END
+                """.format(test_tags.format('test_search.rowid')))
+
+    # index the tests already stored
+    con.execute("DELETE FROM test_search")
+    con.execute("""
+                   INSERT INTO test_search(rowid, name, notes, tags)
+                   SELECT test.id, test.name, test.notes, {}
+                   FROM test
+                """.format(test_tags.format('test.id')))
+
+
+# columns of 'test' holding a TestSummary, in TestSummary field order
+_SUMMARY_COLUMNS = (
+    ('sample_count', 'INTEGER'),
+    ('sample_rate', 'INTEGER'),
+    ('channel_count', 'INTEGER'),
+    ('duration', 'REAL'),
+    ('peak_level', 'REAL'),
+    ('rms_level', 'REAL'),
+    ('is_processed', 'INTEGER'),
+    ('trigger_active_time', 'REAL'),
+)
+
+
+def _migration_add_summary_columns(con: sqlite3.Connection):
+    '''Schema 4: summary columns on 'test', computed when data is saved.
+
+    Existing tests are left NULL here, as filling them in means reading every
+    data file; DatabaseManager.backfill_test_summaries does that.
+    '''
 
-def configure(save_location=settings.get_setting('save_location'),
-              database_file_name=settings.get_setting('database_file_name')):
+    existing = {row[1] for row in con.execute("PRAGMA table_info(test)")}
+    for name, column_type in _SUMMARY_COLUMNS:
+        if name not in existing:
+            con.execute("ALTER TABLE test ADD COLUMN {} {}".format(name, column_type))
+    con.execute("CREATE INDEX IF NOT EXISTS test_duration ON test(duration)")
+
+
+def _migration_add_damage_events(con: sqlite3.Connection):
+    '''Schema 5: one row per range of frames scored 1-4 by processing.
+
+    Indexed by class together with duration (as the expression end_s -
+    start_s) and by duration alone, so questions like "tests with class 4
+    damage longer than 2 s" are answered from the index.
+    '''
+
+    con.execute("""
+                   CREATE TABLE IF NOT EXISTS damage_event (
+                       id INTEGER PRIMARY KEY,
+                       test_id INTEGER NOT NULL,
+                       start_s REAL NOT NULL,
+                       end_s REAL NOT NULL,
+                       class INTEGER NOT NULL,
+                       detector TEXT,
+                       params_hash TEXT,
+                       FOREIGN KEY(test_id) REFERENCES test(id)
+                   )
+                """)
+    con.execute("CREATE INDEX IF NOT EXISTS damage_event_test ON damage_event(test_id, start_s)")
+    con.execute("CREATE INDEX IF NOT EXISTS damage_event_class ON damage_event(class, (end_s - start_s))")
+    con.execute("CREATE INDEX IF NOT EXISTS damage_event_duration ON damage_event((end_s - start_s))")
+
+
+# applied in order, the schema version is the number of migrations applied
+_MIGRATIONS = [
+    _migration_create_tables,
+    _migration_add_indexes,
+    _migration_add_search_index,
+    _migration_add_summary_columns,
+    _migration_add_damage_events,
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+def configure(save_location: str = None, database_file_name: str = None):
     '''Set up the database in the location indicated by DB_FOLDER_PATH.
     
     User may configure the database at a specified location other than
-    the default location.
+    the default location. Values not given are taken from the settings.
+
+    Nothing needs to be configured before using the database: the location
+    in the settings is set up on first use.
     '''
 
+    if save_location is None: save_location = settings.get_setting('save_location')
+    if database_file_name is None: database_file_name = settings.get_setting('database_file_name')
+
     # update settings
-    settings.configure_setting('save_location', save_location)
-    settings.configure_setting('database_file_name', database_file_name)
+    settings.configure_settings({'save_location': save_location,
+                                 'database_file_name': database_file_name})
+
+    with _locations_lock:
+        _open_locations(save_location, database_file_name)
+
+
+def _open_locations(save_location: str, database_file_name: str):
+    '''Create the storage folders and the database, or upgrade the one there.'''
 
     database_file_path = os.path.join(save_location, 'db')
     files_location = os.path.join(save_location, 'files')
 
+    # open connections are replaced on their next use
+    global _generation, _database_file, _files_folder
+    _generation += 1
+    _database_file = os.path.join(database_file_path, database_file_name)
+    _files_folder = files_location
+
     # create the specified directories
     if not os.path.isdir(database_file_path):
         os.makedirs(database_file_path)
@@ -431,12 +1210,31 @@ def configure(save_location=settings.get_setting('save_location'),
     if not os.path.isdir(files_location):
         os.makedirs(files_location)
 
-    # establish database at specified location
-    db_file = os.path.join(database_file_path, database_file_name)
-    if not os.path.isfile(db_file):
-        con = _connect()
-        _initialize_database_tables(con)
-        con.close()
+    # establish database at specified location, or upgrade the one there
+    con = _connect()
+    _initialize_database_tables(con)
+    con.close()
+
+
+def _files_location() -> str:
+    '''Folder in which test data files are stored.'''
+    if _files_folder is None: _load_locations()
+    return _files_folder
+
+
+def _database_file_path() -> str:
+    '''Path of the database file.'''
+    if _database_file is None: _load_locations()
+    return _database_file
+
+
+def _load_locations():
+    '''Set up the storage locations named in the settings file.'''
+
+    with _locations_lock:
+        if _database_file is None:
+            _open_locations(settings.get_setting('save_location'),
+                            settings.get_setting('database_file_name'))
 
 
 class DatabaseError(Exception):
@@ -451,79 +1249,484 @@ class DatabaseError(Exception):
 
 
 def _save_test_data_to_file(path: str, data: DmgData):
-    '''Save the provided data to a .wav file with the name provided by 'path'.
-
-    The .wav file contains channels for audio, trigger, and output data. The audio
-    can be comprised of multiple channels and it should be indicated via meta tags
-    how many channels are present in the file.
-
-    To indicate whether or not a sample has been processed and contains an output
-    channel, a meta tag is added to designate a file 'processed'
+    '''Save the provided data to a .dmg file with the name provided by 'path'.
+
+    The file is a .wav file of the audio channels in the audio's own dtype
+    (e.g. float32 or int16), with the channel layout in a metadata chunk
+    and the trigger and output channels as runs in a chunk after the audio
+    (see _DmgWriter). It is written in one pass to a temporary file which
+    then replaces any earlier version.
+
+    Return
+    ------
+    summary: TestSummary
+        Summary of the data written, or None if nothing was written
     ''' 
     
-    if (data.trigger_data is None):
+    if (data._trigger is None):
         print('trigger data nonexistent')
 
-    # --------------------------------------------------------------------------------------- TEMPORARY
-    #if (data.trigger_data is not ndarray):
-    #    data.trigger_data = numpy.zeros((len(data.audio_data),1)) # zero-filled test array
-
     # check if audio and trigger data is present 
-    if (data.audio_data is not None) and (data.trigger_data is not None):
+    if (data.audio_data is not None) and (data._trigger is not None):
 
-        # determine number of audio channels
-        num_audio_channels = len(data.audio_data[0])
+        audio = numpy.asarray(data.audio_data)
+        if audio.ndim == 1: audio = audio.reshape(-1, 1)
 
         # confirm audio and trigger have the same length
-        assert len(data.audio_data) == len(data.trigger_data), 'audio and trigger array size mismatch'
+        channels = {_TRIGGER_CHANNEL: data.trigger_runs}
+        assert len(audio) == len(channels[_TRIGGER_CHANNEL]), 'audio and trigger array size mismatch'
 
-        # combine all data channels into single 'n x channel' array
-        wav_channels = numpy.hstack((data.audio_data, data.trigger_data))
-        print(wav_channels[0:10])
         if data.is_processed:
-            assert data.output_data is not None
+            assert data._output is not None
             # add output channel if exists
-            wav_channels = numpy.append(wav_channels, data.output_data, 1)
+            channels[_OUTPUT_CHANNEL] = data.output_runs
+            assert len(audio) == len(channels[_OUTPUT_CHANNEL]), 'audio and output array size mismatch'
 
-            print(wav_channels[0:10])
+        full_path = os.path.join(_files_location(), path)
 
-        # pack wav_channels into a .wav file
-        files_location = os.path.join(settings.get_setting('save_location'), 'files')
-        full_path = os.path.join(files_location, path)
-        wavfile.write(full_path, data.sample_rate, wav_channels)
+        # Windows cannot replace a file that is mapped, so audio mapped from
+        # the file being rewritten is read into memory first
+        if os.name == 'nt' and _is_mapped_from(audio, full_path):
+            audio = numpy.array(audio)
+            data.audio_data = audio
 
-        # edit meta_tags of the file
-        with taglib.File(full_path, save_on_exit = True) as save_file:
-            save_file.tags['CHANNELS'] = [str(num_audio_channels)]
-            save_file.tags['PROCESSED'] = [str(data.is_processed)]
+        # summarised block by block as the file is written, like finalize_journal
+        accumulator = _SummaryAccumulator(data.sample_rate, audio.shape[1], data.is_processed)
+
+        with _DmgWriter(full_path, data.sample_rate, audio.shape[1], len(audio), audio.dtype,
+                        is_processed=data.is_processed) as writer:
+            for start in range(0, len(audio), _WRITE_BLOCK_FRAMES):
+                block = audio[start:start + _WRITE_BLOCK_FRAMES]
+                writer.write_audio(block)
+                accumulator.add(block)
+            writer.channel_runs = channels
+
+        # the trigger is counted run by run
+        trigger = channels[_TRIGGER_CHANNEL]
+        accumulator.trigger_active_count = int(trigger.run_lengths()[trigger.values > 0.5].sum())
+
+        return accumulator.summary()
 
     else: 
         print('<save_test_data_to_file> Error saving data.')
+        return None
+
+
+# frames written at a time, so mapped audio is paged through rather than
+# copied whole
+_WRITE_BLOCK_FRAMES = 1 << 18
+
+
+def _is_mapped_from(array: ndarray, full_path: str) -> bool:
+    '''Whether 'array' is (a view of) a memory map of the file at 'full_path'.'''
+
+    filename = getattr(array, 'filename', None)
+    return filename is not None and os.path.abspath(filename) == os.path.abspath(full_path)
+
+
+class _SummaryAccumulator:
+    '''Builds a TestSummary from data handed over in one or more blocks of
+    frames, so long recordings can be summarised while they are written.'''
+
+    def __init__(self, sample_rate: int, channel_count: int, is_processed: bool):
+        self.sample_rate = sample_rate
+        self.channel_count = channel_count
+        self.is_processed = is_processed
+        self.sample_count = 0
+        self.peak_level = 0.0
+        self.sum_of_squares = 0.0
+        self.trigger_active_count = 0
+
+    def add(self, audio_block: ndarray, trigger_block: ndarray = None):
+        if len(audio_block) == 0: return
+
+        audio_block = numpy.asarray(audio_block, dtype=numpy.float64).ravel()
+        self.sample_count += len(audio_block) // max(self.channel_count, 1)
+        self.peak_level = max(self.peak_level, float(numpy.max(numpy.abs(audio_block))))
+        self.sum_of_squares += float(numpy.dot(audio_block, audio_block))
+
+        # the trigger is stored as 0/1 states
+        if trigger_block is not None:
+            self.trigger_active_count += int(numpy.count_nonzero(numpy.asarray(trigger_block) > 0.5))
+
+    def summary(self) -> TestSummary:
+        num_values = self.sample_count * self.channel_count
+        return TestSummary(sample_count=self.sample_count,
+                           sample_rate=self.sample_rate,
+                           channel_count=self.channel_count,
+                           duration=self.sample_count / self.sample_rate if self.sample_rate else 0.0,
+                           peak_level=self.peak_level,
+                           rms_level=float(numpy.sqrt(self.sum_of_squares / num_values)) if num_values else 0.0,
+                           is_processed=self.is_processed,
+                           trigger_active_time=self.trigger_active_count / self.sample_rate if self.sample_rate else 0.0)
+
+
+# frames summarised at a time, bounding the temporary float64 copies
+_SUMMARY_BLOCK_FRAMES = 1 << 16
+
+
+def _summarize_test_data(data: DmgData) -> TestSummary:
+    '''Compute the TestSummary of a test's data.'''
+
+    audio = data.audio_data
+    if audio.ndim == 1:
+        audio = audio.reshape(-1, 1)
+
+    accumulator = _SummaryAccumulator(data.sample_rate, audio.shape[1], data.is_processed)
+    for start in range(0, len(audio), _SUMMARY_BLOCK_FRAMES):
+        accumulator.add(audio[start:start + _SUMMARY_BLOCK_FRAMES])
 
+    # the trigger is counted run by run rather than frame by frame
+    trigger = data.trigger_runs
+    if trigger is not None:
+        accumulator.trigger_active_count = int(trigger.run_lengths()[trigger.values > 0.5].sum())
 
-def _read_test_data_from_file(path: str) -> DmgData:
+    return accumulator.summary()
+
+
+# .dmg files are .wav files with two extra RIFF chunks: the metadata
+# (before the audio, so it is found without reading past the samples) and
+# the trigger and output channels as runs (after the audio, as a recording
+# being finalized only knows them once all of it has been written)
+_METADATA_CHUNK = b'dmgm'
+_CHANNEL_RUNS_CHUNK = b'dmgc'
+_DMG_VERSION = 1
+_CHANNEL_RUNS_VERSION = 1
+_TRIGGER_CHANNEL = b'trig'
+_OUTPUT_CHANNEL = b'outp'
+
+# .wav format tags
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+class _DmgWriter:
+    '''Writes a .dmg file in a single pass.
+
+    Used as a context manager: the header and metadata are written on
+    entry, the audio is handed to 'write_audio' in one or more blocks of
+    frames, and 'channel_runs' is set to the trigger (and output)
+    ChannelRuns before leaving. Everything goes to a temporary file next to
+    'full_path' which replaces 'full_path' only once it is complete, so an
+    existing file is never left half written. On an error the temporary
+    file is removed.
+    '''
+
+    def __init__(self,
+                 full_path: str,
+                 sample_rate: int,
+                 audio_channels: int,
+                 num_frames: int,
+                 dtype: numpy.dtype,
+                 is_processed: bool = False):
+
+        self.full_path = full_path
+        self.sample_rate = int(sample_rate)
+        self.audio_channels = audio_channels
+        self.num_frames = num_frames
+        self.dtype = numpy.dtype(dtype).newbyteorder('<')
+        self.is_processed = is_processed
+        self.channel_runs = {}
+
+        self._format_tag = _wave_format_tag(self.dtype)
+        self._temp_path = full_path + '.tmp'
+        self._file = None
+        self._frames_written = 0
+
+    def __enter__(self):
+        data_size = self.dtype.itemsize * self.audio_channels * self.num_frames
+        if data_size > 0xFFFFFFFF - 1024:
+            raise DatabaseError('Recording is too long to be stored in a single .wav file.')
+
+        metadata = yaml.safe_dump({'version': _DMG_VERSION,
+                                   'audio_channels': self.audio_channels,
+                                   'processed': bool(self.is_processed)}).encode()
+
+        self._file = open(self._temp_path, 'wb')
+        try:
+            # the RIFF size is filled in once the file is complete
+            self._file.write(b'RIFF' + struct.pack('<I', 0) + b'WAVE')
+
+            bytes_per_frame = self.dtype.itemsize * self.audio_channels
+            _write_riff_chunk(self._file, b'fmt ', struct.pack('<HHIIHH', self._format_tag, self.audio_channels,
+                                                               self.sample_rate, self.sample_rate * bytes_per_frame,
+                                                               bytes_per_frame, 8 * self.dtype.itemsize))
+            _write_riff_chunk(self._file, _METADATA_CHUNK, metadata)
+            self._file.write(b'data' + struct.pack('<I', data_size))
+        except BaseException:
+            self._discard()
+            raise
+
+        return self
+
+    def write_audio(self, block: ndarray):
+        '''Append 'frames x audio_channels' samples.'''
+
+        block = numpy.ascontiguousarray(block, dtype=self.dtype)
+        self._file.write(block.tobytes())
+        self._frames_written += len(block)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self._discard()
+            return False
+
+        try:
+            if self._frames_written != self.num_frames:
+                raise DatabaseError('Expected {} frames of audio, got {}.'.format(self.num_frames, self._frames_written))
+
+            if self.dtype.itemsize * self.audio_channels * self.num_frames % 2:
+                self._file.write(b'\x00')
+            _write_riff_chunk(self._file, _CHANNEL_RUNS_CHUNK, _encode_channel_runs(self.channel_runs))
+
+            riff_size = self._file.tell() - 8
+            self._file.seek(4)
+            self._file.write(struct.pack('<I', riff_size))
+
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self._temp_path, self.full_path)
+        except BaseException:
+            self._discard()
+            raise
+
+        return False
+
+    def _discard(self):
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+@dataclass
+class _DmgHeader:
+    '''What the chunk headers of a .dmg (or plain .wav) file describe.'''
+    sample_rate: int
+    channels: int
+    dtype: numpy.dtype
+    num_frames: int
+    data_offset: int
+    metadata: dict = None
+    channel_runs_offset: int = None
+    channel_runs_size: int = 0
+
+
+def _read_dmg_header(file) -> _DmgHeader:
+    '''Read the format and metadata of an open .dmg file. Only chunk headers
+    and the small chunks are read, the samples are skipped over.'''
+
+    riff = file.read(12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:] != b'WAVE':
+        raise DatabaseError('Not a .wav file: ' + str(getattr(file, 'name', '')))
+
+    fmt = None
+    header = None
+    metadata = None
+    channel_runs = (None, 0)
+
+    while True:
+        chunk = file.read(8)
+        if len(chunk) < 8: break
+
+        chunk_id, size = struct.unpack('<4sI', chunk)
+        offset = file.tell()
+
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', file.read(16))
+        elif chunk_id == _METADATA_CHUNK:
+            metadata = yaml.safe_load(file.read(size).decode())
+        elif chunk_id == _CHANNEL_RUNS_CHUNK:
+            channel_runs = (offset, size)
+        elif chunk_id == b'data':
+            if fmt is None: raise DatabaseError('.wav data chunk before its format chunk')
+            format_tag, channels, sample_rate, _, bytes_per_frame, bits = fmt
+            dtype = _wave_dtype(format_tag, bits)
+            header = _DmgHeader(sample_rate, channels, dtype, size // bytes_per_frame, offset)
+
+        file.seek(offset + size + size % 2)
+
+    if header is None:
+        raise DatabaseError('.wav file has no audio: ' + str(getattr(file, 'name', '')))
+
+    header.metadata = metadata
+    header.channel_runs_offset, header.channel_runs_size = channel_runs
+    return header
+
+
+def _wave_format_tag(dtype: numpy.dtype) -> int:
+    if dtype.kind == 'f' and dtype.itemsize in (4, 8):
+        return _WAVE_FORMAT_IEEE_FLOAT
+    if (dtype.kind == 'i' and dtype.itemsize in (2, 4)) or dtype == numpy.uint8:
+        return _WAVE_FORMAT_PCM
+    raise DatabaseError('Audio of type {} cannot be stored in a .wav file.'.format(dtype))
+
+
+def _wave_dtype(format_tag: int, bits: int) -> numpy.dtype:
+    if format_tag == _WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        return numpy.dtype('<f{}'.format(bits // 8))
+    if format_tag == _WAVE_FORMAT_PCM and bits in (16, 32):
+        return numpy.dtype('<i{}'.format(bits // 8))
+    if format_tag == _WAVE_FORMAT_PCM and bits == 8:
+        return numpy.dtype(numpy.uint8)
+    raise DatabaseError('Unsupported .wav sample format ({}, {} bits)'.format(format_tag, bits))
+
+
+def _write_riff_chunk(file, chunk_id: bytes, payload: bytes):
+    file.write(chunk_id + struct.pack('<I', len(payload)))
+    file.write(payload)
+    if len(payload) % 2: file.write(b'\x00')
+
+
+def _encode_channel_runs(channels: dict) -> bytes:
+    '''Pack named ChannelRuns into the payload of a _CHANNEL_RUNS_CHUNK.
+
+    Layout (little endian): version (u32), channel count (u32), then for
+    each channel its 4 byte name, frame count (u64), run count (u64), the
+    run starts (int64) and the run values (float64).
+    '''
+
+    parts = [struct.pack('<II', _CHANNEL_RUNS_VERSION, len(channels))]
+    for name, runs in channels.items():
+        parts.append(struct.pack('<4sQQ', name, runs.num_frames, len(runs.starts)))
+        parts.append(numpy.asarray(runs.starts, dtype='<i8').tobytes())
+        parts.append(numpy.asarray(runs.values, dtype='<f8').tobytes())
+    return b''.join(parts)
+
+
+def _decode_channel_runs(payload: bytes) -> dict:
+    '''Unpack the named ChannelRuns of a _CHANNEL_RUNS_CHUNK payload.'''
+
+    version, count = struct.unpack_from('<II', payload, 0)
+    if version != _CHANNEL_RUNS_VERSION:
+        raise DatabaseError('Unsupported channel data version: {}'.format(version))
+
+    channels = {}
+    offset = 8
+    for _ in range(count):
+        name, num_frames, num_runs = struct.unpack_from('<4sQQ', payload, offset)
+        offset += 20
+        starts = numpy.frombuffer(payload, dtype='<i8', count=num_runs, offset=offset)
+        offset += 8 * num_runs
+        values = numpy.frombuffer(payload, dtype='<f8', count=num_runs, offset=offset)
+        offset += 8 * num_runs
+        channels[name] = ChannelRuns(num_frames, starts, values)
+    return channels
+
+
+def _read_test_data_from_file(path: str, mmap: bool = False) -> DmgData:
     '''Extract data from .dmg file and produce a DmgData object.
     
     Assumes the path to be within the dmg._files_location directory. The
-    provided path is appended to that variable.
+    provided path is appended to that variable. With 'mmap' the channels are
+    views of a memory map of the file.
+
+    The file is opened once: its headers are read, then its samples. Files
+    written before the trigger and output were stored as runs are handed
+    to _read_legacy_test_data_file.
     '''
     
     # check file exists
-    files_location = os.path.join(settings.get_setting('save_location'), 'files')
-    full_path = os.path.join(files_location, path)
+    full_path = os.path.join(_files_location(), path)
     if not os.path.isfile(full_path): return None
 
+    with open(full_path, 'rb') as file:
+        header = _read_dmg_header(file)
+        if header.channel_runs_offset is None:
+            return _read_legacy_test_data_file(full_path, mmap=mmap)
+
+        file.seek(header.channel_runs_offset)
+        channels = _decode_channel_runs(file.read(header.channel_runs_size))
+
+        # a mapped file gives 'frames x channels' views of the file's pages,
+        # and each channel is a strided view of those
+        shape = (header.num_frames, header.channels)
+        if mmap:
+            audio = numpy.memmap(full_path, dtype=header.dtype, mode='r', offset=header.data_offset, shape=shape)
+        else:
+            file.seek(header.data_offset)
+            audio = numpy.fromfile(file, dtype=header.dtype, count=shape[0] * shape[1]).reshape(shape)
+
+    data = DmgData()
+    data.sample_rate = header.sample_rate
+    data.audio_data = audio
+    data.trigger_data = channels[_TRIGGER_CHANNEL]
+    data.output_data = channels.get(_OUTPUT_CHANNEL)
+    data.is_processed = data._output is not None
+
+    return data
+
+
+def _iter_test_data_blocks(path: str, block_seconds: float, overlap: float):
+    '''Generator of the DataBlocks of a .dmg file (see DatabaseManager.iter_blocks).'''
+
+    full_path = os.path.join(_files_location(), path)
+    if not os.path.isfile(full_path):
+        raise DatabaseError('Data file not found: ' + path)
+
+    with open(full_path, 'rb') as file:
+        header = _read_dmg_header(file)
+
+        if header.channel_runs_offset is None:
+            # the older layout is read through a memory map
+            legacy = _read_legacy_test_data_file(full_path, mmap=True)
+            num_frames = len(legacy.audio_data)
+            read_audio = lambda start, stop: numpy.array(legacy.audio_data[start:stop])
+            trigger, output = legacy._trigger, legacy._output
+        else:
+            file.seek(header.channel_runs_offset)
+            channels = _decode_channel_runs(file.read(header.channel_runs_size))
+            num_frames = header.num_frames
+            trigger, output = channels[_TRIGGER_CHANNEL], channels.get(_OUTPUT_CHANNEL)
+
+            def read_audio(start, stop):
+                file.seek(header.data_offset + start * header.dtype.itemsize * header.channels)
+                count = (stop - start) * header.channels
+                return numpy.fromfile(file, dtype=header.dtype, count=count).reshape(-1, header.channels)
+
+        sample_rate = header.sample_rate
+        block_frames = max(1, int(round(block_seconds * sample_rate)))
+        overlap_frames = int(round(overlap * sample_rate))
+        if not 0 <= overlap_frames < block_frames:
+            raise ValueError('overlap must be at least 0 and shorter than a block.')
+
+        for start in range(0, num_frames, block_frames):
+            first = max(0, start - overlap_frames)
+            stop = min(start + block_frames, num_frames)
+            yield DataBlock(first, start - first, sample_rate, read_audio(first, stop),
+                            _channel_range(trigger, first, stop), _channel_range(output, first, stop))
+
+
+def _channel_range(channel, start: int, stop: int) -> ndarray:
+    '''Dense values of frames 'start' up to 'stop' of a trigger or output channel.'''
+
+    if channel is None: return None
+    if isinstance(channel, ChannelRuns): return channel.dense_range(start, stop)
+    return numpy.array(channel[start:stop])
+
+
+def _read_legacy_test_data_file(full_path: str, mmap: bool = False) -> DmgData:
+    '''Read a file whose trigger and output are extra float .wav channels
+    after the audio, with the channel layout in CHANNELS and PROCESSED tags.'''
+
+    # only files saved by older versions need these
+    import taglib
+    from scipy.io import wavfile
+
     # extract meta data and wav data from file
     num_channels = 0
     data = DmgData()
-    data.sample_rate, wav_channels = wavfile.read(full_path)
+    with warnings.catch_warnings():
+        # the chunk holding the tags is unknown to scipy
+        warnings.simplefilter('ignore', wavfile.WavFileWarning)
+        data.sample_rate, wav_channels = wavfile.read(full_path, mmap=mmap)
 
-    with taglib.File(full_path, save_on_exit = True) as save_file:
+    with taglib.File(full_path) as save_file:
         num_channels = int(save_file.tags["CHANNELS"][0])
         is_processed = save_file.tags["PROCESSED"][0]
         if is_processed == 'True': data.is_processed = True
         elif is_processed == 'False': data.is_processed = False
-        else: raise Exception('Something really bad just happend. (Read file)')
+        else: raise DatabaseError('Invalid PROCESSED tag in ' + full_path)
 
     # separate channels from wav_data and insert in data object
     data.audio_data = wav_channels[:, 0:(num_channels)]
@@ -533,6 +1736,297 @@ def _read_test_data_from_file(path: str) -> DmgData:
 
     return data
 
+# [RECORDING JOURNAL]
+
+_JOURNAL_EXTENSION = '.journal'
+_JOURNAL_HEADER_FILE = 'journal.yaml'
+_JOURNAL_AUDIO_FILE = 'audio.raw'
+_JOURNAL_TRIGGER_FILE = 'trigger.raw'
+_JOURNAL_TRIGGER_DTYPE = numpy.float64  # (timestamp, reading) pairs
+
+# finalized recordings that have not been saved to a test yet
+_RECORDING_EXTENSION = '.recording.dmg'
+
+
+class RecordingJournal:
+    '''Append-only on-disk record of a recording in progress.
+
+    Audio and trigger blocks handed to this object are queued and written by
+    a background thread into a '<name>.journal' directory inside the
+    'files' folder, so a recording never has to be held in memory and
+    everything written before a crash can be recovered. Use
+    finalize_journal to turn a closed (or interrupted) journal into a
+    .dmg file.
+
+    The queue is bounded. If the disk falls behind, blocks are dropped
+    rather than stalling the audio callback, and counted in 'dropped_blocks'.
+    '''
+
+    def __init__(self,
+                 sample_rate: int,
+                 channels: int,
+                 dtype: str = 'float32',
+                 name: str = None,
+                 max_queued_blocks: int = 256):
+
+        if name is None:
+            name = 'recording_' + datetime.datetime.now().strftime("%m%d%Y_%H%M%S")
+
+        self.name = name
+        self.path = os.path.join(_files_location(), name + _JOURNAL_EXTENSION)
+        self.dropped_blocks = 0
+
+        os.makedirs(self.path)
+        header = {
+            'sample_rate': int(sample_rate),
+            'channels': int(channels),
+            'dtype': numpy.dtype(dtype).str,
+            'created': datetime.datetime.now().isoformat()
+        }
+        header_path = os.path.join(self.path, _JOURNAL_HEADER_FILE)
+        with open(header_path, 'w') as file:
+            yaml.safe_dump(header, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        self._dtype = numpy.dtype(dtype)
+        self._queue = Queue(maxsize=max_queued_blocks)
+        self._writer = _JournalWriter(self.path, self._queue)
+        self._writer.start()
+
+    def write_audio(self, block: ndarray):
+        '''Queue a 'frames x channels' block of audio. Never blocks.'''
+        self._put((_JOURNAL_AUDIO_FILE, numpy.ascontiguousarray(block, dtype=self._dtype).copy()))
+
+    def write_trigger(self, timestamps, values):
+        '''Queue raw trigger pin readings and the time.monotonic() timestamps
+        they were taken at. Missing (None or nan) readings are stored as 0.'''
+        samples = numpy.empty((len(values), 2), dtype=_JOURNAL_TRIGGER_DTYPE)
+        samples[:, 0] = timestamps
+        samples[:, 1] = numpy.nan_to_num(numpy.array(values, dtype=_JOURNAL_TRIGGER_DTYPE), nan=0.0)
+        self._put((_JOURNAL_TRIGGER_FILE, samples))
+
+    def set_audio_start_time(self, start_time: float):
+        '''Record the time.monotonic() timestamp of the first audio frame, which
+        the trigger timestamps are aligned against when finalizing.'''
+        if start_time is None: return
+
+        header_path = os.path.join(self.path, _JOURNAL_HEADER_FILE)
+        with open(header_path, 'r') as file:
+            header = yaml.safe_load(file)
+        header['audio_start_time'] = float(start_time)
+        with open(header_path, 'w') as file:
+            yaml.safe_dump(header, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def close(self):
+        '''Write out everything still queued and stop the writer thread.'''
+        self._queue.put(None)
+        self._writer.join()
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except Full:
+            self.dropped_blocks += 1
+
+
+class _JournalWriter(Thread):
+
+    def __init__(self, path: str, in_queue: Queue, sync_interval: float = 1.0):
+        '''Thread for appending queued blocks to the files of a journal.'''
+
+        Thread.__init__(self, daemon=True)
+        self._path = path
+        self._queue = in_queue
+        self._sync_interval = sync_interval
+
+    def run(self):
+
+        files = {}
+        last_sync = time.monotonic()
+
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None: break
+
+                file_name, values = item
+                if file_name not in files:
+                    files[file_name] = open(os.path.join(self._path, file_name), 'ab')
+                files[file_name].write(values.tobytes())
+
+                # push data to disk regularly so little is lost on a crash
+                if time.monotonic() - last_sync >= self._sync_interval:
+                    for file in files.values():
+                        file.flush()
+                        os.fsync(file.fileno())
+                    last_sync = time.monotonic()
+
+        finally:
+            for file in files.values():
+                file.flush()
+                os.fsync(file.fileno())
+                file.close()
+
+
+def list_journals() -> list[str]:
+    '''Return the paths of all journals left in the 'files' folder, i.e.
+    recordings that were interrupted or never finalized.'''
+
+    files_location = _files_location()
+    if not os.path.isdir(files_location): return []
+
+    return sorted(os.path.join(files_location, name)
+                  for name in os.listdir(files_location)
+                  if name.endswith(_JOURNAL_EXTENSION))
+
+
+def finalize_journal(journal_path: str, path: str, block_frames: int = 1 << 16, delete_journal: bool = True):
+    '''Convert a journal into a .dmg file and delete the journal.
+
+    The file is written block by block, so memory use does not depend on the
+    length of the recording. The trigger readings are interpolated at the
+    time of each audio frame and converted to 0/1 with the trigger settings
+    (see signal_processor.TriggerConditioner). If the audio start time
+    was never recorded (the recording was interrupted), the audio is taken
+    to start with the first trigger reading. Whole frames are kept from
+    files cut short by a crash.
+
+    Parameters
+    ----------
+    journal_path: str
+        Path of the '.journal' directory
+    path: str
+        Name of the .dmg file to create in the 'files' folder
+    delete_journal: bool, optional
+        Whether to delete the journal once the file is written. Without it
+        the caller removes it (see _remove_journal), e.g. only after the
+        test using the file has been committed.
+
+    Return
+    ------
+    summary: TestSummary
+        Summary of the data written, computed in the same pass
+    '''
+
+    with open(os.path.join(journal_path, _JOURNAL_HEADER_FILE), 'r') as file:
+        header = yaml.safe_load(file)
+
+    sample_rate = header['sample_rate']
+    channels = header['channels']
+    audio = _map_journal_file(os.path.join(journal_path, _JOURNAL_AUDIO_FILE),
+                              numpy.dtype(header['dtype']), channels)
+    trigger = _map_journal_file(os.path.join(journal_path, _JOURNAL_TRIGGER_FILE),
+                                numpy.dtype(_JOURNAL_TRIGGER_DTYPE), 2)
+
+    if audio is None:
+        raise DatabaseError('Journal contains no audio: ' + journal_path)
+
+    full_path = os.path.join(_files_location(), path)
+    num_frames = len(audio)
+    num_trigger_values = len(trigger) if trigger is not None else 0
+    start_time = header.get('audio_start_time')
+    if start_time is None and num_trigger_values:
+        start_time = float(trigger[0, 0])
+    accumulator = _SummaryAccumulator(sample_rate, channels, is_processed=False)
+    conditioner = processor.TriggerConditioner(**settings.get_settings().trigger_conditioning(sample_rate))
+
+    trigger_runs = []
+
+    with _DmgWriter(full_path, sample_rate, channels, num_frames, audio.dtype) as writer:
+
+        for start in range(0, num_frames, block_frames):
+            stop = min(start + block_frames, num_frames)
+
+            raw_trigger = numpy.zeros(stop - start)
+            if num_trigger_values:
+                # trigger readings at the time of each audio frame
+                frame_times = start_time + numpy.arange(start, stop) / sample_rate
+                raw_trigger = resampling.sample_at(trigger[:, 0], trigger[:, 1], frame_times)
+
+            writer.write_audio(audio[start:stop])
+            trigger_runs.append(ChannelRuns.from_dense(conditioner.push(raw_trigger).astype(float)))
+            accumulator.add(audio[start:stop])
+
+        trigger_runs.append(ChannelRuns.from_dense(conditioner.flush().astype(float)))
+        writer.channel_runs = {_TRIGGER_CHANNEL: ChannelRuns.join(trigger_runs)}
+
+    # the trigger is counted run by run
+    joined = writer.channel_runs[_TRIGGER_CHANNEL]
+    accumulator.trigger_active_count = int(joined.run_lengths()[joined.values > 0.5].sum())
+
+    del audio, trigger
+    if delete_journal: _remove_journal(journal_path)
+
+    return accumulator.summary()
+
+
+def _remove_journal(journal_path: str):
+
+    for name in os.listdir(journal_path):
+        os.remove(os.path.join(journal_path, name))
+    os.rmdir(journal_path)
+
+
+def finalize_recording(journal_path: str) -> DmgData:
+    '''Finalize a journal into a '.recording.dmg' file in the 'files' folder
+    and return its data memory-mapped, so the recording is not read into
+    memory.
+
+    The file is kept until the data is saved to a test (see
+    DatabaseManager.save_active_test_data) or discarded. Files of
+    recordings that were neither, e.g. after a crash, are recovered by
+    DatabaseManager.recover_interrupted_recordings.
+    '''
+
+    path = os.path.basename(journal_path)[:-len(_JOURNAL_EXTENSION)] + _RECORDING_EXTENSION
+    finalize_journal(journal_path, path)
+    return _read_test_data_from_file(path, mmap=True)
+
+
+def list_recording_files() -> list[str]:
+    '''Return the paths of all finalized recordings in the 'files' folder
+    that were never saved to a test or discarded.'''
+
+    files_location = _files_location()
+    if not os.path.isdir(files_location): return []
+
+    return sorted(os.path.join(files_location, name)
+                  for name in os.listdir(files_location)
+                  if name.endswith(_RECORDING_EXTENSION))
+
+
+def _recording_file_of(data: DmgData) -> str:
+    '''Path of the recording file 'data' is mapped from, or None.'''
+
+    filename = getattr(data.audio_data, 'filename', None) if data else None
+    if filename is None or not filename.endswith(_RECORDING_EXTENSION): return None
+    return filename
+
+
+def _remove_file(full_path: str) -> bool:
+    '''Delete a file, return False if it could not be (Windows does not
+    delete a file that is still mapped).'''
+
+    try:
+        os.remove(full_path)
+        return True
+    except OSError:
+        return False
+
+
+def _map_journal_file(path: str, dtype: numpy.dtype, columns: int) -> ndarray:
+    '''Memory-map the whole frames in a journal data file, or None if there are none.'''
+
+    if not os.path.isfile(path): return None
+    num_frames = os.path.getsize(path) // (dtype.itemsize * columns)
+    if num_frames == 0: return None
+
+    return numpy.memmap(path, dtype=dtype, mode='r', shape=(num_frames, columns))
+
+
 # [CRUD]
              
 def _create_test(con: sqlite3.Connection,
@@ -555,7 +2049,10 @@ def _create_test(con: sqlite3.Connection,
              VALUES (?,?,?,?)
           """
     
-    cur.execute(sql, (name, creation_date, notes, data_file_path))
+    try:
+        cur.execute(sql, (name, creation_date, notes, data_file_path))
+    except sqlite3.IntegrityError:
+        raise DatabaseError('A test with this name already exists')
     
     return cur.lastrowid, data_file_path
 
@@ -563,43 +2060,34 @@ def _create_test(con: sqlite3.Connection,
 def _create_tag(con:sqlite3.Connection, value: str):
     
     cur = con.cursor()
-    
-    # check if tag exists
-    sql = "SELECT * FROM tag WHERE value=?"
-    existing_tag = cur.execute(sql, (value,)).fetchone()
-
-    if existing_tag != None:
-        raise DatabaseError('A tag with this value already exists')
         
-    # insert a new tag
+    # insert a new tag, the unique index rejects an existing value
     sql = """
-             INSERT INTO tag(value)
+             INSERT OR IGNORE INTO tag(value)
              VALUES(?)
           """
     cur.execute(sql, (value,))
 
+    if cur.rowcount == 0:
+        raise DatabaseError('A tag with this value already exists')
+
+    _invalidate_tag_cache()
     return cur.lastrowid
 
 
 def _create_tag_link(con: sqlite3.Connection, test_id, tag_id):
     
     cur = con.cursor()
-    # check if tag link exists already
-    sql = """
-             SELECT * FROM test_tag
-             WHERE test_id=?
-             AND tag_id=?
-          """
-    existing_links = cur.execute(sql, (test_id, tag_id)).fetchone()
-    if existing_links != None: raise DatabaseError('A link between the specified test and tag already exists.')
 
-    # add tag link
+    # add tag link, the unique index rejects an existing link
     sql = """
-             INSERT INTO test_tag(test_id, tag_id)
+             INSERT OR IGNORE INTO test_tag(test_id, tag_id)
              VALUES(?,?)
           """
     cur.execute(sql, (test_id, tag_id))
 
+    if cur.rowcount == 0: raise DatabaseError('A link between the specified test and tag already exists.')
+
 
 def _read_data_file_path_by_id(con: sqlite3.Connection, id: int):
     cur = con.cursor()
@@ -654,6 +2142,31 @@ def _read_tag_value_by_tag_id(con: sqlite3.Connection, tag_id: int):
     return tag_value[0]
 
 
+# value -> id of every tag, shared by the connections of this process and
+# dropped whenever tags are written or a transaction rolls back. It only serves
+# listings, the ids written to test_tag are always read from the database.
+_tag_cache = None
+_tag_cache_generation = None
+
+
+def _read_tag_ids(con: sqlite3.Connection) -> dict:
+    '''Map of every tag value to its id, in id order, served from memory
+    until the tags change.'''
+    global _tag_cache, _tag_cache_generation
+
+    if _tag_cache is None or _tag_cache_generation != _generation:
+        rows = con.execute("SELECT value, id FROM tag ORDER BY id").fetchall()
+        _tag_cache = dict(rows)
+        _tag_cache_generation = _generation
+
+    return _tag_cache
+
+
+def _invalidate_tag_cache():
+    global _tag_cache
+    _tag_cache = None
+
+
 def _read_all_tag_values(con: sqlite3.Connection):
 
     con.row_factory = lambda cursor, row: row[0]
@@ -685,7 +2198,8 @@ def _read_test_id_by_name(con: sqlite3.Connection, name: str):
 def _read_test_by_id(con: sqlite3.Connection, id: int):
     cur = con.cursor()
     sql = """
-             SELECT * FROM test
+             SELECT id, name, created, notes, data_file_path
+             FROM test
              WHERE id=?
           """
     test = cur.execute(sql, (id,)).fetchone()
@@ -728,6 +2242,193 @@ def _read_all_test_ids(con: sqlite3.Connection):
     return existing_tests
 
 
+# separates the tag values joined by _read_test_summaries
+_TAG_SEPARATOR = '\x1f'
+
+
+def _read_test_summaries(con: sqlite3.Connection,
+                         tag_values: list[str] = None,
+                         test_ids: list[int] = None,
+                         limit: int = None,
+                         offset: int = 0,
+                         tag_query: str = None,
+                         order_by: str = 'id',
+                         descending: bool = False):
+    '''Read the row of every test along with all of its tag values joined
+    into one string (group_concat), in a single query.
+
+    Tests can be restricted to those linked to any of 'tag_values', those
+    with an id in 'test_ids' and/or those matching a tag_query expression,
+    and paged with 'limit' and 'offset'. Rows are sorted by 'order_by', a
+    column in _SORT_COLUMNS, then by id.
+
+    Return
+    ------
+    rows: list[tuple]
+        (id, name, created, notes, data_file_path, tags, *summary columns),
+        where tags is None or the tag values separated by _TAG_SEPARATOR
+    '''
+
+    if order_by not in _SORT_COLUMNS:
+        raise DatabaseError('Cannot sort tests by ' + str(order_by))
+
+    conditions = []
+    parameters = []
+    link_conditions = ''
+    link_parameters = []
+
+    # lists are bound as one JSON array each (json_each), so any number of
+    # values stays within SQLite's limit on host parameters
+    if tag_values is not None:
+        conditions.append("""
+             test.id IN (SELECT test_tag.test_id
+                         FROM test_tag
+                         JOIN tag ON tag.id = test_tag.tag_id
+                         WHERE tag.value IN (SELECT value FROM json_each(?)))
+          """)
+        parameters.append(json.dumps([str(value) for value in tag_values]))
+
+    if test_ids is not None:
+        id_list = json.dumps([int(test_id) for test_id in test_ids])
+        conditions.append("test.id IN (SELECT value FROM json_each(?))")
+        parameters.append(id_list)
+
+        # only join the tags of the requested tests
+        link_conditions = "WHERE test_tag.test_id IN (SELECT value FROM json_each(?))"
+        link_parameters = [id_list]
+
+    if tag_query is not None:
+        query_condition, query_parameters = compile_query(tag_query)
+        conditions.append('(' + query_condition + ')')
+        parameters += query_parameters
+
+    # tags are joined per test first, so each link is only visited once
+    # whatever the filter
+    cur = con.cursor()
+    sql = """
+             SELECT test.id, test.name, test.created, test.notes, test.data_file_path,
+                    tags.tag_values, {}
+             FROM test
+             LEFT JOIN (SELECT test_tag.test_id AS test_id,
+                               group_concat(tag.value, ?) AS tag_values
+                        FROM test_tag
+                        JOIN tag ON tag.id = test_tag.tag_id
+                        {}
+                        GROUP BY test_tag.test_id) AS tags
+                  ON tags.test_id = test.id
+             {}
+             ORDER BY test.{} IS NULL, test.{} {}, test.id
+             LIMIT ? OFFSET ?
+          """.format(', '.join('test.' + name for name, _ in _SUMMARY_COLUMNS),
+                     link_conditions,
+                     'WHERE ' + ' AND '.join(conditions) if conditions else '',
+                     order_by, order_by, 'DESC' if descending else 'ASC')
+
+    parameters += [-1 if limit is None else limit, offset]
+    return cur.execute(sql, [_TAG_SEPARATOR] + link_parameters + parameters).fetchall()
+
+
+def _test_entry_from_summary(row) -> TestEntry:
+    '''Build a TestEntry (without its data loaded) from a _read_test_summaries row.'''
+
+    test_entry = TestEntry()
+    test_entry.id = row[0]
+    test_entry.name = row[1]
+    test_entry.creation_date = row[2]
+    test_entry.notes = row[3]
+    test_entry.data_file_path = row[4]
+    if row[5] is not None:
+        test_entry.tags = row[5].split(_TAG_SEPARATOR)
+    test_entry.summary = _test_summary_from_columns(row[6:])
+
+    return test_entry
+
+
+def _test_summary_from_columns(columns) -> TestSummary:
+    '''TestSummary from the _SUMMARY_COLUMNS of a row, or None if unset.'''
+
+    if columns[0] is None: return None
+    summary = TestSummary(*columns)
+    summary.is_processed = bool(summary.is_processed)
+    return summary
+
+
+def _read_tests_without_summary(con: sqlite3.Connection) -> list[tuple]:
+    '''(id, data_file_path) of the tests whose summary is not set.'''
+
+    sql = """
+             SELECT id, data_file_path
+             FROM test
+             WHERE sample_count IS NULL
+             ORDER BY id
+          """
+    return con.execute(sql).fetchall()
+
+
+def _read_test_ids_by_query(con: sqlite3.Connection, tag_query: str) -> list[int]:
+    '''Ids of the tests matching a tag_query expression, in one statement.'''
+
+    condition, parameters = compile_query(tag_query)
+    sql = """
+             SELECT test.id
+             FROM test
+             WHERE {}
+             ORDER BY test.id
+          """.format(condition)
+    return [row[0] for row in con.execute(sql, parameters).fetchall()]
+
+
+# columns list_tests can sort by
+_SORT_COLUMNS = ('id', 'name', 'created') + tuple(name for name, _ in _SUMMARY_COLUMNS)
+
+
+# relative weight of name, notes and tags matches when ranking search results
+_SEARCH_WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def _search_test_ids(con: sqlite3.Connection, query: str, limit: int, offset: int) -> list[int]:
+    '''Ids of the tests whose name, notes or tags contain every word of
+    'query' (as a word prefix), best matches first.'''
+
+    terms = re.findall(r'\w+', query)
+    if not terms: return []
+
+    cur = con.cursor()
+    has_index = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'test_search'").fetchone()
+
+    if has_index:
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        sql = """
+                 SELECT rowid
+                 FROM test_search
+                 WHERE test_search MATCH ?
+                 ORDER BY bm25(test_search, ?, ?, ?)
+                 LIMIT ? OFFSET ?
+              """
+        rows = cur.execute(sql, (match,) + _SEARCH_WEIGHTS + (limit, offset)).fetchall()
+
+    else:
+        # no full text index, scan for substrings instead
+        condition = """
+             (test.name LIKE ? OR test.notes LIKE ?
+              OR EXISTS (SELECT 1 FROM test_tag JOIN tag ON tag.id = test_tag.tag_id
+                         WHERE test_tag.test_id = test.id AND tag.value LIKE ?))
+          """
+        parameters = []
+        for term in terms:
+            parameters += ['%' + term + '%'] * 3
+        sql = """
+                 SELECT id
+                 FROM test
+                 WHERE {}
+                 ORDER BY id
+                 LIMIT ? OFFSET ?
+              """.format(' AND '.join([condition] * len(terms)))
+        rows = cur.execute(sql, parameters + [limit, offset]).fetchall()
+
+    return [row[0] for row in rows]
+
+
 def _update_test_by_name(con: sqlite3.Connection,
                          name: str,
                          notes: str,
@@ -748,45 +2449,138 @@ def _update_test_by_name(con: sqlite3.Connection,
     cur.execute(sql, (notes, name))
 
 
+# damage classes stored as events, class 0 (trigger off, no damage) is not
+DAMAGE_CLASSES = (1, 2, 3, 4)
+
+
+def damage_params_hash(params: dict = None) -> str:
+    '''Short stable hash of a detector's parameters, or None without any.'''
+
+    if not params: return None
+    encoded = json.dumps(params, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def _replace_damage_events(con: sqlite3.Connection, test_id: int, events: list[DamageEvent]):
+    '''Replace all damage events of a test.'''
+
+    _delete_damage_events_by_test_id(con, test_id)
+    sql = """
+             INSERT
+             INTO damage_event (test_id, start_s, end_s, class, detector, params_hash)
+             VALUES (?,?,?,?,?,?)
+          """
+    con.executemany(sql, [(test_id, event.start_s, event.end_s, event.damage_class,
+                           event.detector, event.params_hash) for event in events])
+
+
+def _read_damage_events(con: sqlite3.Connection,
+                        test_id: int = None,
+                        damage_class: int = None,
+                        min_duration: float = None) -> list[DamageEvent]:
+
+    conditions = []
+    parameters = []
+    if test_id is not None:
+        conditions.append("test_id = ?")
+        parameters.append(test_id)
+    if damage_class is not None:
+        conditions.append("class = ?")
+        parameters.append(damage_class)
+    if min_duration is not None:
+        conditions.append("end_s - start_s > ?")
+        parameters.append(min_duration)
+
+    sql = """
+             SELECT start_s, end_s, class, detector, params_hash, test_id
+             FROM damage_event
+             {}
+             ORDER BY test_id, start_s
+          """.format('WHERE ' + ' AND '.join(conditions) if conditions else '')
+    return [DamageEvent(*row) for row in con.execute(sql, parameters).fetchall()]
+
+
+def _read_test_ids_with_damage(con: sqlite3.Connection, damage_class: int, min_duration: float) -> list[int]:
+    '''Ids of the tests with an event of 'damage_class' longer than 'min_duration'.'''
+
+    sql = """
+             SELECT DISTINCT test_id
+             FROM damage_event
+             WHERE class = ? AND end_s - start_s > ?
+             ORDER BY test_id
+          """
+    return [row[0] for row in con.execute(sql, (damage_class, min_duration)).fetchall()]
+
+
+def _delete_damage_events_by_test_id(con: sqlite3.Connection, test_id: int):
+
+    con.execute("DELETE FROM damage_event WHERE test_id = ?", (test_id,))
+
+
+def _update_test_summary(con: sqlite3.Connection, test_id: int, summary: TestSummary):
+    '''Store a test's summary columns, or clear them if 'summary' is None.'''
+
+    values = [None] * len(_SUMMARY_COLUMNS)
+    if summary is not None:
+        values = [summary.sample_count, summary.sample_rate, summary.channel_count,
+                  summary.duration, summary.peak_level, summary.rms_level,
+                  int(summary.is_processed), summary.trigger_active_time]
+
+    sql = """
+             UPDATE test
+             SET {}
+             WHERE id=?
+          """.format(', '.join(name + '=?' for name, _ in _SUMMARY_COLUMNS))
+    con.execute(sql, values + [test_id])
+
+
 def _update_tag_links(con: sqlite3.Connection, test_id: int, tag_values: list[str]):
     '''Sync tags in the test_tags table with those given in this function.
     
     Tags found in the database that are not found in the list of tags given
     here are deleted. Tags provided in the tags list which are not yet present
     int the database are inserted.
+
+    Works on whole sets: missing tags are inserted together, new links are
+    inserted together and stale links are removed by a single DELETE.
     '''
 
     if tag_values == None: return
 
-    # attempt to add all provided tags to tag via links
-    for value in tag_values:
-        tag_id = _read_tag_id_by_value(con, value)
-        
-        # if tag exists: 
-        if tag_id:
-            # this function handles duplicate tag links
-            try:
-                _create_tag_link(con, test_id, tag_id)
-            except DatabaseError:
-                pass # continue if link already exists 
+    tag_values = list(dict.fromkeys(tag_values))
+    cur = con.cursor()
 
-        else:
-            # if tag does not already exist, create it and add a link from it to test
-            tag_id = _create_tag(con, value)
-            _create_tag_link(con, test_id, tag_id)
+    # the ids are read from the database rather than the tag cache, which may
+    # be stale (other processes and connections, rolled back transactions)
+    value_list = json.dumps([str(value) for value in tag_values])
+    sql = """
+             SELECT value, id
+             FROM tag
+             WHERE value IN (SELECT value FROM json_each(?))
+          """
+    found = dict(cur.execute(sql, (value_list,)).fetchall())
 
+    # add tags which do not exist yet
+    new_values = [value for value in tag_values if value not in found]
+    if new_values:
+        cur.executemany("INSERT OR IGNORE INTO tag(value) VALUES(?)",
+                        [(value,) for value in new_values])
+        found = dict(cur.execute(sql, (value_list,)).fetchall())
+        _invalidate_tag_cache()
 
-    # delete tag links from database which are not present in the list provided
-    existing_tags = _read_linked_tag_ids_by_test_id(con, test_id)
-    if existing_tags:
-        for tag_id in existing_tags:
+    linked_ids = [found[value] for value in tag_values]
 
-            # check if existing tag value matches one provided
-            existing_tag_value = _read_tag_value_by_tag_id(con, tag_id)
-            if existing_tag_value not in tag_values:
+    # link every tag given, existing links are left as they are
+    cur.executemany("INSERT OR IGNORE INTO test_tag(test_id, tag_id) VALUES(?,?)",
+                    [(test_id, tag_id) for tag_id in linked_ids])
 
-                # if not, delete the link to it from the database
-                _delete_tag_link(con, test_id, tag_id)      
+    # unlink every tag not given
+    sql = """
+             DELETE FROM test_tag
+             WHERE test_id=?
+             AND tag_id NOT IN (SELECT value FROM json_each(?))
+          """
+    cur.execute(sql, (test_id, json.dumps(linked_ids)))
 
 
 def _delete_tag_link(con: sqlite3.Connection, test_id: int, tag_id: int):
@@ -836,11 +2630,17 @@ def _delete_tag_by_id(con: sqlite3.Connection, tag_id: int):
              WHERE id=?
           """
     cur.execute(sql, (tag_id,))
+    _invalidate_tag_cache()
 
 
 def main():
-    return
+    '''Backfill the summaries of tests saved by older versions.'''
+
+    def report(done, total):
+        print('\rsummarised {} / {} tests'.format(done, total), end='')
+
+    count = DatabaseManager().backfill_test_summaries(progress=report)
+    print('\n{} summaries written'.format(count))
 
-configure()
 if __name__ == '__main__':
     main()
@@ -0,0 +1,255 @@
+'''Boolean tag queries compiled to SQL.
+
+A query combines tag names and creation date conditions with AND, OR, NOT
+and parentheses, e.g.
+
+    (range-A OR range-B) AND drill AND NOT calibration
+    drill AND created >= 2024-01-01 AND created < 2024-03-01
+
+Terms written next to each other without an operator are ANDed. Tag names
+run up to the next space or parenthesis; quote them ("wet floor") if they
+contain either, or if they are one of the keywords. Keywords are not case
+sensitive. Dates are YYYY-MM-DD or YYYY-MM-DDTHH:MM[:SS]. A date without a
+time stands for that whole day, so 'created <= 2024-01-31' includes all of
+January 31st.
+
+compile_query turns a query into a WHERE clause over the 'test' table with
+one parameter per tag or date, so the whole query runs as a single
+statement using the tag_value, test_tag_tag_id and test_created indexes.
+'''
+
+import re
+import datetime
+from dataclasses import dataclass
+
+
+class TagQueryError(ValueError):
+    '''Raised when a tag query cannot be parsed.'''
+
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+
+@dataclass
+class TagTerm:
+    value: str
+
+
+@dataclass
+class DateTerm:
+    operator: str
+    value: datetime.datetime
+    whole_day: bool = False
+
+
+@dataclass
+class NotExpression:
+    operand: object
+
+
+@dataclass
+class AndExpression:
+    operands: list
+
+
+@dataclass
+class OrExpression:
+    operands: list
+
+
+_KEYWORDS = ('AND', 'OR', 'NOT')
+_DATE_FIELD = 'created'
+
+_TOKEN_PATTERN = re.compile(r'''
+      \s*(?:
+        (?P<open>\()
+      | (?P<close>\))
+      | (?P<operator>>=|<=|>|<|=)
+      | "(?P<quoted>[^"]*)"
+      | (?P<word>[^\s()"<>=]+)
+      )''', re.VERBOSE)
+
+
+def _tokenize(text: str) -> list:
+    '''Split a query into (kind, value) tokens.'''
+
+    tokens = []
+    position = 0
+    text = text.rstrip()
+
+    while position < len(text):
+        match = _TOKEN_PATTERN.match(text, position)
+        if match is None or match.end() == position:
+            raise TagQueryError('Unexpected character at position {}: {!r}'.format(position, text[position:]))
+        position = match.end()
+
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value.upper() in _KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        elif kind == 'quoted':
+            kind = 'tag'
+        elif kind == 'word':
+            kind = 'tag'
+        tokens.append((kind, value))
+
+    return tokens
+
+
+class _Parser:
+    '''Recursive descent parser, from lowest to highest precedence:
+    OR, AND (explicit or implied), NOT, then terms and parentheses.'''
+
+    def __init__(self, tokens: list):
+        self._tokens = tokens
+        self._position = 0
+
+    def parse(self):
+        if not self._tokens:
+            raise TagQueryError('Query is empty.')
+
+        expression = self._parse_or()
+        if self._peek() is not None:
+            raise TagQueryError('Unexpected {!r}.'.format(self._peek()[1]))
+        return expression
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise TagQueryError('Query ended unexpectedly.')
+        self._position += 1
+        return token
+
+    def _parse_or(self):
+        operands = [self._parse_and()]
+        while self._peek() == ('keyword', 'OR'):
+            self._next()
+            operands.append(self._parse_and())
+        return operands[0] if len(operands) == 1 else OrExpression(operands)
+
+    def _parse_and(self):
+        operands = [self._parse_not()]
+        while True:
+            token = self._peek()
+            if token == ('keyword', 'AND'):
+                self._next()
+            elif token is None or token == ('keyword', 'OR') or token[0] == 'close':
+                break
+            operands.append(self._parse_not())
+        return operands[0] if len(operands) == 1 else AndExpression(operands)
+
+    def _parse_not(self):
+        if self._peek() == ('keyword', 'NOT'):
+            self._next()
+            return NotExpression(self._parse_not())
+        return self._parse_term()
+
+    def _parse_term(self):
+        kind, value = self._next()
+
+        if kind == 'open':
+            expression = self._parse_or()
+            if self._next()[0] != 'close':
+                raise TagQueryError('Missing closing parenthesis.')
+            return expression
+
+        if kind == 'tag':
+            # 'created' followed by a comparison is a date condition
+            token = self._peek()
+            if value.lower() == _DATE_FIELD and token is not None and token[0] == 'operator':
+                operator = self._next()[1]
+                date_kind, date_text = self._next()
+                if date_kind != 'tag':
+                    raise TagQueryError('Expected a date after {!r}.'.format(operator))
+                date, whole_day = _parse_date(date_text)
+                return DateTerm(operator, date, whole_day)
+            return TagTerm(value)
+
+        raise TagQueryError('Unexpected {!r}.'.format(value))
+
+
+def _parse_date(text: str):
+    '''Parse a date or date and time, and whether it names a whole day.'''
+
+    try:
+        if re.fullmatch(r'\d{4}-\d{2}-\d{2}', text):
+            return datetime.datetime.strptime(text, '%Y-%m-%d'), True
+        return datetime.datetime.fromisoformat(text), False
+    except ValueError:
+        raise TagQueryError('Invalid date: {!r}.'.format(text))
+
+
+def parse(text: str):
+    '''Parse a tag query into an expression tree of TagTerm, DateTerm,
+    NotExpression, AndExpression and OrExpression objects.'''
+
+    return _Parser(_tokenize(text)).parse()
+
+
+def compile_query(text: str):
+    '''Compile a tag query into a condition on the 'test' table.
+
+    Return
+    ------
+    condition: str
+        SQL expression to use in a WHERE clause of a query over 'test'
+    parameters: list
+        Values for the '?' placeholders in 'condition', in order
+    '''
+
+    parameters = []
+    condition = _compile(parse(text), parameters)
+    return condition, parameters
+
+
+def _compile(expression, parameters: list) -> str:
+
+    if isinstance(expression, TagTerm):
+        parameters.append(expression.value)
+        return """test.id IN (SELECT test_tag.test_id
+                              FROM test_tag
+                              JOIN tag ON tag.id = test_tag.tag_id
+                              WHERE tag.value = ?)"""
+
+    if isinstance(expression, DateTerm):
+        return _compile_date(expression, parameters)
+
+    if isinstance(expression, NotExpression):
+        return 'NOT ({})'.format(_compile(expression.operand, parameters))
+
+    if isinstance(expression, AndExpression):
+        return ' AND '.join('({})'.format(_compile(operand, parameters)) for operand in expression.operands)
+
+    if isinstance(expression, OrExpression):
+        return ' OR '.join('({})'.format(_compile(operand, parameters)) for operand in expression.operands)
+
+    raise TagQueryError('Unknown expression: {!r}'.format(expression))
+
+
+def _compile_date(term: DateTerm, parameters: list) -> str:
+
+    if not term.whole_day:
+        parameters.append(term.value)
+        return 'test.created {} ?'.format(term.operator)
+
+    # a bare date covers the whole day
+    day_start = term.value
+    next_day = day_start + datetime.timedelta(days=1)
+
+    if term.operator == '=':
+        parameters += [day_start, next_day]
+        return 'test.created >= ? AND test.created < ?'
+
+    operator, bound = {
+        '>=': ('>=', day_start),
+        '<': ('<', day_start),
+        '>': ('>=', next_day),
+        '<=': ('<', next_day),
+    }[term.operator]
+    parameters.append(bound)
+    return 'test.created {} ?'.format(operator)
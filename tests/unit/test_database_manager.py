@@ -3,12 +3,15 @@ import os
 import datetime
 import sys
 import taglib
+import sqlite3
 
 sys.path.append('src')
 import settings
-import database_manager as db
+import storage as db
+import signal_processor as processor
 import numpy as np
-from database_manager import DmgData
+from storage import DmgData
+from scipy.io import wavfile
 
 
 TEST_FOLDER = os.path.dirname(__file__)
@@ -59,9 +62,12 @@ def test_save_test_data_to_file():
     path = os.path.join(TEST_SAVE_LOCATION, 'files/test_wav.wav')
     db._save_test_data_to_file(path, data)
 
-    with taglib.File(path) as file:
-        assert file.tags['CHANNELS'][0] == '3'
-        assert file.tags['PROCESSED'][0] == 'True'
+    with open(path, 'rb') as file:
+        header = db._read_dmg_header(file)
+    assert header.metadata['audio_channels'] == 3
+    assert header.metadata['processed'] == True
+    assert (header.channels, header.num_frames, header.sample_rate) == (3, 10, 100)
+    assert not os.path.exists(path + '.tmp')
     os.remove(path)
     os.remove(settings._CONFIG_FILE_PATH)
 
@@ -91,6 +97,161 @@ def test_read_test_data_from_file():
 
     os.remove(settings._CONFIG_FILE_PATH)
 
+def test_compact_test_data_file():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION)
+    data = DmgData()
+    data.audio_data = np.random.default_rng(0).integers(-1000, 1000, (1000, 2)).astype(np.int16)
+    data.trigger_data = np.zeros((1000, 1))
+    data.trigger_data[100:400] = 1
+    data.output_data = np.zeros(1000)
+    data.output_data[200:500] = 1
+    data.sample_rate = 100
+    data.is_processed = True
+
+    path = os.path.join(TEST_SAVE_LOCATION, 'files/test_compact.wav')
+    db._save_test_data_to_file(path, data)
+
+    # audio in its own type, trigger and output as a handful of runs
+    assert os.path.getsize(path) < data.audio_data.nbytes + 2048
+    new_data = db._read_test_data_from_file(path)
+    assert new_data.audio_data.dtype == np.int16
+    assert np.array_equal(new_data.audio_data, data.audio_data)
+    assert new_data.is_processed
+
+    runs = new_data.trigger_runs
+    assert list(runs.starts) == [0, 100, 400] and list(runs.values) == [0, 1, 0]
+    assert new_data._trigger is runs
+
+    assert np.array_equal(new_data.trigger_data, np.ravel(data.trigger_data))
+    assert np.array_equal(new_data.output_data, data.output_data)
+
+    os.remove(path)
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_read_legacy_test_data_file():
+    '''Files with the trigger and output stored as float .wav channels still load.'''
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION)
+
+    audio = np.ones((10, 2))
+    trigger = np.zeros((10, 1))
+    trigger[3:6] = 1
+    output = np.ones((10, 1))
+
+    path = os.path.join(TEST_SAVE_LOCATION, 'files/test_legacy.wav')
+    wavfile.write(path, 100, np.hstack((audio, trigger, output)))
+    with taglib.File(path, save_on_exit=True) as file:
+        file.tags['CHANNELS'] = ['2']
+        file.tags['PROCESSED'] = ['True']
+    modified = os.path.getmtime(path)
+
+    data = db._read_test_data_from_file(path)
+    assert np.array_equal(data.audio_data, audio)
+    assert np.array_equal(data.trigger_data, trigger[:, 0])
+    assert np.array_equal(data.output_data, output[:, 0])
+    assert data.is_processed
+
+    # reading never writes to the file
+    assert os.path.getmtime(path) == modified
+
+    os.remove(path)
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_dmg_writer_is_atomic():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION)
+    path = os.path.join(TEST_SAVE_LOCATION, 'files/test_atomic.dmg')
+
+    data = DmgData()
+    data.audio_data = np.zeros((10, 1), dtype=np.float32)
+    data.trigger_data = np.zeros(10)
+    data.sample_rate = 100
+    db._save_test_data_to_file(path, data)
+
+    # a save failing part way leaves the previous file as it was
+    with pytest.raises(RuntimeError):
+        with db._DmgWriter(path, 100, 1, 10, np.float32) as writer:
+            writer.write_audio(np.ones((5, 1)))
+            raise RuntimeError()
+
+    with pytest.raises(db.DatabaseError):
+        with db._DmgWriter(path, 100, 1, 10, np.float32) as writer:
+            writer.write_audio(np.ones((5, 1)))
+
+    assert not any(name.endswith('.tmp') for name in os.listdir(os.path.dirname(path)))
+    assert np.array_equal(db._read_test_data_from_file(path).audio_data, data.audio_data)
+
+    os.remove(path)
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_channel_runs():
+
+    channel = np.array([0, 0, 1, 1, 1, 0, 2, 2])
+    runs = db.ChannelRuns.from_dense(channel)
+    assert list(runs.starts) == [0, 2, 5, 6]
+    assert np.array_equal(runs.to_dense(), channel)
+
+    # runs continuing across pieces are merged
+    joined = db.ChannelRuns.join([db.ChannelRuns.from_dense(channel[:3]),
+                                  db.ChannelRuns.from_dense(channel[3:4]),
+                                  db.ChannelRuns.from_dense(channel[4:])])
+    assert list(joined.starts) == list(runs.starts)
+    assert np.array_equal(joined.to_dense(), channel)
+
+    assert len(db.ChannelRuns.from_dense(np.zeros(0)).to_dense()) == 0
+
+
+def test_migrate_existing_database():
+    '''Test that a database from before schema versioning is upgraded in place.'''
+
+    settings.__init__()
+    os.makedirs(os.path.join(TEST_SAVE_LOCATION, 'db'), exist_ok=True)
+    db_path = os.path.join(TEST_SAVE_LOCATION, 'db/test.db')
+
+    # original schema, holding the duplicates it allowed
+    con = sqlite3.connect(db_path)
+    con.execute("CREATE TABLE test (id INTEGER PRIMARY KEY NOT NULL, name TEXT NOT NULL, created TIMESTAMP NOT NULL, notes TEXT, data_file_path TEXT)")
+    con.execute("CREATE TABLE test_tag (test_id INTEGER, tag_id INTEGER)")
+    con.execute("CREATE TABLE tag (id INTEGER PRIMARY KEY, value TEXT)")
+    con.executemany("INSERT INTO test VALUES (?,?,?,?,?)", [(1, 'a', datetime.datetime.now(), '', 'a.dmg'),
+                                                            (2, 'a', datetime.datetime.now(), '', 'a2.dmg')])
+    con.executemany("INSERT INTO tag VALUES (?,?)", [(1, 'x'), (2, 'y'), (3, 'x')])
+    con.executemany("INSERT INTO test_tag VALUES (?,?)", [(1, 1), (1, 3), (2, 2), (2, 2)])
+    con.commit()
+    con.close()
+
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    con = db._connect()
+    cur = con.cursor()
+
+    assert cur.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    assert cur.execute("SELECT id, name FROM test ORDER BY id").fetchall() == [(1, 'a'), (2, 'a (2)')]
+    assert cur.execute("SELECT id, value FROM tag ORDER BY id").fetchall() == [(1, 'x'), (2, 'y')]
+    assert sorted(cur.execute("SELECT test_id, tag_id FROM test_tag").fetchall()) == [(1, 1), (2, 2)]
+
+    # lookups are served by the new indexes
+    plan = cur.execute("EXPLAIN QUERY PLAN SELECT id FROM tag WHERE value=?", ('x',)).fetchall()
+    assert 'tag_value' in plan[0][3]
+
+    with pytest.raises(db.DatabaseError):
+        db._create_test(con, name='a', creation_date=datetime.datetime.now(), notes='')
+
+    con.close()
+
+    # configuring again leaves an up to date database alone
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+
+    os.remove(db_path)
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
 def test_create_test():
 
     settings.__init__()
@@ -111,7 +272,7 @@ def test_create_test():
     assert path == data_file_path
 
     sql = """
-             SELECT *
+             SELECT id, name, created, notes, data_file_path
              FROM test
              WHERE id=1
           """
@@ -493,6 +654,95 @@ def test_update_tag_links():
     os.remove(settings._CONFIG_FILE_PATH)
 
 
+def test_update_tag_links_statement_count():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    con = db._connect()
+
+    # statements run by the code itself, not by triggers or the search index
+    statements = []
+    con.set_trace_callback(lambda statement: statements.append(statement)
+                           if not statement.startswith('--') and "'main'." not in statement else None)
+
+    # new tags and links are inserted in bulk, removals take one statement
+    tags = ['tag{}'.format(i) for i in range(40)]
+    db._update_tag_links(con, 1, tags)
+    assert len([statement for statement in statements if not statement.startswith('INSERT OR IGNORE')]) < 5
+    assert len([statement for statement in statements if statement.lstrip().startswith('DELETE')]) == 1
+    assert sorted(db._read_linked_tag_ids_by_test_id(con, 1)) == list(range(1, 41))
+
+    # known tags are resolved by a single lookup, nothing is inserted
+    statements.clear()
+    db._update_tag_links(con, 1, tags[10:] + ['tag5', 'tag5'])
+    assert len([statement for statement in statements if 'FROM tag\n' in statement]) == 1
+    assert not any('INTO tag(' in statement for statement in statements)
+    assert sorted(db._read_linked_tag_ids_by_test_id(con, 1)) == [6] + list(range(11, 41))
+
+    # the cache follows tag writes
+    db._create_tag(con, 'extra')
+    db._delete_tag_by_id(con, 1)
+    assert list(db._read_tag_ids(con))[0] == 'tag1'
+    assert 'tag0' not in db._read_tag_ids(con)
+    assert 'extra' in db._read_tag_ids(con)
+
+    con.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_update_tag_links_stale_cache():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    con = db._connect()
+    other = db._connect()
+
+    db._update_tag_links(con, 1, ['tag1', 'tag2'])
+    con.commit()
+    assert db._read_tag_ids(con) == {'tag1': 1, 'tag2': 2}
+
+    # another connection deletes tag2 and adds tag3 behind the cache
+    other.execute("DELETE FROM tag WHERE value='tag2'")
+    other.execute("INSERT INTO tag(value) VALUES('tag3')")
+    other.commit()
+
+    db._update_tag_links(con, 2, ['tag2', 'tag3'])
+    tag_ids = sorted(db._read_linked_tag_ids_by_test_id(con, 2))
+    assert [db._read_tag_value_by_tag_id(con, tag_id) for tag_id in tag_ids] == ['tag3', 'tag2']
+
+    # a cached id that does not belong to the value is not linked
+    db._read_tag_ids(con)['tag1'] = 99
+    db._update_tag_links(con, 3, ['tag1'])
+    assert db._read_linked_tag_ids_by_test_id(con, 3) == [1]
+
+    other.close()
+    con.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_transaction_rollback_resets_tag_cache():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    try:
+        with manager.transaction() as con:
+            db._update_tag_links(con, 1, ['tag1'])
+            assert 'tag1' in db._read_tag_ids(con)
+            raise RuntimeError('abort')
+    except RuntimeError:
+        pass
+
+    assert manager.list_existing_tags() == None
+
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
 def test_delete_tag_link():
     
     settings.__init__()
@@ -623,6 +873,508 @@ def test_delete_tag_by_id():
     os.remove(settings._CONFIG_FILE_PATH)
 
 
+def test_manager_transaction():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    # one connection is reused for every call on this thread
+    with manager.transaction() as con:
+        with manager.transaction() as inner_con:
+            assert inner_con is con
+    assert manager._connection() is con
+
+    # a failing transaction leaves nothing behind
+    with pytest.raises(db.DatabaseError):
+        with manager.transaction() as con:
+            db._create_tag(con, 'first')
+            db._create_tag(con, 'first')
+    assert manager.list_existing_tags() is None
+
+    manager.create_new_tag('second')
+    assert manager.list_existing_tags() == ['second']
+
+    # reconfiguring replaces the connection
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='other.db')
+    assert manager._connection() is not con
+    assert manager.list_existing_tags() is None
+
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/other.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_list_tests():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    for name, tags in [('first', ['a', 'b, c']), ('second', ['b, c']), ('third', None), ('fourth', ['a', 'd'])]:
+        test = manager.create_new_test(name)
+        test.tags = tags
+        manager.save_active_test_data()
+
+    tests = manager.list_tests()
+    assert [test.name for test in tests] == ['first', 'second', 'third', 'fourth']
+    assert sorted(tests[0].tags) == ['a', 'b, c']
+    assert tests[2].tags is None
+    assert isinstance(tests[0].creation_date, datetime.datetime)
+
+    # linked to any of the tags, each test listed once
+    tests = manager.list_tests_by_tags(['a', 'b, c'])
+    assert [test.name for test in tests] == ['first', 'second', 'fourth']
+    assert sorted(tests[2].tags) == ['a', 'd']
+    assert manager.list_tests_by_tags(['missing']) is None
+
+    test_id = tests[1].id
+    assert manager.list_tests(test_ids=[test_id]) == [tests[1]]
+    assert manager.list_tests(tags=['d'], test_ids=[test_id]) == []
+
+    # more ids than SQLite takes host parameters
+    many_ids = list(range(-100000, 0)) + [test_id]
+    assert manager.list_tests(test_ids=many_ids) == [tests[1]]
+
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_search():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    for name, notes, tags in [('hammer drop', 'steel floor', ['impact']),
+                              ('floor scrape', 'hammer was used', ['abrasion', 'steel']),
+                              ('baseline', 'quiet room', None)]:
+        test = manager.create_new_test(name)
+        test.notes = notes
+        test.tags = tags
+        manager.save_active_test_data()
+
+    # prefixes of every word must match, name matches rank first
+    assert [test.name for test in manager.search('hamm')] == ['hammer drop', 'floor scrape']
+    assert [test.name for test in manager.search('ste flo')] == ['floor scrape', 'hammer drop']
+    assert [test.name for test in manager.search('abras')] == ['floor scrape']
+    assert manager.search('missing') == []
+    assert manager.search('"(*') == manager.search('')
+
+    # paging
+    assert [test.name for test in manager.search('', limit=2, offset=1)] == ['floor scrape', 'baseline']
+    assert [test.name for test in manager.search('hamm', limit=1, offset=1)] == ['floor scrape']
+
+    # the index follows edits to tests and tags
+    test = manager.load_existing_test_by_name('baseline')
+    test.notes = 'hammer test'
+    test.tags = ['calibration']
+    manager.save_active_test_data()
+    assert [test.name for test in manager.search('calib')] == ['baseline']
+
+    manager.delete_tag_by_value('calibration')
+    assert manager.search('calib') == []
+
+    manager.delete_test_entry_by_name('hammer drop')
+    assert sorted(test.name for test in manager.search('hamm')) == ['baseline', 'floor scrape']
+
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_lazy_test_data(monkeypatch):
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    data = DmgData()
+    data.audio_data = np.ones((10,2))
+    data.trigger_data = np.zeros((10,1))
+    data.sample_rate = 100
+
+    test = manager.create_new_test('lazy')
+    test.tags = ['tag_a']
+    test.data = data
+    manager.save_active_test_data()
+
+    reads = []
+    read_test_data_from_file = db._read_test_data_from_file
+    monkeypatch.setattr(db, '_read_test_data_from_file',
+                        lambda *args, **kwargs: reads.append(args) or read_test_data_from_file(*args, **kwargs))
+
+    # listing and loading only touch the database
+    tests = manager.list_tests_by_tags(['tag_a'])
+    test = manager.load_existing_test_by_name('lazy')
+    assert [entry.name for entry in tests] == ['lazy']
+    assert reads == []
+
+    # saving metadata does not load or rewrite the data
+    test.notes = 'notes'
+    manager.save_active_test_data()
+    assert reads == []
+
+    assert np.array_equal(test.data.audio_data, data.audio_data)
+    assert test.data is test.data
+    assert len(reads) == 1
+
+    mapped = manager.load_existing_test_by_name('lazy').load_data(mmap=True)
+    assert np.array_equal(mapped.audio_data, data.audio_data)
+    del mapped
+
+    manager.delete_active_test_entry()
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_mapped_test_data():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    data = DmgData()
+    data.audio_data = np.arange(3000, dtype=np.float32).reshape(1000, 3)
+    data.trigger_data = np.zeros(1000)
+    data.sample_rate = 100
+
+    test = manager.create_new_test('mapped')
+    test.data = data
+    manager.save_active_test_data()
+
+    # loaded data is a map of the file, channels are views of the map
+    test = manager.load_existing_test_by_name('mapped')
+    audio = test.data.audio_data
+    assert isinstance(audio, np.memmap)
+    channel = test.data.audio_channel(1)
+    assert np.shares_memory(channel, audio)
+    assert channel.strides == (12,)
+    assert np.array_equal(channel, data.audio_data[:, 1])
+
+    # the mapped test can be processed and saved over its own file
+    test.data.output_data = np.ones(1000)
+    test.data.is_processed = True
+    manager.save_active_test_data()
+    saved = manager.load_existing_test_by_name('mapped').data
+    assert np.array_equal(saved.audio_data, data.audio_data)
+    assert saved.is_processed and np.all(saved.output_data == 1)
+
+    del audio, channel, saved
+    manager.delete_active_test_entry()
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_iter_blocks():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    sample_rate = 200
+    rng = np.random.default_rng(0)
+    data = DmgData()
+    data.audio_data = rng.normal(0, 0.05, (sample_rate * 30 + 7, 2)).astype(np.float32)
+    data.audio_data[sample_rate * 12:sample_rate * 14] *= 20
+    data.trigger_data = np.zeros(len(data.audio_data))
+    data.trigger_data[sample_rate * 5:sample_rate * 11] = 1
+    data.output_data = (rng.random(len(data.audio_data)) > 0.99).astype(float)
+    data.is_processed = True
+    data.sample_rate = sample_rate
+
+    test = manager.create_new_test('blocks')
+    test.data = data
+    manager.save_active_test_data()
+
+    blocks = list(manager.iter_blocks(test.id, block_seconds=4.0, overlap=0.5))
+    assert [block.start_frame for block in blocks[:3]] == [0, 700, 1500]
+    assert [block.overlap_frames for block in blocks[:3]] == [0, 100, 100]
+    for block in blocks:
+        stop = block.start_frame + len(block.audio)
+        assert np.array_equal(block.audio, data.audio_data[block.start_frame:stop])
+        assert np.array_equal(block.trigger, data.trigger_data[block.start_frame:stop])
+        assert np.array_equal(block.output, data.output_data[block.start_frame:stop])
+
+    trimmed = [block.without_overlap() for block in blocks]
+    assert np.array_equal(np.concatenate([block.audio for block in trimmed]), data.audio_data)
+
+    # block-wise processing gives the same result as processing it whole
+    detector = processor.StreamingDamageDetector(sample_rate)
+    for block in trimmed:
+        detector.push(block.audio, block.trigger)
+    ranges = detector.flush()
+    dmg_detections = processor.detect_damage_analytically(data.audio_data, sample_rate)
+    assert np.array_equal(detector.get_detections(), dmg_detections)
+    assert ranges == processor.score_damage(dmg_detections, data.trigger_data, sample_rate)[1]
+
+    with pytest.raises(ValueError):
+        next(manager.iter_blocks(test.id, block_seconds=1.0, overlap=1.0))
+    with pytest.raises(db.DatabaseError):
+        next(manager.iter_blocks(-1))
+
+    manager.delete_active_test_entry()
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_recording_journal_finalize():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+
+    audio = np.random.default_rng(0).uniform(-1, 1, (1000, 2)).astype(np.float32)
+    journal = db.RecordingJournal(sample_rate=100, channels=2, name='journal_test')
+    for start in range(0, 1000, 64):
+        journal.write_audio(audio[start:start+64])
+    journal.write_trigger([10, 11.999], [None, 0.1])
+    journal.write_trigger([12, 15.999, 16], [0.9, 0.9, 0.0])
+    journal.set_audio_start_time(10)
+    journal.close()
+
+    assert db.list_journals() == [journal.path]
+
+    summary = db.finalize_journal(journal.path, 'journal_test.dmg')
+    assert db.list_journals() == []
+    assert not os.path.isdir(journal.path)
+
+    data = db._read_test_data_from_file('journal_test.dmg')
+    assert data.sample_rate == 100
+    assert np.array_equal(data.audio_data, audio)
+
+    # trigger readings interpolated at the time of each frame
+    assert np.all(data.trigger_data[0:200] == 0)
+    assert np.all(data.trigger_data[200:600] == 1)
+    assert np.all(data.trigger_data[600:] == 0)
+
+    assert summary.sample_count == 1000 and summary.channel_count == 2
+    assert summary.trigger_active_time == pytest.approx(4.0)
+    assert summary.peak_level == pytest.approx(np.abs(audio).max())
+
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'files/journal_test.dmg'))
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_finalized_recording_is_mapped_until_saved():
+    '''Test that a finalized recording is mapped from disk and moves to the test's file once saved.'''
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+
+    audio = np.random.default_rng(1).uniform(-1, 1, (500, 2)).astype(np.float32)
+    journal = db.RecordingJournal(sample_rate=100, channels=2, name='mapped_test')
+    journal.write_audio(audio)
+    journal.set_audio_start_time(0)
+    journal.close()
+
+    data = db.finalize_recording(journal.path)
+    recording_file = os.path.join(TEST_SAVE_LOCATION, 'files/mapped_test.recording.dmg')
+    assert isinstance(data.audio_data, np.memmap)
+    assert os.path.samefile(data.audio_data.filename, recording_file)
+    assert np.array_equal(data.audio_data, audio)
+
+    manager = db.DatabaseManager()
+    test = manager.create_new_test('mapped_test')
+    test.data = data
+    manager.save_active_test_data()
+
+    # the same data, now mapped from the test's own file
+    assert test.data is data
+    assert os.path.samefile(data.audio_data.filename,
+                            os.path.join(TEST_SAVE_LOCATION, 'files', test.data_file_path))
+    assert np.array_equal(data.audio_data, audio)
+    assert not os.path.exists(recording_file)
+
+    manager.delete_active_test_entry()
+
+    # a recording that is discarded is removed
+    journal = db.RecordingJournal(sample_rate=100, channels=2, name='discarded')
+    journal.write_audio(audio)
+    journal.close()
+    manager.create_new_test('discarded').data = db.finalize_recording(journal.path)
+    manager.discard_active_entry()
+    assert db.list_recording_files() == []
+
+    # one never saved, e.g. after a crash, is recovered as a test
+    journal = db.RecordingJournal(sample_rate=100, channels=2, name='unsaved')
+    journal.write_audio(audio)
+    journal.close()
+    del journal, data
+    db.finalize_recording(db.list_journals()[0])
+
+    recovered = manager.recover_interrupted_recordings()
+    assert [test.name for test in recovered] == ['unsaved']
+    assert recovered[0].summary.sample_count == 500
+    assert db.list_recording_files() == []
+    assert np.array_equal(manager.load_existing_test_by_name('unsaved').data.audio_data, audio)
+
+    manager.delete_active_test_entry()
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_recover_interrupted_recordings(monkeypatch):
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+
+    journal = db.RecordingJournal(sample_rate=100, channels=2, name='crashed')
+    journal.write_audio(np.ones((300, 2), dtype=np.float32))
+    journal.close()
+
+    # a frame cut short by the crash
+    with open(os.path.join(journal.path, 'audio.raw'), 'ab') as file:
+        file.write(b'\x00' * 5)
+
+    manager = db.DatabaseManager()
+
+    # the journal is kept, and nothing else left behind, if the test cannot be committed
+    def fail(*args): raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(db, '_update_test_summary', fail)
+    files = os.listdir(os.path.join(TEST_SAVE_LOCATION, 'files'))
+    with pytest.raises(db.DatabaseError):
+        manager.recover_interrupted_recordings()
+    assert db.list_journals() == [journal.path]
+    assert os.listdir(os.path.join(TEST_SAVE_LOCATION, 'files')) == files
+    monkeypatch.undo()
+
+    recovered = manager.recover_interrupted_recordings()
+
+    assert len(recovered) == 1
+    assert recovered[0].name == 'crashed'
+    assert recovered[0].summary.duration == pytest.approx(3.0)
+    assert db.list_journals() == []
+
+    test = manager.load_existing_test_by_name('crashed')
+    assert test.data.audio_data.shape == (300, 2)
+    assert np.all(test.data.trigger_data == 0)
+
+    # a journal without audio cannot be recovered
+    broken = db.RecordingJournal(sample_rate=100, channels=2, name='broken')
+    broken.close()
+
+    with pytest.raises(db.DatabaseError):
+        manager.recover_interrupted_recordings()
+
+    failed = []
+    assert manager.recover_interrupted_recordings(on_error=lambda path, error: failed.append(path)) == []
+    assert failed == [broken.path]
+
+    for name in os.listdir(broken.path): os.remove(os.path.join(broken.path, name))
+    os.rmdir(broken.path)
+    manager.delete_active_test_entry()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_test_summaries(monkeypatch):
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    for name, length, level in [('long', 400, 0.5), ('short', 100, 0.25), ('empty', None, None)]:
+        test = manager.create_new_test(name)
+        if length:
+            data = DmgData()
+            data.audio_data = np.full((length, 2), level)
+            data.audio_data[0, 1] = -2 * level
+            data.trigger_data = np.zeros((length, 1))
+            data.trigger_data[10:60] = 1
+            data.sample_rate = 100
+            test.data = data
+        manager.save_active_test_data()
+
+    # listing and sorting by the summary does not read any data file
+    monkeypatch.setattr(db, '_read_test_data_from_file', None)
+    tests = manager.list_tests(order_by='duration', descending=True)
+    monkeypatch.undo()
+
+    assert [test.name for test in tests] == ['long', 'short', 'empty']
+    assert tests[2].summary is None
+    summary = tests[1].summary
+    assert (summary.sample_count, summary.sample_rate, summary.channel_count) == (100, 100, 2)
+    assert summary.duration == 1.0
+    assert summary.peak_level == 0.5
+    assert summary.rms_level == pytest.approx(np.sqrt((199 * 0.25 ** 2 + 0.5 ** 2) / 200))
+    assert summary.is_processed is False
+    assert summary.trigger_active_time == 0.5
+
+    with pytest.raises(db.DatabaseError):
+        manager.list_tests(order_by='notes; DROP TABLE test')
+
+    # tests saved before summaries were kept are filled in by the backfill
+    with manager.transaction() as con:
+        db._update_test_summary(con, tests[0].id, None)
+    assert manager.list_tests(test_ids=[tests[0].id])[0].summary is None
+
+    progress = []
+    assert manager.backfill_test_summaries(progress=lambda done, total: progress.append((done, total))) == 1
+    assert progress == [(1, 2), (2, 2)]
+    assert manager.list_tests(test_ids=[tests[0].id])[0].summary == tests[0].summary
+
+    for test in tests:
+        manager.delete_test_entry_by_name(test.name)
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_damage_events():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    # results of a test processed before it was first saved are kept until the save
+    test = manager.create_new_test('unsaved')
+    manager.record_damage_events([(0.0, 1.0, 0), (1.0, 4.0, 4), (4.0, 4.5, 3)], detector='ANALYTICAL',
+                                 params={'threshold': 0.225})
+    assert manager.list_damage_events() == []
+    manager.save_active_test_data()
+
+    events = manager.list_damage_events(test_id=test.id)
+    assert [(event.start_s, event.end_s, event.damage_class) for event in events] == [(1.0, 4.0, 4), (4.0, 4.5, 3)]
+    assert events[0].detector == 'ANALYTICAL'
+    assert events[0].params_hash == db.damage_params_hash({'threshold': 0.225}) != db.damage_params_hash({'threshold': 0.3})
+    assert test.damage_events is None
+
+    # a saved test's results are written right away and replace the old ones
+    other = manager.create_new_test('saved')
+    manager.save_active_test_data()
+    manager.record_damage_events([(0.0, 1.5, 4), (2.0, 3.0, 2)], detector='ANALYTICAL')
+    assert len(manager.list_damage_events(test_id=other.id)) == 2
+
+    assert [test.name for test in manager.list_tests_with_damage(4, min_duration=2.0)] == ['unsaved']
+    assert [test.name for test in manager.list_tests_with_damage(4, min_duration=1.0)] == ['unsaved', 'saved']
+    assert [event.test_id for event in manager.list_damage_events(damage_class=2)] == [other.id]
+    assert manager.list_tests_with_damage(1) == []
+
+    manager.record_damage_events([], detector='ANALYTICAL')
+    assert manager.list_damage_events(test_id=other.id) == []
+
+    # class and duration lookups are served by the indexes
+    with manager.transaction() as con:
+        plan = con.execute("EXPLAIN QUERY PLAN SELECT DISTINCT test_id FROM damage_event WHERE class = ? AND end_s - start_s > ?",
+                           (4, 2.0)).fetchall()
+    assert 'damage_event_class' in plan[0][3]
+
+    manager.delete_test_entry_by_name('unsaved')
+    assert manager.list_damage_events() == []
+
+    manager.delete_test_entry_by_name('saved')
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
 """ Test Function Template
 
 def test_():
@@ -1 +1,166 @@
 import pytest
+import os
+import sys
+import numpy as np
+
+sys.path.append('src')
+import settings
+import sensors
+
+
+def test_capture_buffer_single_segment():
+
+    buffer = sensors._CaptureBuffer(channels=2, dtype=np.float32, segment_frames=100)
+    blocks = [np.full((10, 2), i, dtype=np.float32) for i in range(5)]
+    for block in blocks:
+        buffer.write(block)
+
+    data = buffer.get_data()
+    assert data.shape == (50, 2)
+    assert np.array_equal(data, np.concatenate(blocks))
+
+    # handed out without copying
+    assert np.shares_memory(data, buffer._segments[0])
+    assert buffer.block_count == 5
+    assert buffer.bytes_captured == 50 * 2 * 4
+
+
+def test_capture_buffer_grows():
+
+    buffer = sensors._CaptureBuffer(channels=1, dtype=np.float32, segment_frames=16)
+    blocks = [np.arange(i * 7, (i + 1) * 7, dtype=np.float32).reshape(-1, 1) for i in range(10)]
+
+    stored = []
+    for block in blocks:
+        stored += buffer.write(block)
+
+    # blocks crossing a segment boundary come back in two pieces
+    assert len(stored) > len(blocks)
+    assert np.array_equal(np.concatenate(stored), np.concatenate(blocks))
+    assert not stored[0].flags.writeable
+
+    data = buffer.get_data()
+    assert np.array_equal(data, np.concatenate(blocks))
+    assert buffer.get_data() is not data
+    assert np.shares_memory(buffer.get_data(), data)
+
+
+def test_trigger_capture_alignment():
+
+    # samples 10 ms apart with one late sample
+    timestamps = np.array([5.00, 5.01, 5.02, 5.05, 5.06])
+    values = np.array([0.0, 0.5, np.nan, 1.0, 1.0])
+    capture = sensors.TriggerCapture(timestamps, values, sample_period=0.01)
+
+    assert capture.sample_rate == pytest.approx(4 / 0.06)
+
+    jitter = capture.jitter()
+    assert jitter.max_interval == pytest.approx(0.03)
+    assert jitter.mean_interval == pytest.approx(0.015)
+
+    # audio starting 10 ms after the first trigger sample, at 200 Hz
+    aligned = capture.align(start_time=5.01, sample_rate=200, num_frames=12)
+    assert aligned[0] == pytest.approx(0.5)
+    assert aligned[1] == pytest.approx(0.25)
+    assert aligned[2] == pytest.approx(0.0)
+    assert aligned[8] == pytest.approx(1.0)
+    assert aligned[11] == pytest.approx(1.0)
+
+
+def test_detection_uses_capture_time():
+    '''Test that queued blocks are scored with the trigger at the time they were captured.'''
+
+    import signal_processor as processor
+    from queue import Queue
+
+    sample_rate = 100
+    # trigger switched on at t = 12 s, read long after that
+    read_trigger_at = lambda times: (times >= 12.0).astype(float)
+
+    block_queue = Queue()
+    detector = processor.StreamingDamageDetector(sample_rate)
+    conditioner = processor.TriggerConditioner(on_threshold=0.5, debounce_frames=30, full_scale=1)
+    thread = sensors._DetectionThread(detector, block_queue, read_trigger_at, conditioner, Queue())
+
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 0.05, (10 * sample_rate, 2))
+    for start in range(0, len(audio), 50):
+        block_queue.put((audio[start:start + 50], 10.0 + start / sample_rate))
+
+    thread.start()
+    thread.stop()
+    thread.join()
+
+    trigger = np.zeros(len(audio))
+    trigger[2 * sample_rate:] = 1
+    _, expected = processor.score_damage(processor.detect_damage_analytically(audio, sample_rate),
+                                         trigger, sample_rate)
+    assert detector.flush() == expected
+
+
+class _FakeRecorder:
+    '''Stands in for the devices, which are not attached during tests.'''
+
+    opened = []
+
+    def __init__(self):
+        self.ready = True
+        self.is_recording = False
+        self.closed = False
+        self.settings = sensors._device_settings()
+        _FakeRecorder.opened.append(self)
+
+    def close(self):
+        self.closed = True
+
+
+def test_device_manager_sessions():
+    '''Test that the devices are opened once for all sessions and reopened when their settings change.'''
+
+    settings.configure_setting('trigger_port', 'COM4')
+    _FakeRecorder.opened = []
+    manager = sensors.DeviceManager(open_recorder=_FakeRecorder)
+
+    # nothing is opened before the first session
+    assert manager.recorder is None
+    assert not manager.reconnect()
+
+    first = manager.acquire()
+    second = manager.acquire()
+    assert len(_FakeRecorder.opened) == 1
+    assert first.recorder is second.recorder
+    assert manager.session_count == 2
+
+    # unchanged settings keep the devices open
+    assert not manager.reconnect()
+
+    # changed settings reopen them for every session
+    settings.configure_setting('trigger_port', 'COM9')
+    old_recorder = first.recorder
+    assert manager.reconnect()
+    assert old_recorder.closed
+    assert first.recorder is second.recorder
+    assert first.recorder.settings[0] == 'COM9'
+
+    # not while a recording is in progress
+    first.recorder.is_recording = True
+    with pytest.raises(sensors.DeviceError):
+        manager.reconnect(force=True)
+    first.recorder.is_recording = False
+
+    # the devices are closed with the last session
+    recorder = first.recorder
+    first.release()
+    first.release()
+    assert not recorder.closed
+    assert not first.ready
+    with pytest.raises(sensors.DeviceError):
+        first.recorder
+
+    with second:
+        assert second.ready
+    assert recorder.closed
+    assert manager.recorder is None
+    assert manager.session_count == 0
+
+    os.remove(settings._CONFIG_FILE_PATH)
@@ -0,0 +1,98 @@
+import pytest
+import sys
+import numpy as np
+
+sys.path.append('src')
+import signal_processor as processor
+from processing import (
+    ProcessingExecutor,
+    ProcessingJob,
+    ProcessingCancelled,
+    process_recording,
+    detector_params
+)
+from storage import DmgData
+
+
+def _recording(seconds: int, sample_rate: int = 100) -> DmgData:
+    '''Quiet audio with a loud burst while the trigger is on, and after.'''
+
+    rng = np.random.default_rng(seconds)
+    audio = rng.normal(0, 0.05, (seconds * sample_rate, 2))
+    audio[4 * sample_rate:8 * sample_rate] *= 20
+    trigger = np.zeros((seconds * sample_rate, 1))
+    trigger[3 * sample_rate:6 * sample_rate] = 1
+
+    data = DmgData()
+    data.sample_rate = sample_rate
+    data.audio_data = audio
+    data.trigger_data = trigger
+    return data
+
+
+def test_process_recording_matches_batch():
+    '''Test that processing in blocks gives the batch results and reports progress.'''
+
+    data = _recording(30)
+    dmg_detections = processor.detect_damage_analytically(data.audio_data, data.sample_rate)
+    _, consecutive_scores = processor.score_damage(dmg_detections, data.trigger_data, data.sample_rate)
+
+    fractions = []
+    result = process_recording(data, 'ANALYTICAL', progress=fractions.append, block_seconds=4)
+
+    assert np.array_equal(result.dmg_detections, dmg_detections)
+    assert result.consecutive_scores == consecutive_scores
+    assert fractions == sorted(fractions)
+    assert len(fractions) == 9 and fractions[-1] == 1.0
+
+    # stopped between two blocks once cancelled
+    with pytest.raises(ProcessingCancelled):
+        process_recording(data, 'ANALYTICAL', progress=fractions.append,
+                          cancelled=lambda: fractions[-1] > 0.5, block_seconds=4)
+
+    with pytest.raises(ValueError):
+        process_recording(data, 'SOMETHING_ELSE')
+
+
+def test_detector_params():
+    '''Test that the stored parameters are the ones the detectors run with.'''
+
+    assert detector_params('ANALYTICAL') == {'threshold': processor.DAMAGE_THRESHOLD}
+    assert processor.StreamingDamageDetector(100).threshold == processor.DAMAGE_THRESHOLD
+    assert detector_params('MACHINE_LEARNING') == {}
+
+
+def test_processing_executor():
+    '''Test that queued jobs are processed in order with callbacks delivered on dispatch.'''
+
+    executor = ProcessingExecutor(block_seconds=5)
+    delivered = []
+    jobs = [executor.submit(_recording(seconds), 'ANALYTICAL', context=seconds,
+                            on_progress=lambda job: delivered.append(('progress', job.context)),
+                            on_finished=lambda job: delivered.append(('finished', job.context)))
+            for seconds in (10, 20)]
+    failing = executor.submit(_recording(10), 'MACHINE_LEARNING', on_finished=lambda job: None)
+
+    for job in jobs + [failing]: assert job.wait(10)
+    assert executor.pending == []
+
+    # nothing is called from the worker threads
+    assert delivered == []
+    executor.dispatch_callbacks()
+    assert [entry for entry in delivered if entry[0] == 'finished'] == [('finished', 10), ('finished', 20)]
+    assert delivered.index(('finished', 10)) < delivered.index(('progress', 20))
+
+    assert [job.state for job in jobs] == [ProcessingJob.DONE, ProcessingJob.DONE]
+    assert jobs[1].progress == 1.0
+    assert failing.state == ProcessingJob.FAILED and failing.error is not None
+
+    # a job cancelled while queued never runs
+    long_job = executor.submit(_recording(2000), 'ANALYTICAL')
+    queued_job = executor.submit(_recording(10), 'ANALYTICAL')
+    queued_job.cancel()
+    long_job.cancel()
+    assert queued_job.wait(10) and long_job.wait(10)
+    assert queued_job.state == ProcessingJob.CANCELLED
+    assert queued_job.result is None and queued_job.progress == 0.0
+
+    executor.shutdown(wait=True)
@@ -0,0 +1,69 @@
+import pytest
+import sys
+import numpy as np
+from scipy.signal import resample_poly
+
+sys.path.append('src')
+import resampling
+
+
+def test_rate_ratio():
+
+    assert resampling.rate_ratio(44100, 48000) == (160, 147)
+    assert resampling.rate_ratio(1000, 48000) == (48, 1)
+    assert resampling.rate_ratio(48000, 48000) == (1, 1)
+
+    # measured rates are approximated
+    up, down = resampling.rate_ratio(998.7, 48000)
+    assert down <= 1000
+    assert up / down == pytest.approx(48000 / 998.7, rel=1e-5)
+
+    with pytest.raises(ValueError):
+        resampling.rate_ratio(0, 48000)
+
+
+def test_resample_matches_resample_poly():
+
+    rng = np.random.default_rng(0)
+    audio = rng.normal(0, 0.1, (4410, 2))
+
+    resampled = resampling.resample(audio, 44100, 48000)
+
+    assert resampled.shape == (4800, 2)
+    assert np.allclose(resampled, resample_poly(audio, 160, 147, axis=0))
+
+    # the filter is only designed once per ratio
+    resampling._polyphase_filter.cache_clear()
+    resampling.resample(audio, 44100, 48000)
+    resampling.resample(audio[:100], 44100, 48000)
+    assert resampling._polyphase_filter.cache_info().hits == 1
+
+
+def test_resample_leaves_matching_rate_untouched():
+
+    audio = np.zeros((100, 2), dtype=np.float32)
+    assert resampling.resample(audio, 48000, 48000) is audio
+
+    trigger = np.zeros(10)
+    resampled_trigger, resampled_audio, common_sr = resampling.match_signals(trigger, 1000, audio, 48000)
+    assert resampled_audio is audio
+    assert len(resampled_trigger) == 480
+    assert common_sr == 48000
+
+
+def test_interpolate():
+
+    trigger = np.array([0.0, 1.0, 1.0, 0.0])
+
+    held = resampling.interpolate(trigger, 2, 4, method='hold')
+    assert list(held) == [0, 0, 1, 1, 1, 1, 0, 0]
+
+    linear = resampling.interpolate(trigger, 2, 4)
+    assert list(linear) == [0, 0.5, 1, 1, 1, 0.5, 0, 0]
+
+    # columns are interpolated independently
+    columns = resampling.interpolate(np.stack((trigger, 1 - trigger), axis=1), 2, 4, num_samples=3)
+    assert columns.tolist() == [[0, 1], [0.5, 0.5], [1, 0]]
+
+    with pytest.raises(ValueError):
+        resampling.interpolate(trigger, 2, 4, method='cubic')
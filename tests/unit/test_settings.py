@@ -1,2 +1,77 @@
 import pytest
+import os
+import sys
+import yaml
 
+sys.path.append('src')
+import settings
+
+
+def test_settings_are_cached_until_the_file_changes(monkeypatch):
+    '''Test that the config file is only parsed again after it changed on disk.'''
+
+    settings.__init__()
+    settings.configure_setting('trigger_port', 'COM7')
+
+    loads = []
+    original_load = yaml.safe_load
+    monkeypatch.setattr(yaml, 'safe_load', lambda file: loads.append(1) or original_load(file))
+
+    # settings written by this process are already cached
+    for _ in range(10):
+        assert settings.get_setting('trigger_port') == 'COM7'
+    assert loads == []
+
+    # an edit made outside of settings.py is picked up
+    with open(settings._CONFIG_FILE_PATH, 'r') as file:
+        values = yaml.load(file, Loader=yaml.SafeLoader)
+    values['trigger_port'] = 'COM12'
+    with open(settings._CONFIG_FILE_PATH, 'w') as file:
+        yaml.dump(values, file)
+
+    assert settings.get_setting('trigger_port') == 'COM12'
+    assert settings.get_setting('trigger_port') == 'COM12'
+    assert len(loads) == 1
+
+    # a deleted config file is recreated with the defaults
+    os.remove(settings._CONFIG_FILE_PATH)
+    assert settings.get_setting('trigger_port') == settings._DEFAULT_SETTINGS['trigger_port']
+    assert os.path.isfile(settings._CONFIG_FILE_PATH)
+
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+def test_configure_settings(monkeypatch):
+    '''Test that several settings are written at once, atomically, and read back typed.'''
+
+    settings.__init__()
+
+    replaced = []
+    original_replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda src, dst: replaced.append(dst) or original_replace(src, dst))
+
+    settings.configure_settings({'audio_device_id': 3,
+                                 'record_to_disk': True,
+                                 'trigger_on_threshold': '250.5'})
+
+    # one write, renamed over the config file
+    assert replaced == [settings._CONFIG_FILE_PATH]
+    assert not os.path.exists(settings._CONFIG_FILE_PATH + '.tmp')
+
+    # other settings are kept, values are stored as strings
+    values = settings._get_settings()
+    assert values['audio_device_id'] == '3'
+    assert values['record_to_disk'] == 'True'
+    assert values['process_mode'] == settings._DEFAULT_SETTINGS['process_mode']
+
+    config = settings.get_settings()
+    assert config.audio_device_id == 3
+    assert config.record_to_disk is True
+    assert config.trigger_on_threshold == 250.5
+
+    # values that cannot be converted fall back to the default
+    settings.configure_setting('audio_channels', 'stereo')
+    assert settings.get_setting('audio_channels') == 'stereo'
+    assert settings.get_settings().audio_channels == int(settings._DEFAULT_SETTINGS['audio_channels'])
+
+    os.remove(settings._CONFIG_FILE_PATH)
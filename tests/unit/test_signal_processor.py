@@ -1 +1,396 @@
 import pytest
+import sys
+import numpy as np
+
+sys.path.append('src')
+import signal_processor as processor
+
+
+def _reference_detect_damage(audio_data, audio_sample_rate, threshold=0.225):
+    '''Original per-chunk implementation of detect_damage_analytically, kept
+    here to check the vectorized version against.'''
+
+    frames_per_qtr_sec = int(0.2 * audio_sample_rate)
+    start_index = int(0.4 * audio_sample_rate)
+    dmg_detections = np.zeros(len(audio_data), dtype=int)
+    amp_threshold = .002
+    for i in range(start_index, len(audio_data), frames_per_qtr_sec):
+        chunk = audio_data[i:i+frames_per_qtr_sec]
+        chunk_mean = np.mean(np.abs(chunk))
+        if chunk_mean < amp_threshold:
+            dmg_detections[i:i+frames_per_qtr_sec] = 0
+            continue
+        if i >= start_index + frames_per_qtr_sec:
+            avg_amplitude = np.mean(np.abs(audio_data[start_index:i]))
+            if abs(chunk_mean - avg_amplitude) > threshold * avg_amplitude:
+                for j in range(i, min(i + frames_per_qtr_sec, len(audio_data))):
+                    dmg_detections[j] = 1
+    return dmg_detections
+
+
+def _bursty_audio(seed, num_samples, channels=None):
+    '''Quiet background noise with a handful of loud and silent bursts.'''
+
+    rng = np.random.default_rng(seed)
+    shape = (num_samples,) if channels is None else (num_samples, channels)
+    audio = rng.normal(0, 0.05, shape)
+    for _ in range(8):
+        start = rng.integers(0, num_samples)
+        length = rng.integers(1, num_samples // 10 + 2)
+        audio[start:start+length] *= rng.choice([0.0, 0.01, 3.0, 10.0])
+    return audio
+
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('sample_rate', [100, 441, 1000])
+def test_detect_damage_analytically_matches_reference(seed, sample_rate):
+
+    audio = _bursty_audio(seed, sample_rate * 7 + seed * 13)
+
+    expected = _reference_detect_damage(audio, sample_rate)
+    detections = processor.detect_damage_analytically(audio, sample_rate)
+
+    assert detections.shape == expected.shape
+    assert np.array_equal(detections, expected)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_detect_damage_analytically_multichannel(seed):
+
+    audio = _bursty_audio(seed, 5003, channels=2)
+
+    expected = _reference_detect_damage(audio, 500)
+    detections = processor.detect_damage_analytically(audio, 500)
+
+    assert np.array_equal(detections, expected)
+
+
+def test_detect_damage_analytically_short_sample():
+
+    # shorter than the 0.4 second lead in
+    audio = np.ones(30)
+    assert np.array_equal(processor.detect_damage_analytically(audio, 100), np.zeros(30))
+
+    # lead in plus a single partial chunk
+    audio = np.ones(45)
+    assert np.array_equal(processor.detect_damage_analytically(audio, 100),
+                          _reference_detect_damage(audio, 100))
+
+
+def _reference_score_damage(dmg_detections, trigger_detections, sampleRate):
+    '''Original per-sample implementation of score_damage, kept here to check
+    the vectorized version against.'''
+
+    damage_score = np.zeros(len(dmg_detections))
+    trigger_noise = 0
+    trigger_on = False
+    trigger_on_frame = -1
+    trigger_off_frame = -1
+    duration_of_test = len(dmg_detections)/sampleRate
+
+    for i in range(len(dmg_detections)):
+        if trigger_detections[i] == 1:
+            trigger_on = True
+            trigger_on_frame = i
+        if trigger_detections[i] == 0:
+            trigger_on = False
+        if i >= 2 and trigger_detections[i] == 0 and trigger_detections[i-1] == 1:
+            trigger_noise += 1
+            trigger_off_frame = i
+        if(trigger_off_frame > 0):
+            time_from_off_frame = ((i/sampleRate) - (trigger_off_frame/sampleRate))
+
+        if dmg_detections[i] == 0 and not trigger_on and trigger_off_frame < 0:
+            damage_score[i] = 0
+        elif dmg_detections[i] == 0 and trigger_on:
+            damage_score[i] = 1
+        elif dmg_detections[i] == 0 and not trigger_on and i - trigger_on_frame > 1 and time_from_off_frame < 5:
+            damage_score[i] = 2
+        elif dmg_detections[i] == 1 and not trigger_on and time_from_off_frame >= 5:
+            damage_score[i] = 4
+        elif dmg_detections[i] == 1 and not trigger_on:
+            damage_score[i] = 3
+
+    if(trigger_noise > 0):
+        trigger_noise = 100 - (trigger_noise*2)
+        damage_score[0] = trigger_noise
+
+    consecutive_scores = []
+    start_index = 0
+    for i in range(1, len(damage_score)):
+        if damage_score[i] != damage_score[i-1]:
+            if start_index != i - 1:
+                consecutive_scores.append((start_index/sampleRate, i/sampleRate, damage_score[start_index]))
+            start_index = i
+    if start_index != len(damage_score) - 1:
+        consecutive_scores.append((start_index/sampleRate, duration_of_test, damage_score[start_index]))
+
+    return damage_score, consecutive_scores
+
+
+def _firing_run(seed, sample_rate, seconds):
+    '''Random trigger pulses with damage that starts after the first trigger
+    release (the reference loop cannot score damage before that point).'''
+
+    rng = np.random.default_rng(seed)
+    n = sample_rate * seconds
+    trigger = np.zeros(n, dtype=int)
+    dmg = np.zeros(n, dtype=int)
+
+    position = rng.integers(2, sample_rate)
+    while position < n:
+        length = rng.integers(1, 2 * sample_rate)
+        trigger[position:position+length] = 1
+        position += length + rng.integers(1, 8 * sample_rate)
+
+    first_off = np.flatnonzero((trigger[1:-1] == 1) & (trigger[2:] == 0))[0] + 2
+    for _ in range(6):
+        start = rng.integers(first_off, n)
+        dmg[start:start + rng.integers(1, 10 * sample_rate)] = 1
+
+    return dmg, trigger
+
+
+def _assert_same_scores(actual, expected):
+    assert np.array_equal(actual[0], expected[0])
+    assert len(actual[1]) == len(expected[1])
+    for actual_range, expected_range in zip(actual[1], expected[1]):
+        assert actual_range == expected_range
+
+
+def test_score_damage_examples():
+
+    # examples from signal_processor.main(), sampled at 5 Hz
+    dmg_detections = np.array([0]*9 + [1]*50)
+    trigger_detections = np.array([0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 0, 0, 1, 0, 1, 1] + [0]*40)
+    _assert_same_scores(processor.score_damage(dmg_detections, trigger_detections, 5),
+                        _reference_score_damage(dmg_detections, trigger_detections, 5))
+
+    dmg_detections = np.zeros(29, dtype=int)
+    trigger_detections = np.array([0]*10 + [1]*11 + [0]*8)
+    _assert_same_scores(processor.score_damage(dmg_detections, trigger_detections, 5),
+                        _reference_score_damage(dmg_detections, trigger_detections, 5))
+
+
+def test_score_damage_trigger_noise():
+
+    # four on-to-off transitions -> 100 - 4*2
+    trigger = np.array([0, 1, 0, 1, 1, 0, 1, 0, 0, 1, 0, 0, 0])
+    dmg = np.zeros(len(trigger), dtype=int)
+    damage_score, _ = processor.score_damage(dmg, trigger, 2)
+    assert damage_score[0] == 92
+    assert damage_score[0] == _reference_score_damage(dmg, trigger, 2)[0][0]
+
+    # transition at frame 1 is not counted, so frame 0 keeps its class
+    trigger = np.array([1, 0, 0, 0])
+    damage_score, _ = processor.score_damage(np.zeros(4, dtype=int), trigger, 2)
+    assert damage_score[0] == 1
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('sample_rate', [5, 50, 200])
+def test_score_damage_matches_reference(seed, sample_rate):
+
+    dmg, trigger = _firing_run(seed, sample_rate, 40)
+
+    _assert_same_scores(processor.score_damage(dmg, trigger, sample_rate),
+                        _reference_score_damage(dmg, trigger, sample_rate))
+
+
+def test_score_damage_accepts_column_trigger():
+
+    dmg, trigger = _firing_run(0, 50, 20)
+    column_trigger = trigger.reshape(-1, 1).astype(float)
+
+    _assert_same_scores(processor.score_damage(dmg, column_trigger, 50),
+                        _reference_score_damage(dmg, trigger, 50))
+
+
+def test_score_damage_damage_before_first_release():
+
+    # damage with the trigger off before any on-to-off edge stays at class 0
+    dmg = np.array([1, 1, 1, 0, 0, 0, 1, 1])
+    trigger = np.array([0, 0, 0, 1, 1, 0, 0, 0])
+    damage_score, _ = processor.score_damage(dmg, trigger, 1)
+    assert list(damage_score[1:3]) == [0, 0]
+    assert list(damage_score[6:8]) == [3, 3]
+
+
+def test_score_damage_size_mismatch():
+
+    with pytest.raises(ValueError):
+        processor.score_damage(np.zeros(3), np.zeros(4), 1)
+
+
+def _push_in_blocks(detector, audio, trigger, seed):
+    '''Feed a recording to the detector in randomly sized blocks.'''
+
+    rng = np.random.default_rng(seed)
+    ranges = []
+    position = 0
+    while position < len(audio):
+        size = int(rng.integers(1, 400))
+        ranges += detector.push(audio[position:position+size], trigger[position:position+size])
+        position += size
+    return ranges
+
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('channels', [None, 2])
+def test_streaming_detector_matches_batch(seed, channels):
+
+    sample_rate = 500
+    audio = _bursty_audio(seed, sample_rate * 30 + seed, channels=channels)
+    _, trigger = _firing_run(seed, sample_rate, 30)
+    trigger = np.append(trigger, np.zeros(seed, dtype=int))
+
+    detector = processor.StreamingDamageDetector(sample_rate)
+    live_ranges = _push_in_blocks(detector, audio, trigger, seed)
+    final_ranges = detector.flush()
+
+    dmg_detections = processor.detect_damage_analytically(audio, sample_rate)
+    _, consecutive_scores = processor.score_damage(dmg_detections, trigger, sample_rate)
+
+    assert np.array_equal(detector.get_detections(), dmg_detections)
+    assert final_ranges == consecutive_scores
+
+    # ranges reported while recording are final apart from the one holding frame 0
+    for live_range in live_ranges[1:]:
+        assert live_range in consecutive_scores
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_block_detector_and_scorer_match_batch(seed):
+
+    sample_rate = 300
+    audio = _bursty_audio(seed, sample_rate * 20 + seed)
+    _, trigger = _firing_run(seed, sample_rate, 20)
+    trigger = np.append(trigger, np.zeros(seed, dtype=int))
+
+    dmg_detections = processor.detect_damage_analytically(audio, sample_rate)
+    _, consecutive_scores = processor.score_damage(dmg_detections, trigger, sample_rate)
+
+    rng = np.random.default_rng(seed)
+    boundaries = np.sort(rng.integers(0, len(audio), 12))
+    detector = processor.BlockDamageDetector(sample_rate)
+    blocks = [detector.push(block) for block in np.split(audio, boundaries)] + [detector.flush()]
+    assert np.array_equal(np.concatenate(blocks), dmg_detections)
+    assert np.array_equal(detector.get_detections(), dmg_detections)
+
+    scorer = processor.BlockDamageScorer(sample_rate)
+    for dmg_block, trigger_block in zip(np.split(dmg_detections, boundaries), np.split(trigger, boundaries)):
+        scorer.push(dmg_block, trigger_block)
+    assert scorer.frames_scored == len(audio)
+    assert scorer.finish() == consecutive_scores
+
+
+def test_streaming_detector_reports_during_capture():
+
+    sample_rate = 100
+    audio = np.full(sample_rate * 10, 0.05)
+    audio[sample_rate * 6:] = 1.0
+
+    detector = processor.StreamingDamageDetector(sample_rate)
+    assert detector.push(audio[:sample_rate * 5]) == []
+    assert detector.current_class == 0
+
+    # damage is scored within one chunk of being pushed, trigger never released
+    detector.push(audio[sample_rate * 5:sample_rate * 7])
+    assert detector.get_detections()[sample_rate * 6] == 1
+    assert len(detector.get_detections()) > sample_rate * 6
+
+    with pytest.raises(Exception):
+        detector.flush()
+        detector.push(audio[:10])
+
+
+def test_streaming_detector_short_recording():
+
+    detector = processor.StreamingDamageDetector(100)
+    detector.push(np.ones(30))
+    assert detector.flush() == processor.score_damage(np.zeros(30), np.zeros(30), 100)[1]
+    assert np.array_equal(detector.get_detections(), np.zeros(30))
+
+
+def _reference_binarize_trigger(tdata):
+    '''Original per-value trigger conversion from sensors.Recorder.get_data.'''
+
+    b_tdata = []
+    for value in tdata:
+        if value:
+            value = value * 1023
+            if value < 300:
+                value = 0
+            else:
+                value = 1
+        else:
+            value = 0
+        b_tdata.append(value)
+    return np.array(b_tdata)
+
+
+def test_condition_trigger_matches_reference():
+
+    rng = np.random.default_rng(0)
+    tdata = list(rng.uniform(0, 1, 5000) ** 3)
+    tdata[10:20] = [None] * 10
+
+    trigger = processor.condition_trigger(tdata)
+
+    assert np.array_equal(trigger.states, _reference_binarize_trigger(tdata))
+    assert np.array_equal(processor.trigger_from_edges(trigger.rising_edges, trigger.falling_edges, len(trigger)),
+                          trigger.states)
+
+
+def test_condition_trigger_hysteresis_and_debounce():
+
+    # readings already in pin counts
+    raw = np.array([0, 350, 250, 250, 150, 250, 350, 350, 350, 100, 100, 100, 100])
+
+    trigger = processor.condition_trigger(raw, on_threshold=300, off_threshold=200, full_scale=1)
+    assert list(trigger.states) == [0, 1, 1, 1, 0, 0, 1, 1, 1, 0, 0, 0, 0]
+    assert list(trigger.rising_edges) == [1, 6]
+    assert list(trigger.falling_edges) == [4, 9]
+
+    # the two frame release is too short to be accepted
+    trigger = processor.condition_trigger(raw, on_threshold=300, off_threshold=200,
+                                          debounce_frames=3, full_scale=1)
+    assert list(trigger.states) == [0, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0]
+    assert list(trigger.rising_edges) == [1]
+    assert list(trigger.falling_edges) == [9]
+
+    with pytest.raises(ValueError):
+        processor.condition_trigger(raw, on_threshold=200, off_threshold=300)
+
+
+def test_trigger_conditioner_matches_condition_trigger():
+    '''Test that conditioning in blocks of any size gives the whole-recording states.'''
+
+    rng = np.random.default_rng(3)
+    raw = np.repeat(rng.choice([0.1, 0.25, 0.35, np.nan], 400), rng.integers(1, 12, 400))
+
+    for debounce_frames in (0, 5, 30):
+        expected = processor.condition_trigger(raw, on_threshold=300, off_threshold=200,
+                                               debounce_frames=debounce_frames).states
+
+        conditioner = processor.TriggerConditioner(on_threshold=300, off_threshold=200,
+                                                   debounce_frames=debounce_frames)
+        states, start = [], 0
+        while start < len(raw):
+            stop = start + int(rng.integers(0, 40))
+            states.append(conditioner.push(raw[start:stop]))
+            start = stop
+        states.append(conditioner.flush())
+
+        assert np.array_equal(np.concatenate(states), expected)
+
+
+def test_score_damage_accepts_trigger_signal():
+
+    dmg, trigger = _firing_run(1, 50, 20)
+    trigger_signal = processor.condition_trigger(trigger, on_threshold=0.5, full_scale=1)
+
+    # scored from the edges alone
+    trigger_signal.states = np.zeros(len(trigger))
+    _assert_same_scores(processor.score_damage(dmg, trigger_signal, 50),
+                        _reference_score_damage(dmg, trigger, 50))
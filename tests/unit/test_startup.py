@@ -0,0 +1,69 @@
+import pytest
+import os
+import sys
+import subprocess
+import ast
+
+sys.path.append('src')
+import settings
+
+
+# cumulative 'python -X importtime' budget for the modules the app starts with
+IMPORT_BUDGET_S = 1.0
+
+# loaded only when they are needed: plotting, old files, resampling, devices
+DEFERRED_MODULES = ('matplotlib', 'scipy.signal', 'scipy.io', 'taglib', 'sounddevice', 'pyfirmata')
+
+
+def _import(modules: str):
+    '''Import 'modules' in a fresh interpreter under -X importtime.
+
+    Return
+    ------
+    loaded: list
+        DEFERRED_MODULES that the import loaded
+    times: dict
+        Cumulative import time in seconds of every module imported
+    '''
+
+    code = ("import sys; sys.path.append('src'); import {}; "
+            "print([name for name in {!r} if name in sys.modules])").format(modules, DEFERRED_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(cumulative) / 1e6
+
+    return ast.literal_eval(result.stdout.strip().splitlines()[-1]), times
+
+
+def test_imports_have_no_side_effects():
+    '''Test that importing the modules creates no files and loads no heavy dependencies.'''
+
+    default_location = settings._DEFAULT_SETTINGS['save_location']
+    paths = (settings._CONFIG_FILE_PATH, default_location)
+    existed = [os.path.exists(path) for path in paths]
+
+    loaded, times = _import('settings, storage, signal_processor, resampling, tag_query, sensors, processing')
+
+    assert [os.path.exists(path) for path in paths] == existed
+    assert loaded == []
+
+    total = sum(times[name] for name in ('settings', 'storage', 'signal_processor', 'sensors'))
+    assert total < IMPORT_BUDGET_S
+
+
+def test_gui_import_has_no_side_effects():
+    '''Test that importing the GUI neither opens devices nor loads heavy dependencies.'''
+
+    pytest.importorskip('customtkinter')
+
+    existed = os.path.exists(settings._CONFIG_FILE_PATH)
+    loaded, times = _import('controller')
+
+    assert os.path.exists(settings._CONFIG_FILE_PATH) == existed
+    assert loaded == []
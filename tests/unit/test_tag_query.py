@@ -0,0 +1,124 @@
+import pytest
+import os
+import sys
+import random
+import datetime
+
+sys.path.append('src')
+import settings
+import storage as db
+import tag_query
+from tag_query import TagTerm, DateTerm, NotExpression, AndExpression, OrExpression
+
+TEST_SAVE_LOCATION = 'tests/unit/testdb'
+
+
+def test_parse():
+
+    expression = tag_query.parse('(range-A OR range-B) AND drill AND NOT calibration')
+    assert expression == AndExpression([OrExpression([TagTerm('range-A'), TagTerm('range-B')]),
+                                        TagTerm('drill'),
+                                        NotExpression(TagTerm('calibration'))])
+
+    # implied AND, AND binds tighter than OR, quoted tags and lower case keywords
+    assert tag_query.parse('a b or "wet floor" and not "or"') == \
+        OrExpression([AndExpression([TagTerm('a'), TagTerm('b')]),
+                      AndExpression([TagTerm('wet floor'), NotExpression(TagTerm('or'))])])
+
+    assert tag_query.parse('created>=2024-01-02') == DateTerm('>=', datetime.datetime(2024, 1, 2), True)
+    assert tag_query.parse('created < 2024-01-02T10:30') == DateTerm('<', datetime.datetime(2024, 1, 2, 10, 30))
+
+
+@pytest.mark.parametrize('query', ['', 'a AND', '(a OR b', 'a)', 'NOT', 'created >= soon', 'a OR OR b', '"open'])
+def test_parse_errors(query):
+
+    with pytest.raises(tag_query.TagQueryError):
+        tag_query.parse(query)
+
+
+def _evaluate(expression, tags: set, created: datetime.datetime) -> bool:
+    '''Reference evaluation of an expression for one test.'''
+
+    if isinstance(expression, TagTerm):
+        return expression.value in tags
+    if isinstance(expression, NotExpression):
+        return not _evaluate(expression.operand, tags, created)
+    if isinstance(expression, AndExpression):
+        return all(_evaluate(operand, tags, created) for operand in expression.operands)
+    if isinstance(expression, OrExpression):
+        return any(_evaluate(operand, tags, created) for operand in expression.operands)
+
+    day = expression.value
+    if expression.whole_day:
+        created = created.replace(hour=0, minute=0, second=0, microsecond=0)
+    return {'>=': created >= day, '<=': created <= day, '>': created > day,
+            '<': created < day, '=': created == day}[expression.operator]
+
+
+@pytest.fixture
+def populated_manager():
+
+    settings.__init__()
+    db.configure(save_location=TEST_SAVE_LOCATION, database_file_name='test.db')
+    manager = db.DatabaseManager()
+
+    rng = random.Random(0)
+    tags = ['range-A', 'range-B', 'drill', 'calibration', 'wet floor']
+    tests = {}
+
+    with manager.transaction() as con:
+        for i in range(200):
+            created = datetime.datetime(2024, 1, 1) + datetime.timedelta(hours=rng.randrange(24 * 90))
+            test_id, _ = db._create_test(con, 'test{}'.format(i), created, '')
+            test_tags = set(rng.sample(tags, rng.randrange(len(tags) + 1)))
+            db._update_tag_links(con, test_id, list(test_tags))
+            tests[test_id] = (test_tags, created)
+
+    yield manager, tests
+
+    manager.close()
+    os.remove(os.path.join(TEST_SAVE_LOCATION, 'db/test.db'))
+    os.remove(settings._CONFIG_FILE_PATH)
+
+
+QUERIES = [
+    'drill',
+    '(range-A OR range-B) AND drill AND NOT calibration',
+    'NOT (drill OR "wet floor")',
+    'range-A range-B NOT NOT calibration',
+    'drill AND created >= 2024-02-01 AND created < 2024-03-01',
+    'created <= 2024-01-15 OR created > 2024-03-20',
+    'created = 2024-02-10',
+    'created >= 2024-02-10T12:00 AND NOT drill',
+    'unknown OR calibration',
+]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_query_tests_matches_reference(populated_manager, query):
+
+    manager, tests = populated_manager
+    expression = tag_query.parse(query)
+    expected = [test_id for test_id, (tags, created) in sorted(tests.items())
+                if _evaluate(expression, tags, created)]
+
+    assert manager.query_tests(query, ids_only=True) == expected
+
+    entries = manager.query_tests(query)
+    assert [entry.id for entry in entries] == expected
+    for entry in entries:
+        assert set(entry.tags or []) == tests[entry.id][0]
+
+
+def test_query_uses_indexes(populated_manager):
+
+    manager, _ = populated_manager
+    condition, parameters = tag_query.compile_query(QUERIES[1] + ' AND created >= 2024-02-01')
+
+    with manager.transaction() as con:
+        plan = [row[3] for row in con.execute('EXPLAIN QUERY PLAN SELECT test.id FROM test WHERE ' + condition,
+                                              parameters).fetchall()]
+
+    assert not any(step.startswith('SCAN test_tag') or step.startswith('SCAN tag') for step in plan)
+    assert any('INDEX tag_value' in step for step in plan)
+    assert any('INDEX test_tag_tag_id' in step for step in plan)